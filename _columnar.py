@@ -0,0 +1,138 @@
+"""Columnar conversion of CSV rows, using NumPy.
+
+The amount and balance columns are loaded into NumPy arrays and parsed
+for all rows at once, dates are parsed once per distinct value, and the
+rules are matched once per distinct description (and values of any
+other fields they test). Each row's transaction is then made by
+RowPlan.build(), exactly as RowPlan.convert() would make it.
+"""
+import numpy as np
+import profiling
+from csv_importer import Transaction, parse_amount, parse_date, paused_gc
+
+__all__ = ['convert_rows']
+
+# Longest string of digits that always fits in an int64
+MAX_DIGITS = 18
+
+ZERO, NINE, DOT, PLUS, MINUS = map(ord, '09.+-')
+
+FIXED_FIELDS = {'account1', 'account2', 'currency'}
+COLUMN_FIELDS = {'date', 'amount', 'balance'}
+
+
+def column(rows, i):
+    return np.array([row[i] for row in rows], dtype=str)
+
+
+def parse_amounts(values):
+    """Return a list of the (units, places) of each of an array of amount
+    strings, or None for those that are not amounts.
+
+    Plain [sign]digits[.digits] amounts are converted by arithmetic on
+    the characters' code points; anything else is left to
+    parse_amount().
+    """
+    n = len(values)
+    text = np.char.strip(values)
+    if text.itemsize == 0:
+        return [None] * n
+    codes = text.view(np.uint32).reshape(n, -1)
+    inside = np.arange(codes.shape[1]) < np.char.str_len(text)[:, None]
+    digit = (codes >= ZERO) & (codes <= NINE)
+    dot = codes == DOT
+    sign = np.zeros_like(digit)
+    sign[:, 0] = (codes[:, 0] == PLUS) | (codes[:, 0] == MINUS)
+    ndigits = digit.sum(axis=1)
+    simple = (((digit | dot | sign) | ~inside).all(axis=1) &
+              (dot.sum(axis=1) <= 1) &
+              (ndigits > 0) & (ndigits <= MAX_DIGITS))
+
+    units = np.zeros(n, dtype=np.int64)
+    for j in range(codes.shape[1]):
+        units = np.where(digit[:, j], units * 10 + (codes[:, j] - ZERO),
+                         units)
+    units[codes[:, 0] == MINUS] *= -1
+    places = (digit & np.logical_or.accumulate(dot, axis=1)).sum(axis=1)
+    result = list(zip(units.tolist(), places.tolist()))
+
+    for i in np.flatnonzero(~simple).tolist():
+        try:
+            result[i] = parse_amount(str(values[i]))
+        except ValueError:
+            result[i] = None
+    return result
+
+
+def group(values):
+    """Return the distinct values of a list, and the position of each
+    value among them."""
+    positions = {}
+    inverse = [positions.setdefault(v, len(positions)) for v in values]
+    return list(positions), inverse
+
+
+def convert_rows(plan, rows):
+    """Yield (rule index, transaction) for each of a list of rows, as
+    plan.convert() would."""
+    if not rows:
+        return
+    needed = max(i for i in [plan._description, plan._date, plan._amount,
+                             plan._balance] + plan._conditions
+                 if i is not None)
+    if min(map(len, rows)) <= needed:
+        # Let the row-at-a-time path raise the same errors it would
+        for row in rows:
+            yield plan.convert(row)
+        return
+
+    with profiling.stage('parse columns'), paused_gc():
+        n = len(rows)
+        desc = plan._description
+        if plan._conditions:
+            # Rows are told apart by the other fields the rules test too
+            keys, inverse = group([(row[desc].lstrip('*'),
+                                    plan.condition_values(row))
+                                   for row in rows])
+            unique = [d for d, _ in keys]
+        else:
+            unique, inverse = group([row[desc].lstrip('*')
+                                     for row in rows])
+            keys = [(d,) for d in unique]
+        dates = amounts = balances = [None] * n
+        if plan._date is not None:
+            # Statements have few distinct dates, so parse each once
+            distinct, positions = group([row[plan._date] for row in rows])
+            parsed = [parse_date(d) for d in distinct]
+            dates = [parsed[j] for j in positions]
+        if plan._amount is not None:
+            amounts = parse_amounts(column(rows, plan._amount))
+        if plan._balance is not None:
+            balances = parse_amounts(column(rows, plan._balance))
+
+    resolved = [plan._resolve(*k) for k in keys]
+    # Rows won by a rule that sets everything but the columns need no
+    # more than a Transaction, when their date and amount are valid.
+    # Otherwise (and when profiling, which counts in build) they go
+    # through build like any other row.
+    fixed = [None] * len(unique)
+    if profiling.current is None:
+        for j, (index, constants, templates) in enumerate(resolved):
+            if not templates and constants.keys() >= FIXED_FIELDS and \
+                    constants.keys().isdisjoint(COLUMN_FIELDS):
+                fixed[j] = (index, constants['account1'],
+                            constants['account2'], constants['currency'],
+                            constants.get('description', unique[j]),
+                            constants.get('code'))
+
+    build = plan.build
+    for i, row in enumerate(rows):
+        j = inverse[i]
+        date, amount = dates[i], amounts[i]
+        if fixed[j] is not None and date is not None and amount is not None:
+            index, account1, account2, currency, desc, code = fixed[j]
+            yield index, Transaction(date, account1, account2, amount,
+                                     currency, desc, balances[i], code)
+        else:
+            yield build(row, unique[j], resolved[j], date, amount,
+                        balances[i])
@@ -0,0 +1,93 @@
+"""pyparsing grammar for journal files.
+
+The line parser in _ledger_parser is used by default; this module, and
+pyparsing with it, is only imported when the grammar is asked for.
+"""
+from functools import lru_cache
+import pyparsing
+from pyparsing import (ParserElement, OneOrMore, ZeroOrMore, Word, nums,
+                       alphas, Group, Combine, Optional, Regex, Suppress,
+                       restOfLine, LineStart, LineEnd, StringEnd)
+from _ledger_parser import CurrencyAmount, LedgerSyntaxError, ws
+
+__all__ = ['parse_file']
+
+
+@lru_cache(maxsize=None)
+def grammar():
+    """Build the journal grammar, once, on first use."""
+    ParserElement.setDefaultWhitespaceChars(ws)
+
+    EOL = LineEnd().suppress()
+    SOL = LineStart().leaveWhitespace()
+    blankline = SOL + LineEnd()
+
+    indentation = SOL + Word(ws).leaveWhitespace().suppress()
+
+    date = Combine(Word(nums, exact=4) + '-' +
+                   Word(nums, exact=2) + '-' +
+                   Word(nums, exact=2))
+
+    status = Word('*!', exact=1)
+    code = Regex(r'\(([^)\n]*)\)').setParseAction(
+        lambda tokens: tokens[0][1:-1])
+    description = Regex(r'[^;\n]*')
+    description.setParseAction(lambda tokens: tokens[0].strip())
+
+    # Account names may contain single spaces; two spaces or a tab end
+    # them.
+    accountName = Regex(r'[^;\s](?:[^;\s]| (?! ))*')
+    currency = Word(alphas + '£$')
+    number = Word(nums + '-.,')
+    amount = currency('currency') + number('value')
+    assertion = Suppress('=') + Group(currency('currency') +
+                                      number('value'))('assertion')
+    postingLine = (indentation +
+                   accountName('account') +
+                   Optional(amount)('amount') +
+                   Optional(assertion) + restOfLine + EOL)
+    postings = OneOrMore(Group(postingLine))
+
+    transaction = (date('date') +
+                   Optional(status)('status') +
+                   Optional(code)('code') +
+                   description('description') + EOL +
+                   Group(postings)('postings'))
+
+    # Main parser; an empty journal is a valid one
+    body = ZeroOrMore(Group(transaction) | EOL)
+    parser = body + StringEnd()
+    parser.ignore(blankline)
+    parser.ignore('#' + restOfLine)
+    parser.ignore(';' + restOfLine)
+    return parser
+
+
+def convert_transaction(transaction):
+    t = {'date': transaction['date'],
+         'status': transaction.get('status'),
+         'code': transaction.get('code'),
+         'description': transaction['description'],
+         'postings': []}
+    for p in transaction['postings']:
+        if 'value' in p:
+            amount = CurrencyAmount(p['currency'], p['value'])
+        else:
+            amount = None
+        assertion = None
+        if 'assertion' in p:
+            assertion = CurrencyAmount(p['assertion']['currency'],
+                                       p['assertion']['value'])
+        t['postings'].append({'account': p['account'], 'amount': amount,
+                              'assertion': assertion})
+    return t
+
+
+def parse_file(f):
+    """Return the transaction dicts in a journal file object, raising
+    LedgerSyntaxError as the line parser does."""
+    try:
+        return [convert_transaction(t) for t in grammar().parseFile(f)]
+    except pyparsing.ParseException as err:
+        raise LedgerSyntaxError(err.msg, err.line, err.lineno,
+                                err.column) from err
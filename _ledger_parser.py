@@ -1,100 +1,296 @@
-import pyparsing
+import os
+import re
+import mmap
+import operator
 from collections import namedtuple
-from pyparsing import (ParserElement, OneOrMore, ZeroOrMore, Word, nums,
-                       alphas, alphanums, delimitedList, Group, Combine,
-                       SkipTo, Optional, Literal,
-                       restOfLine, LineStart, LineEnd, StringEnd)
 
-__all__ = ['load_ledger']
+__all__ = ['load_ledger', 'iter_ledger', 'format_syntax_error']
 
 
 CurrencyAmount = namedtuple('CurrencyAmount', 'currency amount')
 
 ws = ' \t'
-ParserElement.setDefaultWhitespaceChars(ws)
-
-EOL = LineEnd().suppress()
-SOL = LineStart().leaveWhitespace()
-blankline = SOL + LineEnd()
-
-noIndentation = SOL + ~Word(ws).leaveWhitespace().suppress()
-indentation = SOL + Word(ws).leaveWhitespace().suppress()
-
-date = Combine(Word(nums, exact=4) + '-' +
-               Word(nums, exact=2) + '-' +
-               Word(nums, exact=2))
-
-description = SkipTo(';' | EOL)
-
-accountName = SkipTo(Literal('  ') | Literal(';') | Literal('\n'))
-currency = Word(alphas + '£$')
-number = Word(nums + '-.,')
-amount = currency('currency') + number('value')
-postingLine = (indentation +
-               accountName('account') +
-               Optional(amount)('amount') + restOfLine + EOL)
-postings = OneOrMore(Group(postingLine))
-
-transaction = (date('date') +
-               description('description') + EOL +
-               Group(postings)('postings'))
-
-# # Single statements
-# keyword = Word(alphanums)
-# singleValue = restOfLine
-# singleValue.setParseAction(lambda tokens: tokens[0].strip())
-# valueList = delimitedList(Word(alphas))
-# value = Group(valueList) ^ singleValue
-# oneLineStatement = keyword("keyword") + value("value") + EOL
-
-# # If statements
-# nonIndentedLine = noIndentation + restOfLine() + EOL
-# indentedLine = indentation + oneLineStatement
-# indentedBody = OneOrMore(indentedLine)
-
-# ifConditions = (restOfLine() + EOL +
-#                 ZeroOrMore(nonIndentedLine))
-# ifConditions.setParseAction(lambda tokens: [t for t in tokens if t])
-
-# ifStatement = ("if" +
-#                Group(ifConditions)("conditions") +
-#                Group(indentedBody)("body"))
-
-# Main parser
-body = OneOrMore(Group(transaction) | EOL)
-parser = body + StringEnd()
-parser.setDebug()
-parser.ignore(blankline)
-parser.ignore('#' + restOfLine)
-parser.ignore(';' + restOfLine)
-
-
-def convert_transaction(transaction):
-    t = transaction.asDict()
-    t['postings'] = [p.asDict() for p in t['postings']]
-    for p in t['postings']:
-        p['amount'] = CurrencyAmount(p['amount']['currency'],
-                                     p['amount']['value'])
-    return t
-
-
-def load_ledger(filename):
-    transactions = []
-    f = None
-    close = False
-    try:
-        if isinstance(filename, str):
-            f = open(filename, 'r')
-            close = True
+
+# Hand-written equivalent of the grammar in _ledger_grammar: it accepts
+# the same journals and gives the same results, but reads one line at a
+# time. Unlike the grammar it also allows comment lines between postings,
+# dates written with / or . (and secondary dates), and skips directives
+# (account, commodity, P, alias...) and periodic or automated
+# transactions, as hledger journals have them.
+headerRe = re.compile(r'([0-9]{4})[-/.]([0-9]{1,2})[-/.]([0-9]{1,2})'
+                      r'(?:=[0-9./-]+)?[ \t]*'
+                      r'(?:([*!])[ \t]*)?'
+                      r'(?:\(([^)\n]*)\)[ \t]*)?'
+                      r'(.*)')
+postingRe = re.compile(r'[ \t]+([^;\s](?:[^;\s]| (?! ))*)'
+                       r'(?:[ \t]*([A-Za-z£$]+)[ \t]*([0-9.,-]+))?'
+                       r'(?:[ \t]*=[ \t]*([A-Za-z£$]+)[ \t]*([0-9.,-]+))?')
+includeRe = re.compile(r'!?include[ \t]+(\S.*?)[ \t]*$')
+commentBlockRe = re.compile(r'comment[ \t]*$')
+endCommentRe = re.compile(r'end[ \t]+comment[ \t]*$')
+
+
+class LedgerSyntaxError(Exception):
+    def __init__(self, msg, line, lineno, column, filename=None):
+        super().__init__(msg)
+        self.line = line
+        self.lineno = lineno
+        self.column = column
+        self.filename = filename
+
+    def __reduce__(self):
+        # Raised in worker processes too
+        return type(self), (self.args[0], self.line, self.lineno,
+                            self.column, self.filename)
+
+    def __str__(self):
+        where = 'line:{}, col:{}'.format(self.lineno, self.column)
+        if self.filename is not None:
+            where = '{}, {}'.format(self.filename, where)
+        return '{} (at {})'.format(self.args[0], where)
+
+
+def _date(year, month, day):
+    """Return a date as YYYY-MM-DD, however it was written."""
+    return '{}-{:0>2}-{:0>2}'.format(year, month, day)
+
+
+def format_syntax_error(err):
+    """Return a LedgerSyntaxError as a message pointing at the column."""
+    return '{}\n{}^\n{}'.format(err.line, ' ' * (err.column - 1), err)
+
+
+def _finished(transaction, line, lineno):
+    if not transaction['postings']:
+        raise LedgerSyntaxError('Expected posting', line, lineno, 1)
+    return transaction
+
+
+def parse_lines(lines, includes=None):
+    """Yield transaction dicts, as from the grammar's, from an
+    iterable of journal lines.
+
+    Include directives are only allowed if there is a list `includes`
+    to note them in, as (number of transactions before it, path, line,
+    line number).
+
+    Other directives are skipped, with any indented lines under them.
+    """
+    transaction = None
+    count = 0
+    # Inside a directive, or a comment block
+    skipping = in_comment = False
+    for lineno, line in enumerate(lines, 1):
+        line = line.rstrip('\n')
+        if in_comment:
+            in_comment = endCommentRe.match(line) is None
+            continue
+        stripped = line.lstrip(ws)
+        if not stripped or stripped[0] in '#;':
+            continue
+        if stripped is not line:
+            if skipping:
+                continue
+            m = postingRe.match(line)
+            if transaction is None or m is None:
+                raise LedgerSyntaxError('Unexpected indented line',
+                                        line, lineno, 1)
+            account, currency, value, assert_currency, assert_value = \
+                m.groups()
+            amount = assertion = None
+            if value is not None:
+                amount = CurrencyAmount(currency, value)
+            if assert_value is not None:
+                assertion = CurrencyAmount(assert_currency, assert_value)
+            transaction['postings'].append({'account': account,
+                                            'amount': amount,
+                                            'assertion': assertion})
+            continue
+
+        if transaction is not None:
+            yield _finished(transaction, line, lineno)
+            count += 1
+            transaction = None
+        skipping = False
+        m = includeRe.match(line)
+        if m is not None and includes is not None:
+            includes.append((count, m.group(1), line, lineno))
+            continue
+        if not line[0].isdigit():
+            if m is not None:
+                raise LedgerSyntaxError('Unexpected include', line,
+                                        lineno, 1)
+            in_comment = commentBlockRe.match(line) is not None
+            skipping = True
+            continue
+        m = headerRe.match(line)
+        if m is None:
+            raise LedgerSyntaxError('Expected transaction', line, lineno, 1)
+        year, month, day, status, code, description = m.groups()
+        date = _date(year, month, day)
+        if description[:1] == '#':
+            description = ''
+        else:
+            description = description.split(';', 1)[0].strip()
+        transaction = {'date': date,
+                       'status': status,
+                       'code': code,
+                       'description': description,
+                       'postings': []}
+    if transaction is not None:
+        yield _finished(transaction, '', lineno + 1)
+
+
+def _parse_file_pyparsing(f):
+    # Imported, and built, only when asked for
+    from _ledger_grammar import parse_file
+    return parse_file(f)
+
+
+def _parse_file_lines(f):
+    return list(parse_lines(f))
+
+
+def parse_journal_file(filename):
+    """Return the transactions in one journal file, and the include
+    directives in it as parse_lines() notes them."""
+    includes = []
+    with open(filename, 'r') as f:
+        try:
+            transactions = list(parse_lines(f, includes))
+        except LedgerSyntaxError as err:
+            err.filename = filename
+            raise
+    return transactions, includes
+
+
+PARSERS = {
+    'pyparsing': _parse_file_pyparsing,
+    'lines': _parse_file_lines,
+}
+
+
+def load_ledger(filename, implementation='lines', jobs=1, cache_dir=None):
+    """Load the transactions in a journal file (a filename or file object).
+
+    `implementation` picks the parser: 'lines' (the default) or the
+    slower 'pyparsing' grammar. The line parser follows the include
+    directives of a journal given by name, as journal_tree.load_journal()
+    does with `jobs` and `cache_dir`.
+
+    Syntax errors raise LedgerSyntaxError: deduplicating against part of
+    a journal would pass off what is already in it as new.
+    """
+    parse_file = PARSERS[implementation]
+    if isinstance(filename, str) and implementation == 'lines':
+        # Imported here as it imports this module
+        from journal_tree import load_journal
+        return load_journal(filename, jobs, cache_dir)
+    if isinstance(filename, str):
+        with open(filename, 'r') as f:
+            return parse_file(f)
+    return parse_file(filename)
+
+
+dateLineRe = re.compile(rb'([0-9]{4})[-/.]([0-9]{1,2})[-/.]([0-9]{1,2})')
+# The dates of all transactions, and the start of any comment block
+headerDateRe = re.compile(rb'^[0-9][-/.0-9]*', re.MULTILINE)
+commentBlockLineRe = re.compile(rb'^comment[ \t]*\r?$', re.MULTILINE)
+SEPARATORS = bytes.maketrans(b'/.', b'--')
+# Journal path -> ((device, inode, size, mtime), whether in date order)
+_date_order = {}
+
+
+def _next_transaction(mm, pos):
+    """Return the offset and date of the first transaction starting at or
+    after `pos`, or (len(mm), None)."""
+    if pos > 0 and mm[pos - 1:pos] != b'\n':
+        pos = mm.find(b'\n', pos)
+        pos = len(mm) if pos < 0 else pos + 1
+    while pos < len(mm):
+        m = dateLineRe.match(mm, pos)
+        if m:
+            return pos, _date(*(g.decode('ascii') for g in m.groups()))
+        pos = mm.find(b'\n', pos)
+        if pos < 0:
+            break
+        pos += 1
+    return len(mm), None
+
+
+def _sortable(date):
+    if len(date) == 10:
+        return date.translate(SEPARATORS)
+    m = dateLineRe.match(date)
+    if m is None:
+        return date
+    return _date(*(g.decode('ascii') for g in m.groups())).encode('ascii')
+
+
+def _in_date_order(mm):
+    """Whether the transactions in a mapped journal file are in date
+    order, so that a date window can be found by binary search."""
+    if commentBlockLineRe.search(mm):
+        # Dated lines in comment blocks are not transactions
+        return False
+    dates = [_sortable(d) for d in headerDateRe.findall(mm)]
+    return all(map(operator.le, dates, dates[1:]))
+
+
+def _known_date_order(filename, st, mm):
+    """_in_date_order() for the journal `filename`, whose os.stat() is
+    `st`, only scanning it again once it has been changed."""
+    path = os.path.abspath(filename)
+    key = st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
+    known = _date_order.get(path)
+    if known is not None and known[0] == key:
+        return known[1]
+    ordered = _in_date_order(mm)
+    _date_order[path] = key, ordered
+    return ordered
+
+
+def _seek_date(mm, start):
+    """Binary search for the first transaction dated on or after `start`."""
+    lo, hi = 0, len(mm)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        _, date = _next_transaction(mm, mid)
+        if date is None or date >= start:
+            hi = mid
         else:
-            f = filename
-        for transaction in parser.parseFile(f):
-            transactions.append(convert_transaction(transaction))
-    except pyparsing.ParseException as err:
-        print(err.line)
-        print(" "*(err.column-1) + "^")
-        print(err)
-    finally:
-        if close:
-            f.close()
-    return transactions
+            lo = mid + 1
+    return _next_transaction(mm, lo)[0]
+
+
+def iter_ledger(filename, start=None, end=None):
+    """Yield the transactions in a journal file one at a time.
+
+    With `start` and/or `end` (inclusive 'YYYY-MM-DD' dates), only
+    transactions in that range are yielded. If the journal is in date
+    order, only that part of it is parsed: the first transaction is
+    found by binary search, and reading stops at the first one after
+    `end`. Journals appended to statement by statement, one account
+    after another, seldom are, and are parsed whole. Whether a journal
+    is in date order is remembered until it is changed. Syntax errors
+    raise LedgerSyntaxError.
+    """
+    with open(filename, 'rb') as f:
+        st = os.fstat(f.fileno())
+        if st.st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            ordered = (start is not None or end is not None) and \
+                _known_date_order(filename, st, mm)
+            if start is not None and ordered:
+                mm.seek(_seek_date(mm, start))
+            lines = (line.decode('utf8')
+                     for line in iter(mm.readline, b''))
+            for transaction in parse_lines(lines):
+                date = transaction['date']
+                if end is not None and date > end:
+                    if ordered:
+                        break
+                    continue
+                if start is None or date >= start:
+                    yield transaction
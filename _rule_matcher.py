@@ -0,0 +1,224 @@
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError:
+    import sre_parse
+    import sre_constants
+from collections import Counter
+from heapq import merge
+
+__all__ = ['CompiledMatcher', 'ConditionMatcher']
+
+# Below this many patterns, searching them all is faster than the scan.
+MIN_PREFILTER_PATTERNS = 50
+
+
+def required_literal(pattern):
+    """Return a string that every match of `pattern` must contain.
+
+    Only literal runs at the top level of the pattern are considered;
+    returns None when there are none, or when the pattern ignores case.
+    """
+    if pattern.flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return None
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except (sre_constants.error, TypeError):
+        return None
+    if parsed.state.flags & sre_constants.SRE_FLAG_IGNORECASE:
+        return None
+    best = run = ''
+    for op, av in parsed:
+        if op is sre_constants.LITERAL:
+            run += chr(av)
+            if len(run) > len(best):
+                best = run
+        else:
+            run = ''
+    return best or None
+
+
+def exact_literal(pattern):
+    """Return the string that is the only text `pattern` matches in full,
+    as in '^ABC$', or None if it is not of that form."""
+    if pattern.flags & (sre_constants.SRE_FLAG_IGNORECASE |
+                        sre_constants.SRE_FLAG_MULTILINE):
+        return None
+    try:
+        parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+    except (sre_constants.error, TypeError):
+        return None
+    if parsed.state.flags & (sre_constants.SRE_FLAG_IGNORECASE |
+                             sre_constants.SRE_FLAG_MULTILINE):
+        return None
+    items = list(parsed)
+    if len(items) < 2 or \
+            items[0] != (sre_constants.AT, sre_constants.AT_BEGINNING) or \
+            items[-1] != (sre_constants.AT, sre_constants.AT_END):
+        return None
+    literal = ''
+    for op, av in items[1:-1]:
+        if op is not sre_constants.LITERAL:
+            return None
+        literal += chr(av)
+    return literal
+
+
+class AhoCorasick:
+    """Find which of a set of strings occur in a text in one pass."""
+
+    def __init__(self, keywords):
+        # keywords: mapping of string -> values reported when it occurs
+        self._goto = [{}]
+        out = [[]]
+        for keyword, values in keywords.items():
+            state = 0
+            for ch in keyword:
+                if ch not in self._goto[state]:
+                    self._goto.append({})
+                    out.append([])
+                    self._goto[state][ch] = len(self._goto) - 1
+                state = self._goto[state][ch]
+            out[state].extend(values)
+
+        self._fail = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for ch, child in self._goto[state].items():
+                queue.append(child)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(ch, 0)
+                self._fail[child] = fail
+                out[child].extend(out[fail])
+        self._out = [frozenset(x) for x in out]
+
+    def search(self, text):
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+class CompiledMatcher:
+    """Find the first of a list of compiled patterns that matches.
+
+    Each pattern's required literal is looked for with a single
+    Aho-Corasick scan of the text, and only patterns whose literal
+    occurs (or that have no usable literal) are searched, in order.
+    """
+
+    def __init__(self, patterns):
+        self._patterns = list(patterns)
+        literals = {}
+        self._unfiltered = []
+        self._literals = None
+        if len(self._patterns) < MIN_PREFILTER_PATTERNS:
+            return
+        for i, pattern in enumerate(self._patterns):
+            literal = required_literal(pattern)
+            if literal is None:
+                self._unfiltered.append(i)
+            else:
+                literals.setdefault(literal, []).append(i)
+        self._literals = AhoCorasick(literals)
+
+    def match(self, text):
+        """Return the index of the first matching pattern, or None."""
+        if self._literals is None:
+            candidates = range(len(self._patterns))
+        else:
+            candidates = merge(sorted(self._literals.search(text)),
+                               self._unfiltered)
+        for i in candidates:
+            if self._patterns[i].search(text):
+                return i
+        return None
+
+
+class FieldMatcher:
+    """Find all of a list of compiled patterns that match a text.
+
+    Patterns that match one whole string are looked up by it in a dict;
+    the rest are prefiltered by their required literal, as in
+    CompiledMatcher, once there are enough of them.
+    """
+
+    def __init__(self, patterns):
+        self._patterns = list(patterns)
+        self._exact = {}
+        searched = []
+        for i, pattern in enumerate(self._patterns):
+            literal = exact_literal(pattern)
+            if literal is None:
+                searched.append(i)
+            else:
+                self._exact.setdefault(literal, []).append(i)
+        self._searched = searched
+        self._literals = None
+        if len(searched) < MIN_PREFILTER_PATTERNS:
+            return
+        literals = {}
+        self._searched = []
+        for i in searched:
+            literal = required_literal(self._patterns[i])
+            if literal is None:
+                self._searched.append(i)
+            else:
+                literals.setdefault(literal, []).append(i)
+        self._literals = AhoCorasick(literals)
+
+    def matches(self, text):
+        """Return the indexes of the patterns that match `text`."""
+        found = list(self._exact.get(text, ()))
+        if text.endswith('\n'):
+            # $ also matches before a final newline
+            found.extend(self._exact.get(text[:-1], ()))
+        candidates = self._searched
+        if self._literals is not None:
+            candidates = list(merge(sorted(self._literals.search(text)),
+                                    candidates))
+        found.extend(i for i in candidates if self._patterns[i].search(text))
+        return found
+
+
+class ConditionMatcher:
+    """Find the first of a list of rules whose conditions all match.
+
+    Each rule is a list of (field number, compiled pattern) conditions.
+    The patterns tested against each field go into one FieldMatcher, so
+    a row costs a lookup and a scan per field however many rules there
+    are, plus a count of the conditions met for each rule.
+    """
+
+    def __init__(self, rules, n_fields):
+        self._needed = []
+        self._fields = []
+        patterns = [[] for _ in range(n_fields)]
+        owners = [[] for _ in range(n_fields)]
+        for i, conditions in enumerate(rules):
+            self._needed.append(len(conditions))
+            for field, pattern in conditions:
+                patterns[field].append(pattern)
+                owners[field].append(i)
+        for field in range(n_fields):
+            if patterns[field]:
+                self._fields.append((field, FieldMatcher(patterns[field]),
+                                     owners[field]))
+
+    def match(self, values):
+        """Return the index of the first rule whose conditions are met by
+        the field values `values`, or None."""
+        met = Counter()
+        for field, matcher, owners in self._fields:
+            met.update(owners[i] for i in matcher.matches(values[field]))
+        needed = self._needed
+        return min((i for i, n in met.items() if n == needed[i]),
+                   default=None)
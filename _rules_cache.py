@@ -0,0 +1,65 @@
+import os
+import json
+import hashlib
+
+__all__ = ['default_cache_dir', 'read_keyed', 'load_cached', 'store_cached']
+
+VERSION = 2
+
+
+def default_cache_dir():
+    base = os.environ.get('XDG_CACHE_HOME',
+                          os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'ledger-csv-merge')
+
+
+def read_keyed(filename):
+    """Return the contents of `filename`, and the key to cache what is
+    parsed from exactly those contents under.
+
+    The contents are to be parsed rather than the file read again: it
+    may be saved in between, and the old parse cached under the new
+    key would then be served until the next change.
+    """
+    with open(filename, 'rb') as f:
+        contents = f.read()
+        st = os.fstat(f.fileno())
+    return contents, {'version': VERSION,
+                      'path': os.path.abspath(filename),
+                      'size': st.st_size,
+                      'mtime': st.st_mtime_ns,
+                      'sha256': hashlib.sha256(contents).hexdigest()}
+
+
+def _cache_file(cache_dir, filename):
+    name = hashlib.sha1(os.path.abspath(filename).encode('utf8')).hexdigest()
+    return os.path.join(cache_dir, 'rules-{}.json'.format(name))
+
+
+def load_cached(filename, cache_dir, key):
+    """Return the rules cached for `filename`, or None if there are none
+    or they are not for `key`, from read_keyed()."""
+    try:
+        with open(_cache_file(cache_dir, filename), 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('key') != key:
+        return None
+    return cached['rules']
+
+
+def store_cached(filename, cache_dir, key, rules):
+    """Cache `rules`, a JSON-serialisable value, for `filename` as read
+    by read_keyed() with `key`."""
+    path = _cache_file(cache_dir, filename)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(tmp, 'w') as f:
+            json.dump({'key': key, 'rules': rules}, f)
+        os.replace(tmp, path)
+    except OSError:
+        # The cache is only an optimisation
+        if os.path.exists(tmp):
+            os.unlink(tmp)
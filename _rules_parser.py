@@ -1,4 +1,5 @@
 import pyparsing
+from functools import lru_cache
 from pyparsing import (ParserElement, OneOrMore, ZeroOrMore, Word,
                        alphas, alphanums, delimitedList, Group,
                        restOfLine, LineStart, LineEnd, StringEnd)
@@ -6,39 +7,45 @@ from pyparsing import (ParserElement, OneOrMore, ZeroOrMore, Word,
 __all__ = ['load_rules']
 
 ws = ' \t'
-ParserElement.setDefaultWhitespaceChars(ws)
 
-EOL = LineEnd().suppress()
-SOL = LineStart().leaveWhitespace()
-blankline = SOL + LineEnd()
 
-noIndentation = SOL + ~Word(ws).leaveWhitespace().suppress()
-indentation = SOL + Word(ws).leaveWhitespace().suppress()
+@lru_cache(maxsize=None)
+def grammar():
+    """Build the rules file grammar, once, on first use."""
+    ParserElement.setDefaultWhitespaceChars(ws)
 
-# Single statements
-keyword = Word(alphanums)
-value = restOfLine
-value.setParseAction(lambda tokens: tokens[0].strip())
-oneLineStatement = keyword("keyword") + value("value") + EOL
+    EOL = LineEnd().suppress()
+    SOL = LineStart().leaveWhitespace()
+    blankline = SOL + LineEnd()
 
-# If statements
-nonIndentedLine = noIndentation + restOfLine() + EOL
-indentedLine = indentation + Group(oneLineStatement)
-indentedBody = OneOrMore(indentedLine)
+    noIndentation = SOL + ~Word(ws).leaveWhitespace().suppress()
+    indentation = SOL + Word(ws).leaveWhitespace().suppress()
 
-ifConditions = (restOfLine() + EOL +
-                ZeroOrMore(nonIndentedLine))
-ifConditions.setParseAction(lambda tokens: [t for t in tokens if t])
+    # Single statements
+    keyword = Word(alphanums)
+    value = restOfLine
+    value.setParseAction(lambda tokens: tokens[0].strip())
+    oneLineStatement = keyword("keyword") + value("value") + EOL
 
-ifStatement = ("if" +
-               Group(ifConditions)("conditions") +
-               indentedBody("body"))
+    # If statements
+    nonIndentedLine = noIndentation + restOfLine() + EOL
+    indentedLine = indentation + Group(oneLineStatement)
+    indentedBody = OneOrMore(indentedLine)
 
-# Main parser
-body = OneOrMore(Group(ifStatement | oneLineStatement | EOL))
-parser = body + StringEnd()
-parser.ignore(blankline)
-parser.ignore('#' + restOfLine)
+    ifConditions = (restOfLine() + EOL +
+                    ZeroOrMore(nonIndentedLine))
+    ifConditions.setParseAction(lambda tokens: [t for t in tokens if t])
+
+    ifStatement = ("if" +
+                   Group(ifConditions)("conditions") +
+                   indentedBody("body"))
+
+    # Main parser
+    body = OneOrMore(Group(ifStatement | oneLineStatement | EOL))
+    parser = body + StringEnd()
+    parser.ignore(blankline)
+    parser.ignore('#' + restOfLine)
+    return parser
 
 
 def load_rules(filename):
@@ -52,7 +59,7 @@ def load_rules(filename):
             close = True
         else:
             f = filename
-        for statement in parser.parseFile(f):
+        for statement in grammar().parseFile(f):
             if 'keyword' in statement:
                 if hasattr(statement.value, 'asList'):
                     value = statement.value.asList()
@@ -0,0 +1,166 @@
+"""Check the balance assertions of new transactions before they are
+appended to a journal.
+
+A transaction made from a statement with a balance column asserts the
+balance of its account1 after it. Instead of appending and waiting for
+hledger to reject a gap or a duplicate, the assertions are checked in
+memory: the new transactions' amounts are summed cumulatively, in the
+order hledger applies them, on top of the journal's balance of the
+account as of each transaction's date, and compared with the stated
+balances in one pass.
+"""
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import date as date_type
+from decimal import Decimal
+from itertools import accumulate
+import profiling
+from _ledger_parser import load_ledger
+from ledger_index import posting_amounts, normalize_amount
+
+__all__ = ['journal_balances', 'check_balances', 'BalanceMismatch']
+
+BalanceMismatch = namedtuple('BalanceMismatch', 'transaction expected')
+
+# Larger integers are left to Python rather than NumPy's int64
+MAX_INT64 = 2 ** 62
+
+
+def journal_balances(ledger_file, accounts, jobs=1, cache_dir=None):
+    """Return the running balances of `accounts` in a journal (a filename
+    or file object, read as load_ledger() reads it with `jobs` and
+    `cache_dir`).
+
+    The result maps (account, currency) to two lists: day ordinals in
+    date order, and the balance after the postings of each. Where a
+    posting asserts a balance, the assertion is taken as the balance
+    from then on.
+    """
+    accounts = set(accounts)
+    events = {}
+    with profiling.stage('journal balances'):
+        for t in load_ledger(ledger_file, jobs=jobs, cache_dir=cache_dir):
+            day = date_type.fromisoformat(t['date']).toordinal()
+            for account, (currency, amount) in posting_amounts(
+                    t['postings']):
+                if account in accounts:
+                    events.setdefault((account, currency), []).append(
+                        (day, False, normalize_amount(amount)))
+            for p in t['postings']:
+                if p['account'] in accounts and p['assertion'] is not None:
+                    currency, amount = p['assertion']
+                    events.setdefault((p['account'], currency), []).append(
+                        (day, True, normalize_amount(amount)))
+
+        balances = {}
+        for key, changes in events.items():
+            # hledger applies postings in date order, and in file order
+            # within a day; sort() is stable.
+            changes.sort(key=lambda x: x[0])
+            days, running = [], []
+            balance = 0
+            for day, asserted, amount in changes:
+                balance = amount if asserted else balance + amount
+                if days and days[-1] == day:
+                    running[-1] = balance
+                else:
+                    days.append(day)
+                    running.append(balance)
+            balances[key] = days, running
+    return balances
+
+
+def check_balances(transactions, balances):
+    """Return a BalanceMismatch for the first of `transactions` (in the
+    order they would be appended) whose balance assertion would fail, or
+    None if they all hold.
+
+    `balances` is the result of journal_balances() for the
+    transactions' account1s. Transactions whose dates are not in
+    YYYY-MM-DD form cannot be placed among the journal's, so accounts
+    with any are not checked.
+    """
+    groups = {}
+    for position, t in enumerate(transactions):
+        groups.setdefault((t.account1, t.currency), []).append((position, t))
+
+    first = None
+    with profiling.stage('check balances'):
+        for key, group in groups.items():
+            if all(t.balance is None for _, t in group) or \
+                    any(t.ordinal is None for _, t in group):
+                continue
+            mismatch = _check_account(group, balances.get(key, ([], [])))
+            if mismatch is not None and (first is None or
+                                         mismatch[0] < first[0]):
+                first = mismatch
+    return None if first is None else first[1]
+
+
+def _check_account(group, journal):
+    group.sort(key=lambda x: x[1].ordinal)
+    days, running = journal
+    stated = [t.balance for _, t in group]
+    amounts = [t.amount for _, t in group]
+    # Work in integer units of the finest precision involved
+    places = max([0] + [-d.as_tuple().exponent
+                        for d in amounts + stated + running
+                        if d is not None])
+
+    def units(d):
+        return None if d is None else int(d.scaleb(places))
+
+    ordinals = [t.ordinal for _, t in group]
+    amounts = [units(d) for d in amounts]
+    stated = [units(d) for d in stated]
+    running = [units(d) for d in running]
+
+    first = _first_mismatch
+    # The sums must fit in NumPy's int64
+    if sum(abs(n) for n in amounts + stated + running
+           if n is not None) < MAX_INT64:
+        try:
+            import numpy  # noqa: F401
+            first = _first_mismatch_numpy
+        except ImportError:
+            pass
+    i = first(ordinals, amounts, stated, days, running)
+    if i is None:
+        return None
+    expected = (_opening(days, running, ordinals[i]) +
+                sum(amounts[:i + 1]))
+    position, t = group[i]
+    return position, BalanceMismatch(t, Decimal(expected).scaleb(-places))
+
+
+def _opening(days, running, ordinal):
+    i = bisect_right(days, ordinal)
+    return running[i - 1] if i else 0
+
+
+def _first_mismatch(ordinals, amounts, stated, days, running):
+    """Return the index of the first transaction whose stated balance
+    differs from the journal's balance on its day plus the amounts of it
+    and the transactions before it, or None."""
+    for i, total in enumerate(accumulate(amounts)):
+        if stated[i] is not None and \
+                _opening(days, running, ordinals[i]) + total != stated[i]:
+            return i
+    return None
+
+
+def _first_mismatch_numpy(ordinals, amounts, stated, days, running):
+    """_first_mismatch(), vectorized."""
+    import numpy as np
+    opening = np.zeros(len(ordinals), dtype=np.int64)
+    if days:
+        i = np.searchsorted(np.array(days, dtype=np.int64),
+                            np.array(ordinals, dtype=np.int64), 'right')
+        journal = np.array([0] + running, dtype=np.int64)
+        opening = journal[i]
+    expected = opening + np.cumsum(np.array(amounts, dtype=np.int64))
+    has = np.array([s is not None for s in stated])
+    balances = np.array([0 if s is None else s for s in stated],
+                        dtype=np.int64)
+    wrong = np.flatnonzero(has & (expected != balances))
+    return int(wrong[0]) if len(wrong) else None
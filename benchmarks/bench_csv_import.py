@@ -0,0 +1,134 @@
+"""Time read_transactions_from_csv, in both ingest modes, against the old
+per-row loop.
+
+    python benchmarks/bench_csv_import.py [--rows N]
+"""
+import argparse
+import csv
+import os.path
+import random
+import sys
+import time
+from io import StringIO
+from tempfile import NamedTemporaryFile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from csv_importer import (Transaction, REQUIRED_FIELDS,  # noqa: E402
+                          read_transactions_from_csv)
+from csv_rules import Rules  # noqa: E402
+
+RULES = """
+skip 1
+fields date, description, amount, balance
+currency £
+account1 assets:bank
+account2 expenses:unknown
+
+if TESCO|SAINSBURY
+  account2 expenses:food
+
+if ^CHQ
+  description Cheque ({description})
+
+if SALARY
+  account2 income:salary
+  description Salary {date}
+"""
+
+PAYEES = ['TESCO STORES', 'SAINSBURYS', 'CHQ {}', 'SALARY ACME LTD',
+          'AMAZON', 'TFL TRAVEL', 'PAYPAL *{}', 'COUNCIL TAX']
+
+
+def make_statement(f, rows, seed=0):
+    rnd = random.Random(seed)
+    writer = csv.writer(f)
+    writer.writerow(['Date', 'Description', 'Amount', 'Balance'])
+    balance = 0
+    for i in range(rows):
+        amount = rnd.randrange(-20000, 5000)
+        balance += amount
+        writer.writerow(['2014-{:02d}-{:02d}'.format(1 + i % 12, 1 + i % 28),
+                         rnd.choice(PAYEES).format(rnd.randrange(1000)),
+                         '{:.2f}'.format(amount / 100),
+                         '{:.2f}'.format(balance / 100)])
+
+
+def legacy_read_transactions_from_csv(filename, rules):
+    """read_transactions_from_csv before row plans were introduced."""
+    def field(name, line):
+        i = list(rules.options['fields']).index(name)
+        return line[i]
+    with open(filename, 'r') as f:
+        for i in range(rules.options.get('skip', 0)):
+            f.readline()
+        reader = csv.reader(f)
+        for line_list in reader:
+            line = {}
+            for i, fieldname in enumerate(rules.options['fields']):
+                line[i] = line[fieldname] = line_list[i]
+            desc = line['description'].lstrip('*')
+            match = rules.match(desc)
+            if 'date' not in match:
+                match['date'] = field('date', line)
+            if 'amount' not in match:
+                try:
+                    match['amount'] = float(field('amount', line))
+                except ValueError:
+                    pass
+            if 'balance' not in match:
+                try:
+                    match['balance'] = float(field('balance', line))
+                except ValueError:
+                    pass
+            if 'description' not in match:
+                match['description'] = desc
+            missing_keys = REQUIRED_FIELDS.difference(match.keys())
+            if missing_keys:
+                raise RuntimeError("Required field missing: {}"
+                                   .format(missing_keys))
+            for k in match:
+                if isinstance(match[k], str):
+                    match[k] = match[k].format(**line)
+            yield Transaction(match['date'], match['account1'],
+                              match['account2'], match['amount'],
+                              match['currency'], match['description'],
+                              match.get('balance', None),
+                              match.get('code', None))
+
+
+def bench(read, filename, rules):
+    start = time.perf_counter()
+    # Kept, as get_transactions() does to find the date range
+    n = len(list(read(filename, rules)))
+    return n, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    args = parser.parse_args()
+
+    rules = Rules(StringIO(RULES))
+    columnar = Rules(StringIO('ingest columnar\n' + RULES))
+    with NamedTemporaryFile('w', suffix='.csv', newline='') as f:
+        make_statement(f, args.rows)
+        f.flush()
+        for name, read, r in [
+                ('legacy', legacy_read_transactions_from_csv, rules),
+                ('row plan', read_transactions_from_csv, rules),
+                ('columnar', read_transactions_from_csv, columnar)]:
+            n, elapsed = bench(read, f.name, r)
+            print('{:10} {:8.2f}s {:10.0f} rows/s'
+                  .format(name, elapsed, n / elapsed))
+        sample = min(args.rows, 10000)
+        legacy = legacy_read_transactions_from_csv(f.name, rules)
+        new = read_transactions_from_csv(f.name, rules)
+        assert all(str(a) == str(b) for a, b, _ in
+                   zip(legacy, new, range(sample)))
+        assert all(str(a) == str(b) for a, b in zip(
+            read_transactions_from_csv(f.name, rules),
+            read_transactions_from_csv(f.name, columnar)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Compare duplicate lookups per second: LedgerIndex vs. hledger.
+
+    python benchmarks/bench_dedup.py [--transactions N] [--queries N]
+                                     [--fake-hledger-latency SECONDS]
+
+LedgerIndex's fuzzy lookups of near misses are timed too, as is loading
+a JournalIndex stored by an earlier run after a statement has been
+appended to the journal, and batched
+hledger deduplication serially and with concurrent queries. With
+--fake-hledger-latency, an "hledger" that waits that long and finds
+nothing stands in for the real one.
+"""
+import argparse
+import os.path
+import random
+import shutil
+import stat
+import sys
+import time
+from datetime import date, timedelta
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from csv_importer import (escape, Transaction,  # noqa: E402
+                          deduplicate_transactions, deduplicate_concurrently)
+from ledger_index import LedgerIndex, FuzzyMatch  # noqa: E402
+from journal_index import JournalIndex, default_path  # noqa: E402
+from ledger_wrapper import Ledger  # noqa: E402
+from synthetic import make_journal, END  # noqa: E402
+
+def bench(find, queries):
+    start = time.perf_counter()
+    for q in queries:
+        find(**q)
+    return len(queries) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transactions', type=int, default=5000)
+    parser.add_argument('--queries', type=int, default=20)
+    parser.add_argument('--fake-hledger-latency', type=float)
+    args = parser.parse_args()
+
+    contents, all_queries = make_journal(args.transactions)
+    queries = random.Random(1).sample(all_queries, args.queries)
+    with NamedTemporaryFile('w', suffix='.journal') as f, \
+            TemporaryDirectory() as bin_dir:
+        f.write(contents)
+        f.flush()
+
+        start = time.perf_counter()
+        index = LedgerIndex(f.name)
+        print('index build: {:.3f}s ({} postings)'
+              .format(time.perf_counter() - start, len(index)))
+
+        # A month-long statement at the end of the journal
+        start = time.perf_counter()
+        window = LedgerIndex(f.name, (END - timedelta(days=30)).isoformat(),
+                             END.isoformat())
+        print('index build, last 31 days: {:.3f}s ({} postings)'
+              .format(time.perf_counter() - start, len(window)))
+        JournalIndex(f.name)
+        f.write('\n\n' + make_journal(10, seed=1)[0] + '\n')
+        f.flush()
+        start = time.perf_counter()
+        stored = JournalIndex(f.name)
+        print('stored index, after an append: {:.3f}s ({} postings)'
+              .format(time.perf_counter() - start, len(stored)))
+        os.unlink(default_path(f.name))
+        print('index:   {:12.0f} lookups/s'
+              .format(bench(index.find_transaction, queries * 1000)))
+
+        # Near misses: a day later, with the description changed a little
+        fuzzy = FuzzyMatch(days=3, similarity=0.8)
+        near = [dict(q, date=(date.fromisoformat(q['date']) +
+                              timedelta(days=1)).isoformat(),
+                     desc=q['desc'] + ' X', fuzzy=fuzzy)
+                for q in queries]
+        assert all(index.find_similar(**q) for q in near)
+        print('fuzzy:   {:12.0f} lookups/s'
+              .format(bench(index.find_similar, near * 100)))
+
+        if args.fake_hledger_latency is not None:
+            fake_hledger(bin_dir, args.fake_hledger_latency)
+        if shutil.which('hledger') is None:
+            print('hledger: not installed, skipped')
+            return
+        ledger = Ledger(f.name)
+
+        def find_hledger(desc, **q):
+            return ledger.find_transaction(desc=escape(desc), **q)
+        print('hledger: {:12.2f} lookups/s'
+              .format(bench(find_hledger, queries)))
+
+        # A statement of 4000 rows, deduplicated in batches of 500
+        transactions = [Transaction(q['date'], q['acct'], 'expenses:misc',
+                                    q['amt'], q['cur'], q['desc'])
+                        for q in all_queries[-4000:]]
+        start = time.perf_counter()
+        list(deduplicate_transactions(transactions, ledger))
+        print('hledger batches, serial:     {:.3f}s'
+              .format(time.perf_counter() - start))
+        start = time.perf_counter()
+        deduplicate_concurrently([transactions], ledger)
+        print('hledger batches, concurrent: {:.3f}s'
+              .format(time.perf_counter() - start))
+
+
+def fake_hledger(bin_dir, latency):
+    path = os.path.join(bin_dir, 'hledger')
+    with open(path, 'w') as f:
+        f.write('#!{}\nimport time\ntime.sleep({})\n'
+                .format(sys.executable, latency))
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+
+if __name__ == '__main__':
+    main()
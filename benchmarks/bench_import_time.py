@@ -0,0 +1,68 @@
+"""Check the command's startup time against a budget.
+
+    python benchmarks/bench_import_time.py [--repeat N] [--budget MS]
+
+Imports ledger_csv_merge in fresh interpreters with -X importtime, and
+prints the median cumulative import time and the slowest modules. Exits
+with status 1 if the median is over the budget, or if any module that
+the command should only load when it is needed was imported.
+"""
+import argparse
+import os.path
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Only needed for watching, the pyparsing grammars, hledger queries or
+# --jobs
+DEFERRED = ['watchdog', 'pyparsing', '_rules_parser', '_ledger_grammar',
+            'asyncio', 'concurrent.futures.process', 'difflib', 'numpy']
+
+
+def import_times(module):
+    """Return {module: cumulative microseconds} for importing `module` in
+    a new interpreter."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True,
+        check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line.split('|')
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--budget', type=float, default=150,
+                        help='milliseconds (default 150)')
+    args = parser.parse_args()
+
+    # The first import may compile and cache bytecode
+    import_times('ledger_csv_merge')
+    runs = [import_times('ledger_csv_merge') for _ in range(args.repeat)]
+    total = statistics.median(r['ledger_csv_merge'] for r in runs) / 1000
+    print('import ledger_csv_merge: {:.1f}ms (median of {}), budget {:.0f}ms'
+          .format(total, args.repeat, args.budget))
+    last = runs[-1]
+    top = sorted(((t, name) for name, t in last.items()
+                  if name != 'ledger_csv_merge' and '.' not in name),
+                 reverse=True)[:10]
+    for t, name in top:
+        print('  {:30} {:8.1f}ms'.format(name, t / 1000))
+
+    loaded = [name for name in DEFERRED if name in last]
+    if loaded:
+        print('imported but not needed: {}'.format(', '.join(loaded)))
+    if total > args.budget or loaded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
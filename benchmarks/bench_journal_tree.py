@@ -0,0 +1,77 @@
+"""Time loading a journal split into one included file per year.
+
+    python benchmarks/bench_journal_tree.py [--years N] [--jobs N]
+
+Loads the journal without the cache, in one process and in parallel,
+then with the cache after only the last year's file has changed.
+"""
+import argparse
+import os.path
+import sys
+import time
+from datetime import date
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from journal_tree import load_journal  # noqa: E402
+from synthetic import END, make_description  # noqa: E402
+import random  # noqa: E402
+
+
+def write_tree(directory, years, per_day):
+    """Write main.journal including a file of `per_day` transactions a
+    day for each of `years` years up to END; return its path and the
+    last year's."""
+    rnd = random.Random(0)
+    root = os.path.join(directory, 'main.journal')
+    with open(root, 'w') as main:
+        for year in range(END.year - years + 1, END.year + 1):
+            name = '{}.journal'.format(year)
+            main.write('include {}\n'.format(name))
+            path = os.path.join(directory, name)
+            with open(path, 'w') as f:
+                for day in range(date(year, 1, 1).toordinal(),
+                                 date(year, 12, 31).toordinal() + 1):
+                    day = date.fromordinal(day).isoformat()
+                    for _ in range(per_day):
+                        f.write('{} {}\n    assets:bank  £{:.2f}\n'
+                                '    expenses:misc\n\n'.format(
+                                    day, make_description(rnd),
+                                    rnd.randrange(-20000, 5000) / 100))
+    return root, path
+
+
+def timed(f):
+    start = time.perf_counter()
+    result = f()
+    return time.perf_counter() - start, len(result)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--years', type=int, default=8)
+    parser.add_argument('--per-day', type=int, default=20)
+    parser.add_argument('--jobs', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        root, current = write_tree(tmp, args.years, args.per_day)
+        cache_dir = os.path.join(tmp, 'cache')
+        serial = timed(lambda: load_journal(root))
+        parallel = timed(lambda: load_journal(root, args.jobs))
+        load_journal(root, cache_dir=cache_dir)
+        with open(current, 'a') as f:
+            f.write('{} Appended\n    assets:bank  £1\n    income\n'
+                    .format(END.isoformat()))
+        cached = timed(lambda: load_journal(root, cache_dir=cache_dir))
+
+    print('{} years, {} transactions'.format(args.years, serial[1]))
+    for name, (elapsed, n) in [('serial', serial),
+                               ('{} jobs'.format(args.jobs), parallel),
+                               ('cached', cached)]:
+        print('{:10} {:8.3f}s'.format(name, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""Measure journal parsing throughput in MB/s for each parser.
+
+    python benchmarks/bench_ledger_parser.py [--transactions N]
+"""
+import argparse
+import os.path
+import sys
+import time
+from io import StringIO
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from _ledger_parser import load_ledger, PARSERS  # noqa: E402
+from synthetic import make_journal  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--transactions', type=int, default=5000)
+    args = parser.parse_args()
+
+    contents, _ = make_journal(args.transactions)
+    size = len(contents.encode('utf8')) / 1e6
+    print('journal: {} transactions, {:.2f} MB'
+          .format(args.transactions, size))
+    for implementation in PARSERS:
+        start = time.perf_counter()
+        transactions = load_ledger(StringIO(contents), implementation)
+        elapsed = time.perf_counter() - start
+        assert len(transactions) == args.transactions
+        print('{:10} {:8.3f}s {:8.2f} MB/s'
+              .format(implementation, elapsed, size / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Time Rules.match against the old linear scan as the rule count grows,
+for rules on the description and for rules testing other fields.
+
+    python benchmarks/bench_rules.py [--rules 10,100,1500] [--descriptions N]
+"""
+import argparse
+import os.path
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from csv_rules import Rules  # noqa: E402
+from synthetic import make_rules, make_descriptions  # noqa: E402
+
+
+def linear_match(rules, description, fields=None):
+    fields = dict(fields or {}, description=description)
+    result = dict(rules.defaults)
+    for pattern, actions in rules.rules:
+        if isinstance(pattern, tuple):
+            matched = all(p.search(fields.get(field, ''))
+                          for field, p in pattern)
+        else:
+            matched = pattern.search(description)
+        if matched:
+            result.update(actions)
+            return result
+    return result
+
+
+def make_field_rules(n, seed=0):
+    """Return Rules with `n` rules like those for a bank that puts the
+    payee's reference in its own column: mostly exact references, with
+    every tenth a regex on the reference and the amount."""
+    rnd = random.Random(seed)
+    rules = Rules()
+    for i in range(n):
+        if i % 10 == 0:
+            conditions = [('reference', 'INV{:03d}[0-9]+'.format(i)),
+                          ('amount', '^-{}\\.'.format(rnd.randrange(100)))]
+        else:
+            conditions = [('reference', '^REF{:05d}$'.format(i))]
+        rules.add(conditions, account2='expenses:{}'.format(i))
+    return rules
+
+
+def make_rows(n, rules, seed=0):
+    """Return `n` (description, fields) pairs, about half of which some
+    rule in `rules` matches."""
+    rnd = random.Random(seed)
+    rows = []
+    for _ in range(n):
+        i = rnd.randrange(2 * len(rules.rules))
+        if i % 10 == 0:
+            reference = 'INV{:03d}{}'.format(i, rnd.randrange(1000))
+        else:
+            reference = 'REF{:05d}'.format(i)
+        amount = '-{}.{:02d}'.format(rnd.randrange(100), rnd.randrange(100))
+        rows.append(('PAYMENT', {'reference': reference, 'amount': amount}))
+    return rows
+
+
+def bench(match, descriptions):
+    start = time.perf_counter()
+    for d in descriptions:
+        match(d)
+    return len(descriptions) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rules', default='10,100,1000,1500,5000')
+    parser.add_argument('--descriptions', type=int, default=2000)
+    args = parser.parse_args()
+
+    descriptions = make_descriptions(args.descriptions)
+    print('{:>6} {:>14} {:>14} {:>8}'
+          .format('rules', 'linear/s', 'compiled/s', 'speedup'))
+    for n in map(int, args.rules.split(',')):
+        rules = make_rules(n)
+        start = time.perf_counter()
+        rules.match('')
+        build = time.perf_counter() - start
+        assert all(rules.match(d) == linear_match(rules, d)
+                   for d in descriptions)
+        linear = bench(lambda d: linear_match(rules, d), descriptions)
+        compiled = bench(rules.match, descriptions)
+        print('{:6d} {:14.0f} {:14.0f} {:7.1f}x  (build {:.3f}s)'
+              .format(n, linear, compiled, compiled / linear, build))
+
+    print('\n{:>6} {:>14} {:>14} {:>8}'
+          .format('field', 'linear/s', 'indexed/s', 'speedup'))
+    for n in map(int, args.rules.split(',')):
+        rules = make_field_rules(n)
+        rows = make_rows(args.descriptions, rules)
+        start = time.perf_counter()
+        rules.match('', {})
+        build = time.perf_counter() - start
+        assert all(rules.match(d, f) == linear_match(rules, d, f)
+                   for d, f in rows)
+        # The match cache would hide the cost of matching
+        rules = make_field_rules(n)
+        rules._cached_match = rules._match
+        linear = bench(lambda r: linear_match(rules, *r), rows)
+        indexed = bench(lambda r: rules.match(*r), rows)
+        print('{:6d} {:14.0f} {:14.0f} {:7.1f}x  (build {:.3f}s)'
+              .format(n, linear, indexed, indexed / linear, build))
+
+
+if __name__ == '__main__':
+    main()
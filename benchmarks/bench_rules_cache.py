@@ -0,0 +1,44 @@
+"""Time loading a rules file with and without the parsed-rules cache.
+
+    python benchmarks/bench_rules_cache.py [--rules N]
+"""
+import argparse
+import os.path
+import sys
+import time
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from csv_rules import Rules  # noqa: E402
+from synthetic import write_rules  # noqa: E402
+
+def timed(f):
+    start = time.perf_counter()
+    f()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rules', type=int, default=1500)
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmp:
+        rules_file = os.path.join(tmp, 'rules')
+        cache_dir = os.path.join(tmp, 'cache')
+        with open(rules_file, 'w') as f:
+            write_rules(f, args.rules)
+
+        uncached = timed(lambda: Rules(rules_file))
+        first = timed(lambda: Rules(rules_file, cache_dir=cache_dir))
+        cached = timed(lambda: Rules(rules_file, cache_dir=cache_dir))
+        print('{} rules'.format(args.rules))
+        print('no cache:    {:.3f}s'.format(uncached))
+        print('cold cache:  {:.3f}s'.format(first))
+        print('warm cache:  {:.3f}s (saves {:.3f}s)'
+              .format(cached, uncached - cached))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Compare the peak memory of importing statements of growing size, with
+and without --stream.
+
+    python benchmarks/bench_stream.py [--rows N,N,...]
+"""
+import argparse
+import gc
+import os.path
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ledger_csv_merge import Merger  # noqa: E402
+import synthetic  # noqa: E402
+
+
+def measure(tmp, rows, stream):
+    rules_file = os.path.join(tmp, 'rules')
+    csv_file = os.path.join(tmp, 'statement.csv')
+    ledger_file = os.path.join(tmp, 'ledger.journal')
+    with open(rules_file, 'w') as f:
+        synthetic.write_rules(f, 100)
+    # The statement's balances do not follow on from the journal's, so
+    # leave them out for both modes to append.
+    with open(rules_file) as f:
+        rules = f.read().replace('amount, balance', 'amount, _')
+    with open(rules_file, 'w') as f:
+        f.write(rules)
+    with open(csv_file, 'w', newline='') as f:
+        synthetic.write_statement(f, rows)
+    with open(ledger_file, 'w') as f:
+        synthetic.write_journal(f, 1)
+
+    merger = Merger(ledger_file, rules_file, True, [csv_file],
+                    stream=stream)
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        merger.main()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del merger
+    return peak, elapsed, os.path.getsize(ledger_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', default='10000,40000,160000')
+    args = parser.parse_args()
+
+    for rows in map(int, args.rows.split(',')):
+        for stream in (False, True):
+            with TemporaryDirectory() as tmp:
+                peak, elapsed, size = measure(tmp, rows, stream)
+            print('{:8} rows {:9} {:8.1f} MB peak {:7.2f}s {:12} bytes '
+                  'journal'.format(rows, 'stream' if stream else 'default',
+                                   peak / 1e6, elapsed, size))
+
+
+if __name__ == '__main__':
+    main()
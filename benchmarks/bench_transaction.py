@@ -0,0 +1,87 @@
+"""Compare the memory and formatting time of Transaction against the
+old float-based class.
+
+    python benchmarks/bench_transaction.py [--count N]
+"""
+import argparse
+import gc
+import os.path
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from csv_importer import Transaction, parse_amount  # noqa: E402
+import synthetic  # noqa: E402
+
+
+class LegacyTransaction:
+    def __init__(self, date, account1, account2, amount, currency,
+                 description="", balance=None, code=None):
+        self.date = date
+        self.account1 = account1
+        self.account2 = account2
+        self.amount = amount
+        self.currency = currency
+        self.description = description
+        self.balance = balance
+        self.code = code
+
+    def __str__(self):
+        assertion = ''
+        if self.balance is not None:
+            assertion = " = {}{}".format(self.currency, self.balance)
+        maybe_code = ' ({})'.format(self.code) if self.code else ''
+        return "{}{} {}\n    {}  {}{:.02f}{}\n    {}  {}{:.02f}".format(
+            self.date, maybe_code, self.description,
+            self.account1, self.currency, self.amount, assertion,
+            self.account2, self.currency, -self.amount)
+
+
+def make(cls, rows, parse):
+    # Copy the date so that it is not shared with `rows`, as it would
+    # not be when read from a file.
+    return [cls(''.join(d), 'assets:bank', 'expenses:unknown',
+                parse(amount), '£', desc, parse(balance))
+            for d, desc, amount, balance in rows]
+
+
+def measure(name, cls, rows, parse):
+    gc.collect()
+    tracemalloc.start()
+    transactions = make(cls, rows, parse)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for t in transactions:
+        str(t)
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    for t in transactions:
+        str(t)
+    again = time.perf_counter() - start
+
+    n = len(transactions)
+    print('{:8} {:8.0f} bytes each {:10.0f}/s formatted '
+          '{:10.0f}/s formatted again'
+          .format(name, size / n, n / first, n / again))
+    return transactions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--count', type=int, default=200000)
+    args = parser.parse_args()
+
+    rows = list(synthetic.statement_rows(args.count))
+    # Descriptions are shared by both, so only the transactions count
+    legacy = measure('legacy', LegacyTransaction, rows, float)
+    new = measure('slotted', Transaction, rows, parse_amount)
+    for a, b in zip(legacy, new):
+        assert str(a).split(' = ')[0] == str(b).split(' = ')[0]
+
+
+if __name__ == '__main__':
+    main()
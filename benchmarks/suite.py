@@ -0,0 +1,200 @@
+"""Time each stage of an import on synthetic data.
+
+    python benchmarks/suite.py run [--rows N] [--rules N] [--years N]
+                                   [--jobs N] [--repeat N] [-o results.json]
+    python benchmarks/suite.py compare old.json new.json [--threshold 0.1]
+
+`run` prints a table and, with -o, writes the results as JSON.
+`compare` reports the change in each stage's time between two result
+files and exits with status 1 if any stage got slower by more than
+the threshold.
+
+"import split" is meant to show the split import scaling with --jobs,
+close to linearly with the cores. That is unverified: it has only been
+run on a single CPU, where more jobs can only add overhead.
+"""
+import argparse
+import json
+import os.path
+import platform
+import sys
+import time
+from contextlib import redirect_stdout
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from _ledger_parser import load_ledger  # noqa: E402
+from csv_importer import (read_transactions_from_csv,  # noqa: E402
+                          deduplicate, open_ledger, date_range)
+from csv_rules import Rules  # noqa: E402
+from balance_check import journal_balances, check_balances  # noqa: E402
+from row_fingerprints import RowFingerprints  # noqa: E402
+from ledger_csv_merge import Merger  # noqa: E402
+import synthetic  # noqa: E402
+
+
+def best_of(repeat, f):
+    """Return the shortest time of `repeat` calls of f, and its result."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def run_stages(args, tmp):
+    rules_file = os.path.join(tmp, 'rules')
+    csv_file = os.path.join(tmp, 'statement.csv')
+    ledger_file = os.path.join(tmp, 'ledger.journal')
+    statement = dict(rows=args.rows, days=args.days)
+    with open(rules_file, 'w') as f:
+        synthetic.write_rules(f, args.rules)
+    with open(csv_file, 'w', newline='') as f:
+        synthetic.write_statement(f, **statement)
+    with open(ledger_file, 'w') as f:
+        synthetic.write_journal(f, args.years, statement=statement)
+
+    results = {}
+
+    def stage(name, items, unit, f):
+        seconds, result = best_of(args.repeat, f)
+        rate = items / seconds if seconds else None
+        results[name] = {'seconds': seconds, 'items': items, 'unit': unit,
+                         'per_second': rate}
+        print('{:28} {:10.4f}s {:12} {:5} {:14.0f}/s'
+              .format(name, seconds, items, unit, rate or float('inf')))
+        return result
+
+    rules = stage('load_rules', args.rules, 'rules',
+                  lambda: Rules(rules_file))
+    descriptions = [row[1] for row in synthetic.statement_rows(**statement)]
+    stage('Rules.match', len(descriptions), 'rows',
+          lambda: [rules_match(rules, d) for d in descriptions])
+    transactions = stage(
+        'read_transactions_from_csv', args.rows, 'rows',
+        lambda: list(read_transactions_from_csv(csv_file, rules)))
+    ledger = stage('load_ledger', os.path.getsize(ledger_file), 'bytes',
+                   lambda: load_ledger(ledger_file))
+    new = stage('deduplicate_transactions', args.rows, 'rows', lambda: list(
+        deduplicate(transactions, open_ledger(
+            ledger_file, dates=date_range(transactions)))))
+    stage('check_balances', args.rows, 'rows', lambda: check_balances(
+        new, journal_balances(ledger_file, ['assets:bank'])))
+    # A statement imported before, read again
+    fingerprints = RowFingerprints(os.path.join(tmp, 'rows.sqlite'))
+    list(read_transactions_from_csv(csv_file, rules, fingerprints))
+    with fingerprints.recording():
+        pass
+    stage('skip imported rows', args.rows, 'rows', lambda: list(
+        read_transactions_from_csv(csv_file, rules, fingerprints)))
+    fingerprints.close()
+    # _format() is what __str__ caches, so time it directly
+    stage('Transaction.__str__', args.rows, 'rows',
+          lambda: [t._format() for t in transactions])
+    # The whole import of one statement, then with it split into chunks
+    # on --jobs processes
+    stage('import', args.rows, 'rows', lambda: merge(
+        ledger_file, rules_file, csv_file, 1, False))
+    stage('import split', args.rows, 'rows', lambda: merge(
+        ledger_file, rules_file, csv_file, args.jobs, True))
+
+    return {'transactions in journal': len(ledger),
+            'duplicates found': len(transactions) - len(new)}, results
+
+
+def merge(ledger_file, rules_file, csv_file, jobs, split):
+    merger = Merger(ledger_file, rules_file, False, [csv_file], jobs=jobs,
+                    split=split)
+    with redirect_stdout(StringIO()):
+        merger.reload()
+    return merger.transactions
+
+
+def rules_match(rules, description):
+    # Bypass the match cache, which would otherwise hide matching time
+    # after the first repeat.
+    return rules._match(description, ())[1]
+
+
+def run(args):
+    params = {k: getattr(args, k) for k in ('rows', 'rules', 'years',
+                                            'days', 'jobs', 'repeat')}
+    print(', '.join('{}={}'.format(k, v) for k, v in params.items()))
+    with TemporaryDirectory() as tmp:
+        counts, results = run_stages(args, tmp)
+    print(', '.join('{}: {}'.format(k, v) for k, v in counts.items()))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'params': params,
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'counts': counts,
+                       'results': results}, f, indent=2)
+            f.write('\n')
+
+
+def compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if old['params'] != new['params']:
+        print('warning: results are for different parameters')
+    regressions = []
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        before = old['results'][name]['seconds']
+        after = result['seconds']
+        change = after / before - 1
+        flag = ''
+        if change > args.threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        print('{:28} {:10.4f}s {:10.4f}s {:+8.1%} {}'
+              .format(name, before, after, change, flag))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help='time each stage')
+    p.add_argument('--rows', type=int, default=10000,
+                   help='statement rows (1k to 10M)')
+    p.add_argument('--rules', type=int, default=100,
+                   help='rules in the rules file (10 to 10k)')
+    p.add_argument('--years', type=int, default=1,
+                   help='years of journal history (1 to 100)')
+    p.add_argument('--days', type=int, default=365,
+                   help='days covered by the statement')
+    p.add_argument('--jobs', type=int, default=os.cpu_count(),
+                   help='processes for the split import (default: one '
+                   'per CPU)')
+    p.add_argument('--repeat', type=int, default=3,
+                   help='report the best of this many runs of each stage')
+    p.add_argument('-o', '--output', help='write results to this JSON file')
+
+    p = sub.add_parser('compare', help='compare two result files')
+    p.add_argument('old')
+    p.add_argument('new')
+    p.add_argument('--threshold', type=float, default=0.1,
+                   help='flag stages more than this fraction slower')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
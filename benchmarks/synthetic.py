@@ -0,0 +1,140 @@
+"""Deterministic synthetic statements, rules files and journals.
+
+Everything here depends only on its arguments and `seed`, so
+benchmark runs on different machines or revisions see the same data.
+"""
+import csv
+import os.path
+import random
+import sys
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from csv_rules import Rules  # noqa: E402
+
+WORDS = ('TESCO SAINSBURY AMAZON PAYPAL SALARY RENT COUNCIL WATER GAS '
+         'ELECTRIC TRAIN BUS COFFEE BOOKS CINEMA GYM PHARMACY FUEL').split()
+
+# The last day covered by generated journals and statements
+END = date(2020, 12, 31)
+
+RULES_HEADER = """skip 1
+fields date, description, amount, balance
+currency £
+account1 assets:bank
+account2 expenses:unknown
+"""
+
+
+def rule_list(n, seed=0):
+    """Return `n` (pattern, actions) pairs: mostly literal patterns, with
+    every tenth a regex."""
+    rnd = random.Random(seed)
+    rules = []
+    for i in range(n):
+        word = rnd.choice(WORDS)
+        if i % 10 == 0:
+            pattern = '{} STORE [0-9]+'.format(word)
+        else:
+            pattern = '{} {:04d}'.format(word, i)
+        rules.append((pattern, {'account2': 'expenses:{}'.format(i)}))
+    return rules
+
+
+def make_rules(n, seed=0):
+    rules = Rules()
+    for pattern, actions in rule_list(n, seed):
+        rules.add(pattern, **actions)
+    return rules
+
+
+def write_rules(f, n, seed=0):
+    f.write(RULES_HEADER)
+    for pattern, actions in rule_list(n, seed):
+        f.write('\nif {}\n'.format(pattern))
+        for k, v in actions.items():
+            f.write('  {} {}\n'.format(k, v))
+
+
+def make_description(rnd):
+    kind = rnd.random()
+    word = rnd.choice(WORDS)
+    if kind < 0.5:
+        return 'CARD PAYMENT TO {} {:04d} ON {:02d}/{:02d}'.format(
+            word, rnd.randrange(3000), rnd.randrange(1, 29),
+            rnd.randrange(1, 13))
+    elif kind < 0.8:
+        return '{} STORE {}'.format(word, rnd.randrange(100))
+    else:
+        return 'DIRECT DEBIT {}'.format(word)
+
+
+def make_descriptions(n, seed=1):
+    rnd = random.Random(seed)
+    return [make_description(rnd) for _ in range(n)]
+
+
+def statement_rows(rows, days=365, seed=1):
+    """Yield (date, description, amount, balance) rows spread over the
+    last `days` days up to END, in date order."""
+    rnd = random.Random(seed)
+    start = END - timedelta(days=days - 1)
+    balance = 0
+    for i in range(rows):
+        day = start + timedelta(days=i * days // rows)
+        amount = rnd.randrange(-20000, 5000)
+        balance += amount
+        yield (day.isoformat(), make_description(rnd),
+               '{:.2f}'.format(amount / 100), '{:.2f}'.format(balance / 100))
+
+
+def write_statement(f, rows, days=365, seed=1):
+    writer = csv.writer(f)
+    writer.writerow(['Date', 'Description', 'Amount', 'Balance'])
+    writer.writerows(statement_rows(rows, days, seed))
+
+
+def make_journal(n, seed=0):
+    """Return a date-ordered journal of `n` transactions ending at END,
+    and a query that finds each as a duplicate."""
+    rnd = random.Random(seed)
+    start = END - timedelta(days=(n - 1) // 10)
+    queries = []
+    lines = []
+    for i in range(n):
+        day = (start + timedelta(days=i // 10)).isoformat()
+        desc = 'Payee {} ref {}'.format(rnd.randrange(500), i)
+        amount = rnd.randrange(-100000, 100000) / 100
+        lines.append('{} {}\n    assets:bank  £{:.02f}\n    expenses:misc\n'
+                     .format(day, desc, amount))
+        queries.append(dict(date=day, desc=desc, acct='assets:bank',
+                            amt=amount, cur='£'))
+    return '\n'.join(lines), queries
+
+
+def write_journal(f, years, per_day=3, statement=None, overlap=0.1,
+                  seed=2):
+    """Write `years` of history ending at END.
+
+    If `statement` (the arguments of statement_rows) is given, the
+    first `overlap` fraction of its rows is also entered in the
+    journal, as an earlier import of it would have, so that
+    deduplication finds some duplicates.
+    """
+    rnd = random.Random(seed)
+    imported = []
+    if statement is not None:
+        rows = list(statement_rows(**statement))
+        imported = rows[:int(len(rows) * overlap)]
+    history_end = date.fromisoformat(imported[0][0]) if imported else END
+    day = END - timedelta(days=365 * years)
+    while day < history_end:
+        for _ in range(per_day):
+            f.write('{} {}\n    assets:bank  £{:.2f}\n    expenses:misc\n\n'
+                    .format(day.isoformat(), make_description(rnd),
+                            rnd.randrange(-20000, 5000) / 100))
+        day += timedelta(days=1)
+    for d, desc, amount, _ in imported:
+        f.write('{} {}\n    assets:bank  £{}\n    expenses:unknown\n\n'
+                .format(d, desc, amount))
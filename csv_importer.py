@@ -1,31 +1,157 @@
+import io
+import os
 import re
+import gc
 import csv
-from datetime import datetime
+import mmap
+import logging
+import shutil
+from string import Formatter
+from collections import deque
+from contextlib import contextmanager
+from datetime import date as date_type, datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+import profiling
 from csv_rules import Rules
 from ledger_wrapper import Ledger
+from ledger_index import LedgerIndex, normalize_date
+from journal_index import JournalIndex
+from journal_tree import has_includes
+from _ledger_parser import LedgerSyntaxError, format_syntax_error
+
+ISO_DATE = re.compile(r'[0-9]{4}-[0-9]{2}-[0-9]{2}$')
+
+
+def parse_amount(text):
+    """Return the amount `text` as an integer number of minor units and
+    the number of decimal places, so '-10.15' gives (-1015, 2).
+
+    Raises ValueError if `text` is not a finite number.
+    """
+    whole, _, fraction = text.strip().partition('.')
+    try:
+        return int(whole + fraction), len(fraction)
+    except ValueError:
+        pass
+    # Exponents and other forms Decimal accepts
+    try:
+        value = Decimal(text.strip())
+    except InvalidOperation:
+        raise ValueError('not an amount: {!r}'.format(text)) from None
+    if not value.is_finite():
+        raise ValueError('not an amount: {!r}'.format(text))
+    places = max(0, -value.as_tuple().exponent)
+    return int(value.scaleb(places)), places
+
+
+def to_units(value):
+    """parse_amount() for a str, int, float or Decimal; a (units,
+    places) pair is returned as is."""
+    if isinstance(value, tuple):
+        return value
+    if isinstance(value, int):
+        return value, 0
+    if isinstance(value, float):
+        value = repr(value)
+    return parse_amount(str(value))
+
+
+def format_units(units, places):
+    """Format an amount with at least two decimal places. Zero has no
+    sign, whatever the sign it was read with."""
+    if places < 2:
+        units *= 10 ** (2 - places)
+        places = 2
+    digits = str(abs(units)).rjust(places + 1, '0')
+    return ('-' if units < 0 else '') + \
+        digits[:-places] + '.' + digits[-places:]
+
+
+def parse_date(text):
+    """Return the day ordinal of a YYYY-MM-DD date, or `text` itself if
+    it is not one."""
+    if ISO_DATE.match(text):
+        try:
+            return date_type.fromisoformat(text).toordinal()
+        except ValueError:
+            pass
+    return text
+
+
+@lru_cache(maxsize=4096)
+def _iso_date(ordinal):
+    return date_type.fromordinal(ordinal).isoformat()
 
 
 class Transaction:
+    """One transaction made from a statement row.
+
+    Amounts are held exactly, as integer minor units, and ISO dates as
+    day ordinals; `amount` and `balance` are Decimals. Transactions are
+    not changed once made, so __str__ caches its result.
+    """
+
+    __slots__ = ('_date', 'account1', 'account2', '_amount', '_places',
+                 'currency', 'description', '_balance', '_balance_places',
+                 'code', '_str')
+
     def __init__(self, date, account1, account2, amount, currency,
                  description="", balance=None, code=None):
-        self.date = date
+        # `date` may also be a day ordinal from parse_date()
+        self._date = date if isinstance(date, int) else parse_date(date)
         self.account1 = account1
         self.account2 = account2
-        self.amount = amount
+        self._amount, self._places = to_units(amount)
         self.currency = currency
         self.description = description
-        self.balance = balance
+        if balance is None:
+            self._balance = self._balance_places = None
+        else:
+            self._balance, self._balance_places = to_units(balance)
         self.code = code
+        self._str = None
+
+    @property
+    def date(self):
+        if isinstance(self._date, int):
+            return _iso_date(self._date)
+        return self._date
+
+    @property
+    def ordinal(self):
+        """The day ordinal of the date, or None if it is not an ISO
+        date."""
+        return self._date if isinstance(self._date, int) else None
+
+    @property
+    def amount(self):
+        return Decimal(self._amount).scaleb(-self._places)
+
+    @property
+    def balance(self):
+        if self._balance is None:
+            return None
+        return Decimal(self._balance).scaleb(-self._balance_places)
 
     def __str__(self):
+        if self._str is None:
+            self._str = self._format()
+        return self._str
+
+    def _format(self):
+        currency = self.currency
         assertion = ''
-        if self.balance is not None:
-            assertion = " = {}{}".format(self.currency, self.balance)
+        if self._balance is not None:
+            assertion = ' = ' + currency + format_units(
+                self._balance, self._balance_places)
         maybe_code = ' ({})'.format(self.code) if self.code else ''
-        return "{}{} {}\n    {}  {}{:.02f}{}\n    {}  {}{:.02f}".format(
-            self.date, maybe_code, self.description,
-            self.account1, self.currency, self.amount, assertion,
-            self.account2, self.currency, -self.amount)
+        amount = format_units(self._amount, self._places)
+        negated = format_units(-self._amount, self._places)
+        return ''.join((
+            self.date, maybe_code, ' ', self.description,
+            '\n    ', self.account1, '  ', currency, amount, assertion,
+            '\n    ', self.account2, '  ', currency, negated))
 
 
 REQUIRED_FIELDS = set([
@@ -35,60 +161,383 @@ REQUIRED_FIELDS = set([
     'account2',
     'amount',
 ])
+# Those that cannot be taken from a column when the rules leave them out
+_REQUIRED_COLUMNLESS = REQUIRED_FIELDS.difference(
+    ['date', 'description', 'amount'])
+
+
+class RowPlan:
+    """Everything needed to turn rows of one CSV file into transactions
+    that can be worked out before reading the rows.
+
+    Column indexes are resolved once, each template string in the
+    rules is parsed once into a function of the row, and the rules'
+    result for recently seen descriptions is kept already split into
+    constants and templates.
+
+    Rules that test fields other than the description see them by the
+    name given in `fields`, or by number counting from 1.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.fields = list(rules.options['fields'])
+        # Templates see the last column of a given name, as
+        # str.format(**row_dict) would, but the date, amount and
+        # balance defaults come from the first.
+        self._columns = {name: i for i, name in enumerate(self.fields)}
+        first = {name: self.fields.index(name) for name in self._columns}
+        self._description = self._columns['description']
+        self._date = first.get('date')
+        self._amount = first.get('amount')
+        self._balance = first.get('balance')
+        self._conditions = []
+        for name in rules.condition_fields:
+            if name in first:
+                self._conditions.append(first[name])
+            elif name.isdigit() and 0 < int(name) <= len(self.fields):
+                self._conditions.append(int(name) - 1)
+            else:
+                raise RuntimeError("Rules test unknown field: {}"
+                                   .format(name))
+        self._templates = {}
+        self._resolve = lru_cache(maxsize=4096)(self._resolve)
+
+    def template(self, s):
+        """Return a function formatting `s` with the fields of a row, or
+        the formatted string itself if `s` uses no fields."""
+        try:
+            return self._templates[s]
+        except KeyError:
+            f = self._templates[s] = self._compile_template(s)
+            return f
+
+    def _compile_template(self, s):
+        parts = []
+        try:
+            for literal, name, spec, conversion in Formatter().parse(s):
+                if name is None:
+                    parts.append((literal, None, '', None))
+                elif name in self._columns and '{' not in spec:
+                    parts.append((literal, self._columns[name], spec,
+                                  conversion))
+                else:
+                    raise ValueError(name)
+        except ValueError:
+            # Positional, nested or unknown fields: leave it to str.format
+            return lambda row: s.format(**dict(zip(self.fields, row)))
+
+        if all(i is None for _, i, _, _ in parts):
+            return ''.join(literal for literal, _, _, _ in parts)
+        if len(parts) == 1 and not parts[0][0] and not parts[0][2] \
+                and parts[0][3] is None:
+            i = parts[0][1]
+            return lambda row: row[i]
 
+        def format_row(row):
+            out = []
+            for literal, i, spec, conversion in parts:
+                out.append(literal)
+                if i is not None:
+                    value = row[i]
+                    if conversion == 'r':
+                        value = repr(value)
+                    elif conversion == 'a':
+                        value = ascii(value)
+                    out.append(format(value, spec))
+            return ''.join(out)
+        return format_row
 
-def read_transactions_from_csv(filename, rules):
-    def field(name, line):
-        i = list(rules.options['fields']).index(name)
-        return line[i]
+    def _resolve(self, desc, values=()):
+        """Return the index of the rule matching `desc` and `values`, the
+        row's condition_values(), and the rules' result split into
+        constant values and templates that depend on the row."""
+        constants = {}
+        templates = []
+        index, match = self.rules.match_rule(
+            desc, dict(zip(self.rules.condition_fields, values)))
+        for k, v in match.items():
+            if isinstance(v, str):
+                f = self.template(v)
+                if isinstance(f, str):
+                    constants[k] = f
+                else:
+                    templates.append((k, f))
+            else:
+                constants[k] = v
+        return index, constants, templates
+
+    def description(self, row):
+        # The * looks like a reconciled transaction so don't allow
+        # it at start of descriptions.
+        # TODO: should probably strip any non-alphanum chars
+        return row[self._description].lstrip('*')
+
+    def condition_values(self, row):
+        """Return the values of the fields the rules test, other than the
+        description."""
+        return tuple(row[i] for i in self._conditions)
+
+    def transaction(self, row):
+        return self.convert(row)[1]
+
+    def convert(self, row):
+        """Return the index of the rule that matched `row` (or None) and
+        the transaction made from it."""
+        desc = self.description(row)
+        date = amount = balance = None
+        if self._date is not None:
+            date = row[self._date]
+        if self._amount is not None:
+            try:
+                amount = parse_amount(row[self._amount])
+            except ValueError:
+                pass
+        if self._balance is not None:
+            try:
+                balance = parse_amount(row[self._balance])
+            except ValueError:
+                pass
+        if self._conditions:
+            resolved = self._resolve(desc, self.condition_values(row))
+        else:
+            resolved = self._resolve(desc)
+        return self.build(row, desc, resolved, date, amount, balance)
+
+    def build(self, row, desc, resolved, date, amount, balance):
+        """Make the transaction for `row`, given its description, the
+        result of _resolve() for it, and its date, amount and balance
+        columns already parsed (None if missing or not a number)."""
+        index, constants, templates = resolved
+        if profiling.current is not None:
+            profiling.current.rule_hit(index)
+            profiling.current.count('rows converted')
+        match = constants
+        if templates:
+            # Do string formatting with CSV fields
+            match = dict(constants)
+            for k, f in templates:
+                match[k] = f(row)
+
+        get = match.get
+        date = get('date', date)
+        amount = get('amount', amount)
+        if date is None or amount is None or \
+                not match.keys() >= _REQUIRED_COLUMNLESS:
+            present = set(match).union(['description'])
+            present.update(k for k, v in [('date', date), ('amount', amount)]
+                           if v is not None)
+            raise RuntimeError("Required field missing: {}"
+                               .format(REQUIRED_FIELDS.difference(present)))
+
+        return index, Transaction(date,
+                                  match['account1'],
+                                  match['account2'],
+                                  amount,
+                                  match['currency'],
+                                  get('description', desc),
+                                  get('balance', balance),
+                                  get('code', None))
+
+
+# Bytes of a CSV file counted at a time by chunk_ranges()
+SCAN_SIZE = 1 << 20
+
+
+def _count_quotes(mm, start, end):
+    n = 0
+    for pos in range(start, end, SCAN_SIZE):
+        n += mm[pos:min(pos + SCAN_SIZE, end)].count(b'"')
+    return n
+
+
+def chunk_ranges(filename, chunks, skip=0):
+    """Split the rows of a CSV file after its first `skip` lines into up
+    to `chunks` byte ranges (start, end) of about the same size.
+
+    Each range ends just after a newline outside quoted fields, so that
+    no row, even one with newlines in a quoted field, is split.
+    """
+    with open(filename, 'rb') as f:
+        for _ in range(skip):
+            f.readline()
+        start = pos = f.tell()
+        size = os.fstat(f.fileno()).st_size
+        if start >= size:
+            return []
+        ranges = []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            first = start
+            quotes = 0
+            for k in range(1, chunks):
+                target = first + (size - first) * k // chunks
+                if target <= pos:
+                    continue
+                quotes += _count_quotes(mm, pos, target)
+                pos = target
+                # On to the first newline with an even number of quotes
+                # before it in the range
+                while pos < size:
+                    newline = mm.find(b'\n', pos)
+                    end = size if newline < 0 else newline + 1
+                    quotes += _count_quotes(mm, pos, end)
+                    pos = end
+                    if quotes % 2 == 0:
+                        break
+                if pos >= size:
+                    break
+                ranges.append((start, pos))
+                start = pos
+                quotes = 0
+        ranges.append((start, size))
+    return ranges
+
+
+def read_rows(filename, rules, fingerprints=None, chunk=None):
+    """Yield the rows of a CSV file, leaving out those that the
+    RowFingerprints `fingerprints` have recorded as imported before.
+
+    With `chunk`, a (start, end) range from chunk_ranges(), only the rows
+    in that part of the file are read. Fingerprints tell identical rows
+    apart by how many came before in the whole file, so cannot be used
+    then.
+    """
+    if chunk is not None:
+        if fingerprints is not None:
+            raise ValueError('Rows read in chunks cannot be checked '
+                             'against fingerprints')
+        start, end = chunk
+        with open(filename, 'rb') as f:
+            f.seek(start)
+            data = f.read(end - start)
+        # Decoded as open() would, with the same newline handling
+        yield from csv.reader(io.TextIOWrapper(io.BytesIO(data)))
+        return
     with open(filename, 'r') as f:
         for i in range(rules.options.get('skip', 0)):
             f.readline()
-        reader = csv.reader(f)
-        for line_list in reader:
-            line = {}
-            for i, fieldname in enumerate(rules.options['fields']):
-                line[i] = line[fieldname] = line_list[i]
-
-            # The * looks like a reconciled transaction so don't allow
-            # it at start of descriptions.
-            # TODO: should probably strip any non-alphanum chars
-            desc = line['description'].lstrip('*')
-
-            match = rules.match(desc)
-            if 'date' not in match:
-                match['date'] = field('date', line)
-            if 'amount' not in match:
-                try:
-                    match['amount'] = float(field('amount', line))
-                except ValueError:
-                    pass
-            if 'balance' not in match:
-                try:
-                    match['balance'] = float(field('balance', line))
-                except ValueError:
-                    pass
-            if 'description' not in match:
-                match['description'] = desc
-            missing_keys = REQUIRED_FIELDS.difference(match.keys())
-            if missing_keys:
-                raise RuntimeError("Required field missing: {}"
-                                   .format(missing_keys))
+        rows = csv.reader(f)
+        if fingerprints is not None:
+            rows = fingerprints.filter(filename, rules, rows)
+        yield from rows
 
-            # Do string formatting with CSV fields
-            for k in match:
-                if isinstance(match[k], str):
-                    match[k] = match[k].format(**line)
-
-            t = Transaction(match['date'],
-                            match['account1'],
-                            match['account2'],
-                            match['amount'],
-                            match['currency'],
-                            match['description'],
-                            match.get('balance', None),
-                            match.get('code', None))
+
+INGEST_MODES = ('rows', 'columnar')
+
+
+@contextmanager
+def paused_gc():
+    """Pause the cyclic garbage collector, which would otherwise rescan
+    every row loaded so far each time it runs while a whole file is
+    loaded. Rows hold only strings, so they make no cycles."""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def convert_rows(plan, rows):
+    """Yield (rule index, transaction) for each of a list of rows.
+
+    Rows are converted one at a time, unless the rules' `ingest` option
+    is 'columnar' and NumPy is installed, in which case the list is
+    converted column by column. Either way the results are the same.
+    """
+    mode = plan.rules.options.get('ingest', 'rows')
+    if mode not in INGEST_MODES:
+        raise ValueError("Unknown ingest mode: {!r}".format(mode))
+    if mode == 'columnar':
+        try:
+            import _columnar
+        except ImportError:
+            logging.warning('NumPy is not installed; converting CSV rows '
+                            'one at a time')
+        else:
+            return _columnar.convert_rows(plan, rows)
+    return map(plan.convert, rows)
+
+
+def read_transactions_from_csv(filename, rules, fingerprints=None,
+                               chunk=None):
+    plan = RowPlan(rules)
+    rows = read_rows(filename, rules, fingerprints, chunk)
+    if rules.options.get('ingest', 'rows') != 'rows':
+        with paused_gc():
+            rows = list(profiling.timed('read csv', rows))
+        converted = profiling.timed('convert rows', convert_rows(plan, rows))
+        for _, t in converted:
             yield t
+        return
+    transaction = profiling.timed_call('convert rows', plan.transaction)
+    for row in profiling.timed('read csv', rows):
+        yield transaction(row)
+
+
+class StatementCache:
+    """The rows of one CSV file and the transactions made from them.
+
+    Kept between reloads so that when the rules change, only rows whose
+    winning rule could be different are converted again. The file is
+    re-read if it, or the rules' options or source account, change.
+    """
+
+    def __init__(self, filename, fingerprints=None):
+        self.filename = filename
+        self._fingerprints = fingerprints
+        self._stat = None
+        self._rows = []
+        self._rules = None
+        self._winners = []
+        self.transactions = []
+
+    def update(self, rules):
+        """Bring self.transactions up to date with `rules`, returning the
+        number of rows converted again."""
+        st = os.stat(self.filename)
+        stat = (st.st_mtime_ns, st.st_size)
+        old = self._rules
+        if (old is None or stat != self._stat or
+                rules.options != old.options or
+                rules.defaults.get('account1') !=
+                old.defaults.get('account1')):
+            self._rows = list(profiling.timed('read csv', read_rows(
+                self.filename, rules, self._fingerprints)))
+            self._stat = stat
+            old = None
+        self._rules = _RulesSnapshot(rules)
+
+        if old is None or rules.defaults != old.defaults:
+            unchanged = 0
+        else:
+            # Rules before the first difference are the same, so a row
+            # won by one of them is still won by it.
+            unchanged = 0
+            for a, b in zip(old.rules, rules.rules):
+                if a != b:
+                    break
+                unchanged += 1
+
+        if old is None:
+            self._winners = [None] * len(self._rows)
+            self.transactions = [None] * len(self._rows)
+        stale = [i for i, winner in enumerate(self._winners)
+                 if self.transactions[i] is None or
+                 winner is None or winner >= unchanged]
+        converted = profiling.timed('convert rows', convert_rows(
+            RowPlan(rules), [self._rows[i] for i in stale]))
+        for i, (winner, t) in zip(stale, converted):
+            self._winners[i], self.transactions[i] = winner, t
+        return len(stale)
+
+
+class _RulesSnapshot:
+    def __init__(self, rules):
+        self.options = dict(rules.options)
+        self.defaults = dict(rules.defaults)
+        self.rules = list(rules.rules)
 
 
 def escape(s):
@@ -97,28 +546,247 @@ def escape(s):
     return s
 
 
-def deduplicate_transactions(transactions, ledger):
+def deduplicate_transactions(transactions, ledger, chunk_size=500):
+    chunk = []
     for t in transactions:
-        existing = ledger.find_transaction(
-            date=t.date,
-            desc=escape(t.description),
-            acct=t.account1,
-            amt=t.amount,
-            cur=t.currency)
+        chunk.append(t)
+        if len(chunk) >= chunk_size:
+            yield from _deduplicate_chunk(chunk, ledger)
+            chunk = []
+    yield from _deduplicate_chunk(chunk, ledger)
+
+
+def _query(t):
+    return dict(date=t.date,
+                desc=escape(t.description),
+                acct=t.account1,
+                amt=t.amount,
+                cur=t.currency)
+
+
+def _deduplicate_chunk(transactions, ledger):
+    existing = ledger.find_transactions([_query(t) for t in transactions])
+    for t, found in zip(transactions, existing):
+        if not found:
+            yield t
+
+
+# hledger queries run at once by deduplicate_async()
+HLEDGER_CONCURRENCY = 4
+
+
+async def deduplicate_async(transactions, ledger, chunk_size=500,
+                            limit=None):
+    """Like deduplicate_transactions(), as an async generator.
+
+    The hledger query for each chunk is started as soon as the chunk
+    has been read, and while it runs further chunks are read and
+    queried, up to the asyncio.Semaphore `limit` (by default
+    HLEDGER_CONCURRENCY queries at once). Unique transactions are
+    still yielded in input order.
+    """
+    # asyncio is slow to import, and only used for hledger queries
+    import asyncio
+    if limit is None:
+        limit = asyncio.Semaphore(HLEDGER_CONCURRENCY)
+
+    async def query(chunk):
+        async with limit:
+            existing = await ledger.find_transactions_async(
+                [_query(t) for t in chunk])
+        return [t for t, found in zip(chunk, existing) if not found]
+
+    pending = deque()
+    try:
+        chunk = []
+        for t in transactions:
+            chunk.append(t)
+            if len(chunk) < chunk_size:
+                continue
+            pending.append(asyncio.ensure_future(query(chunk)))
+            chunk = []
+            # Let the query start, and pass on any finished in order
+            await asyncio.sleep(0)
+            while pending and pending[0].done():
+                for t in pending.popleft().result():
+                    yield t
+        if chunk:
+            pending.append(asyncio.ensure_future(query(chunk)))
+        while pending:
+            for t in await pending[0]:
+                yield t
+            pending.popleft()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+def deduplicate_concurrently(statements, ledger,
+                             concurrency=HLEDGER_CONCURRENCY):
+    """Deduplicate each of a list of lists of transactions against a
+    Ledger, running up to `concurrency` hledger queries at once across
+    all of them. Returns a list of the unique transactions of each."""
+    import asyncio
+
+    async def run():
+        limit = asyncio.Semaphore(concurrency)
+
+        async def unique(transactions):
+            return [t async for t in deduplicate_async(transactions, ledger,
+                                                       limit=limit)]
+        return await asyncio.gather(*map(unique, statements))
+    return asyncio.run(run())
+
+
+def deduplicate_transactions_indexed(transactions, index, fuzzy=None):
+    """Drop transactions found in the LedgerIndex `index`: exactly, or
+    within the FuzzyMatch `fuzzy` if given, each posting in the index
+    near matching one transaction at most."""
+    claimed = set()
+    for t in transactions:
+        if fuzzy is None:
+            existing = index.find_transaction(
+                date=t.date,
+                desc=t.description,
+                acct=t.account1,
+                amt=t.amount,
+                cur=t.currency)
+        else:
+            existing = index.find_similar(
+                date=t.date,
+                desc=t.description,
+                acct=t.account1,
+                amt=t.amount,
+                cur=t.currency,
+                fuzzy=fuzzy,
+                claimed=claimed)
         if not existing:
             yield t
 
 
-def get_transactions(filename, rules, existing_ledger=None):
-    transactions = read_transactions_from_csv(filename, rules)
+class MemoizedLedger:
+    """Wrap a Ledger, remembering the result of each query."""
+
+    def __init__(self, ledger):
+        self._ledger = ledger
+        self._results = {}
+
+    def find_transaction(self, **query):
+        key = tuple(sorted(query.items()))
+        if key not in self._results:
+            profiling.count('hledger query cache misses')
+            self._results[key] = self._ledger.find_transaction(**query)
+        else:
+            profiling.count('hledger query cache hits')
+        return self._results[key]
+
+    def _missing(self, queries):
+        """Return the key of each query, and the queries not yet run."""
+        keys = [tuple(sorted(q.items())) for q in queries]
+        missing = {}
+        for key, query in zip(keys, queries):
+            if key not in self._results:
+                missing[key] = query
+        profiling.count('hledger query cache hits', len(keys) - len(missing))
+        profiling.count('hledger query cache misses', len(missing))
+        return keys, missing
+
+    def find_transactions(self, queries):
+        keys, missing = self._missing(queries)
+        if missing:
+            found = self._ledger.find_transactions(list(missing.values()))
+            self._results.update(zip(missing, found))
+        return [self._results[key] for key in keys]
+
+    async def find_transactions_async(self, queries):
+        keys, missing = self._missing(queries)
+        if missing:
+            found = await self._ledger.find_transactions_async(
+                list(missing.values()))
+            self._results.update(zip(missing, found))
+        return [self._results[key] for key in keys]
+
+
+def date_range(transactions, margin=0):
+    """Return the first and last dates of `transactions`, widened by
+    `margin` days either side, or None if any date is not in YYYY-MM-DD
+    form."""
+    dates = set(normalize_date(t.date) for t in transactions)
+    if not dates or not all(ISO_DATE.match(d) for d in dates):
+        return None
+    if not margin:
+        return min(dates), max(dates)
+    margin = timedelta(days=margin)
+    return ((date_type.fromisoformat(min(dates)) - margin).isoformat(),
+            (date_type.fromisoformat(max(dates)) + margin).isoformat())
+
+
+def open_ledger(existing_ledger, use_hledger=False, dates=None, jobs=1,
+                cache_dir=None):
+    """Return something to deduplicate against `existing_ledger`.
+
+    A filename gives a LedgerIndex of the file, limited to the
+    (start, end) range `dates` if given, or a Ledger that queries
+    hledger if `use_hledger` is set; anything else is returned as is.
+    `jobs` and `cache_dir` are for reading the files a journal
+    includes.
+
+    With a `cache_dir`, a journal that includes no other files is
+    indexed whole, by a JournalIndex kept next to it that only parses
+    what has been appended since it was stored.
+    """
+    if not isinstance(existing_ledger, str):
+        return existing_ledger
+    if use_hledger:
+        return Ledger(existing_ledger)
+    if cache_dir is not None and not has_includes(existing_ledger):
+        return JournalIndex(existing_ledger)
+    start, end = dates if dates is not None else (None, None)
+    return LedgerIndex(existing_ledger, start, end, jobs, cache_dir)
+
+
+def deduplicate(transactions, ledger, fuzzy=None):
+    """Drop transactions already in `ledger`. The FuzzyMatch `fuzzy`
+    also drops near matches, if `ledger` is a LedgerIndex."""
+    if isinstance(ledger, LedgerIndex):
+        unique = deduplicate_transactions_indexed(transactions, ledger,
+                                                  fuzzy)
+    else:
+        unique = deduplicate_transactions(transactions, ledger)
+    return profiling.timed('deduplicate', unique)
+
+
+def get_transactions(filename, rules, existing_ledger=None,
+                     use_hledger=False, fuzzy=None, fingerprints=None,
+                     chunk=None):
+    """Read transactions from a CSV file, or from the `chunk` of it given
+    by chunk_ranges(), dropping those already in `existing_ledger`.
+
+    `existing_ledger` is a ledger filename, or an already opened
+    LedgerIndex or Ledger. A filename is indexed in memory to find
+    duplicates, unless `use_hledger` is set, in which case hledger is
+    queried for batches of transactions. With a FuzzyMatch `fuzzy`,
+    a LedgerIndex also finds near duplicates. Rows recorded by the
+    RowFingerprints `fingerprints` are dropped before any of that.
+    """
+    transactions = read_transactions_from_csv(filename, rules, fingerprints,
+                                              chunk)
     if existing_ledger:
-        ledger = Ledger(existing_ledger)
-        transactions = deduplicate_transactions(transactions, ledger)
+        dates = None
+        if isinstance(existing_ledger, str) and not use_hledger:
+            # Only the statement's dates need to be indexed
+            transactions = list(transactions)
+            dates = date_range(transactions,
+                               fuzzy.days if fuzzy is not None else 0)
+        transactions = deduplicate(
+            transactions, open_ledger(existing_ledger, use_hledger, dates),
+            fuzzy)
     return transactions
 
 
-def print_transactions(filename, rules, existing_ledger):
-    transactions = get_transactions(filename, rules, existing_ledger)
+def print_transactions(filename, rules, existing_ledger, use_hledger=False):
+    transactions = get_transactions(filename, rules, existing_ledger,
+                                    use_hledger)
     print("; Converted from {}\n; [{}]\n"
           .format(filename, datetime.now().replace(microsecond=0)))
     for t in transactions:
@@ -126,6 +794,38 @@ def print_transactions(filename, rules, existing_ledger):
         print()
 
 
+def write_statement(f, filename, transactions, now):
+    """Write `transactions` to the journal file object `f`, under a
+    comment naming the CSV file they are from."""
+    print('; Converted from {}'.format(filename), file=f)
+    print('; [{}]\n'.format(now), file=f)
+    for t in transactions:
+        print(str(t) + '\n', file=f)
+
+
+def append_transactions(ledger_file, statements):
+    """Append the transactions of each (filename, transactions) in
+    `statements` to `ledger_file`."""
+    now = datetime.now().replace(microsecond=0)
+    with profiling.stage('append'), open(ledger_file, 'ta') as f:
+        for filename, transactions in statements:
+            write_statement(f, filename, transactions, now)
+
+
+# Bytes copied at a time by append_spool()
+COPY_BUFFER = 1 << 20
+
+
+def append_spool(ledger_file, spool_file):
+    """Append the contents of `spool_file`, written by write_statement(),
+    to `ledger_file`, and flush them to disk."""
+    with profiling.stage('append'), open(spool_file, 'rb') as src, \
+            open(ledger_file, 'ab') as dst:
+        shutil.copyfileobj(src, dst, COPY_BUFFER)
+        dst.flush()
+        os.fsync(dst.fileno())
+
+
 def main():
     import sys
     rules = Rules(sys.argv[1])
@@ -133,7 +833,10 @@ def main():
         existing_ledger = sys.argv[3]
     else:
         existing_ledger = None
-    print_transactions(sys.argv[2], rules, existing_ledger)
+    try:
+        print_transactions(sys.argv[2], rules, existing_ledger)
+    except LedgerSyntaxError as err:
+        sys.exit(format_syntax_error(err))
 
 
 if __name__ == "__main__":
@@ -1,5 +1,10 @@
+import io
 import re
-from _rules_parser import load_rules
+import time
+from functools import lru_cache
+import profiling
+from _rules_cache import read_keyed, load_cached, store_cached
+from _rule_matcher import CompiledMatcher, ConditionMatcher
 
 
 ALLOWED_FIELDS = [
@@ -18,43 +23,210 @@ ALLOWED_FIELDS = [
 ]
 
 
+# A condition line testing a CSV field other than the description
+FIELD_CONDITION = re.compile(r'%([\w-]+)\s+(\S.*)$')
+
+
+def load_rules(rules_file):
+    # The grammar is only imported, and built, when the rules are not
+    # cached.
+    from _rules_parser import load_rules
+    return load_rules(rules_file)
+
+
+def _alternatives(lines):
+    """Return the conditions under which an if block applies, one for
+    each of its condition lines, as in hledger: a pattern to search the
+    description for, or, for lines testing other fields ("%amount
+    ^-10\\.00$") or joined to the line before with "& ", a list of
+    [field, pattern] pairs that must all match."""
+    alternatives = []
+    for line in lines:
+        conjoined = line.startswith('& ') and alternatives
+        if conjoined:
+            line = line[2:].strip()
+        m = FIELD_CONDITION.match(line)
+        condition = list(m.groups()) if m else ['description', line]
+        if conjoined:
+            if isinstance(alternatives[-1], str):
+                alternatives[-1] = [['description', alternatives[-1]]]
+            alternatives[-1].append(condition)
+        elif condition[0] == 'description':
+            alternatives.append(condition[1])
+        else:
+            alternatives.append([condition])
+    return alternatives
+
+
 class Rules:
-    def __init__(self, rules_file=None):
+    """Rules for converting CSV rows to transactions.
+
+    A rule's pattern is either a compiled regex searched for in the
+    description, or a tuple of (field, compiled regex) conditions on the
+    CSV fields that must all match. Rules are tried in order, and the
+    fields that any of them test, besides the description, are listed
+    in `condition_fields`.
+
+    Match results are kept in an LRU cache of up to `cache_size`
+    descriptions (None for no limit, 0 to disable it), which is
+    cleared whenever the rules or defaults change.
+
+    If `cache_dir` is given, rules files loaded by name are parsed
+    only once; later loads use the parsed rules stored there until
+    the file changes.
+    """
+
+    def __init__(self, rules_file=None, cache_size=1024, cache_dir=None):
         self.rules = []
         self.options = {}
         self.defaults = {}
+        self.condition_fields = ()
+        self._cache_dir = cache_dir
+        self._matcher = None
+        self._cached_match = lru_cache(maxsize=cache_size)(self._match)
         if rules_file is not None:
             self.load(rules_file)
 
     def load(self, rules_file):
+        with profiling.stage('load rules'):
+            self._load(rules_file)
+
+    def _load(self, rules_file):
+        parsed = None
+        use_cache = self._cache_dir is not None and \
+            isinstance(rules_file, str)
+        if use_cache:
+            contents, key = read_keyed(rules_file)
+            parsed = load_cached(rules_file, self._cache_dir, key)
+            profiling.count('rules file cache hits' if parsed is not None
+                            else 'rules file cache misses')
+        if parsed is None:
+            if use_cache:
+                # Decoded as open() would
+                parsed = self._parse(io.TextIOWrapper(io.BytesIO(contents)))
+            else:
+                parsed = self._parse(rules_file)
+            # An empty result may be a parse error, which should be
+            # reported again next time rather than cached.
+            if use_cache and any(parsed.values()):
+                store_cached(rules_file, self._cache_dir, key, parsed)
+
+        self.options.update(parsed['options'])
+        self.defaults.update(parsed['defaults'])
+        for pattern, actions in parsed['rules']:
+            self.add(pattern, **actions)
+        self._invalidate()
+
+    @staticmethod
+    def _parse(rules_file):
         options, rules = load_rules(rules_file)
+        parsed = {'options': {}, 'defaults': {}, 'rules': []}
 
         for opt, value in options.items():
             if opt in ALLOWED_FIELDS:
-                self.defaults[opt] = value
+                parsed['defaults'][opt] = value
             else:
                 if opt == 'skip':
                     value = int(value)
                 elif opt == 'fields':
                     value = [x.strip() for x in value.split(',')]
-                self.options[opt] = value
+                parsed['options'][opt] = value
 
         for patterns, body in rules:
-            for pattern in patterns:
-                self.add(pattern, **dict(body))
+            for pattern in _alternatives(patterns):
+                parsed['rules'].append((pattern, dict(body)))
+        return parsed
 
     def set_defaults(self, **kw):
         for k, v in kw.items():
             self.defaults[k] = v
+        self._invalidate()
 
     def add(self, pattern, **actions):
+        """Add a rule applying `actions` to rows whose description
+        `pattern` matches, or, if it is a list of (field, pattern) pairs,
+        to rows where each pattern matches its field."""
         assert set(actions.keys()).difference(ALLOWED_FIELDS) == set([])
-        self.rules.append((re.compile(pattern), actions))
+        if isinstance(pattern, str):
+            pattern = re.compile(pattern)
+        else:
+            pattern = tuple((field, re.compile(p)) for field, p in pattern)
+            self.condition_fields = tuple(sorted(set(
+                self.condition_fields).union(
+                    field for field, _ in pattern if field != 'description')))
+        self.rules.append((pattern, actions))
+        self._invalidate()
+
+    def _invalidate(self):
+        self._matcher = None
+        self._cached_match.cache_clear()
+
+    def cache_info(self):
+        """Return the match cache's hits, misses, maxsize and currsize."""
+        return self._cached_match.cache_info()
+
+    def _values(self, fields):
+        fields = fields or {}
+        return tuple(fields.get(name, '') for name in self.condition_fields)
+
+    def match(self, description, fields=None):
+        """Return the fields set for a row with `description`, and the
+        CSV field values `fields` (a mapping of name to value, needed
+        only for those in self.condition_fields)."""
+        return dict(self._cached_match(description,
+                                       self._values(fields))[1])
+
+    def match_rule(self, description, fields=None):
+        """Return the index of the rule that matches (or None) and the
+        resulting fields, as match() does."""
+        i, result = self._cached_match(description, self._values(fields))
+        return i, dict(result)
+
+    def match_index(self, description, fields=None):
+        """Return the index in self.rules of the rule that matches, or
+        None."""
+        return self._index(description, self._values(fields))
+
+    def _build_matcher(self):
+        plain = [i for i, (p, _) in enumerate(self.rules)
+                 if not isinstance(p, tuple)]
+        conditional = [i for i, (p, _) in enumerate(self.rules)
+                       if isinstance(p, tuple)]
+        numbers = {name: j + 1
+                   for j, name in enumerate(self.condition_fields)}
+        numbers['description'] = 0
+        conditions = None
+        if conditional:
+            conditions = ConditionMatcher(
+                [[(numbers[field], p) for field, p in self.rules[i][0]]
+                 for i in conditional], len(numbers))
+        self._matcher = (CompiledMatcher(self.rules[i][0] for i in plain),
+                         plain, conditions, conditional)
+
+    def _index(self, description, values):
+        if self._matcher is None:
+            self._build_matcher()
+        matcher, plain, conditions, conditional = self._matcher
+        i = matcher.match(description)
+        if i is not None:
+            i = plain[i]
+        if conditions is not None and (i is None or conditional[0] < i):
+            j = conditions.match((description,) + values)
+            if j is not None and (i is None or conditional[j] < i):
+                i = conditional[j]
+        return i
 
-    def match(self, description):
+    def _match(self, description, values):
+        profile = profiling.current
+        if profile is None:
+            i = self._index(description, values)
+        else:
+            profile.enter('match rules')
+            start = time.perf_counter()
+            i = self._index(description, values)
+            profile.rule_match_time(i, time.perf_counter() - start)
+            profile.exit()
         result = dict(self.defaults)
-        for pattern, actions in self.rules:
-            if pattern.search(description):
-                result.update(actions)
-                return result
-        return result
+        if i is not None:
+            result.update(self.rules[i][1])
+        return i, result
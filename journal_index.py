@@ -0,0 +1,183 @@
+"""A LedgerIndex of a journal kept in an SQLite file next to it.
+
+The journal is only ever appended to, so the index is stored with the
+number of bytes it covers (up to its last transaction) and a checksum
+of them. Each run checks the checksum and parses only the rest, adding
+the keys of what it finds; if the indexed part has changed (someone
+edited history), the index is rebuilt from the whole file.
+
+The last transaction is outside the checksum, as it may yet gain
+postings, so its keys are not stored: they are found again, and any
+it no longer has dropped, each time the rest is parsed.
+"""
+import hashlib
+import os
+import sqlite3
+from decimal import Decimal
+import profiling
+from _ledger_parser import LedgerSyntaxError, parse_lines
+from ledger_index import LedgerIndex, transaction_keys
+
+__all__ = ['JournalIndex', 'default_path']
+
+VERSION = 2
+
+# Bytes read at a time to checksum the indexed part of the journal
+READ_SIZE = 1 << 20
+
+
+def default_path(ledger_file):
+    directory, name = os.path.split(os.path.abspath(ledger_file))
+    return os.path.join(directory, '.{}.index.sqlite'.format(name))
+
+
+def last_transaction(data):
+    """Return the offset of the last line in `data` that starts a
+    transaction, or 0 if there is none."""
+    end = len(data)
+    while True:
+        start = data.rfind(b'\n', 0, end) + 1
+        if data[start:start + 1].isdigit():
+            return start
+        if start == 0:
+            return 0
+        end = start - 1
+
+
+def _snapshot(keys):
+    index = LedgerIndex()
+    index._keys = keys
+    return index
+
+
+class JournalIndex(LedgerIndex):
+    """A LedgerIndex of the whole of `ledger_file`, stored in the SQLite
+    file `path`.
+
+    update() indexes whatever has been appended to the journal since
+    it was last called, and stores the keys found.
+    """
+
+    def __init__(self, ledger_file, path=None):
+        super().__init__()
+        self.ledger_file = ledger_file
+        self.path = path or default_path(ledger_file)
+        self.offset = 0
+        self._checksum = hashlib.blake2b()
+        # Keys of the last transaction, from where the index ends
+        self._tail = set()
+        self._db = sqlite3.connect(self.path)
+        try:
+            with profiling.stage('index ledger'):
+                self._restore()
+                self.update()
+        except BaseException:
+            self.close()
+            raise
+        profiling.count('postings indexed', len(self._keys))
+
+    def close(self):
+        self._db.close()
+
+    def __reduce__(self):
+        # Sent to worker processes as a LedgerIndex of the same keys;
+        # only this process updates the stored index.
+        return _snapshot, (self._keys,)
+
+    def _restore(self):
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS indexed ('
+                             'version INTEGER, offset INTEGER, '
+                             'checksum TEXT)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS keys ('
+                             'date TEXT, account TEXT, amount TEXT, '
+                             'currency TEXT, description TEXT, '
+                             'PRIMARY KEY (date, account, amount, '
+                             'currency, description)) WITHOUT ROWID')
+        stored = self._db.execute('SELECT version, offset, checksum '
+                                  'FROM indexed').fetchone()
+        if stored is None or stored[0] != VERSION:
+            return
+        _, offset, expected = stored
+        checksum = hashlib.blake2b()
+        with open(self.ledger_file, 'rb') as f:
+            remaining = offset
+            while remaining:
+                data = f.read(min(remaining, READ_SIZE))
+                if not data:
+                    break
+                checksum.update(data)
+                remaining -= len(data)
+        if remaining or checksum.hexdigest() != expected:
+            profiling.count('journal index rebuilt')
+            return
+        self._keys = set(
+            (date, account, Decimal(amount), currency, description)
+            for date, account, amount, currency, description
+            in self._db.execute('SELECT * FROM keys'))
+        self.offset = offset
+        self._checksum = checksum
+
+    def update(self):
+        """Index the journal from where the index ends, and store it."""
+        with open(self.ledger_file, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read()
+        # Leave a line still being written for next time
+        data = data[:data.rfind(b'\n') + 1]
+        if not data and not self._tail:
+            return
+        try:
+            transactions = list(parse_lines(
+                data.decode('utf8').splitlines(True)))
+        except LedgerSyntaxError:
+            if not self.offset:
+                raise
+            # What was appended carries on from what was indexed
+            self._keys = set()
+            self._tail = set()
+            self.offset = 0
+            self._checksum = hashlib.blake2b()
+            return self.update()
+        profiling.count('journal bytes indexed', len(data))
+        # The last transaction may yet gain postings, or be edited, so
+        # it is parsed again next time.
+        keys = [key for t in transactions[:-1]
+                for key in transaction_keys(t)]
+        tail = set(transaction_keys(transactions[-1])) if transactions \
+            else set()
+        self._drop_stale(self._tail - tail.union(keys))
+        self._tail = tail
+        self._keys.update(keys)
+        self._keys.update(tail)
+        self._buckets = None
+        rebuilt = self.offset == 0
+        indexed = last_transaction(data)
+        self._checksum.update(data[:indexed])
+        self.offset += indexed
+        self._store(keys, rebuilt)
+
+    def _drop_stale(self, keys):
+        """Drop keys the last transaction no longer has, unless an
+        earlier one, stored, has them too."""
+        for key in keys:
+            date, account, amount, currency, description = key
+            if self._db.execute(
+                    'SELECT 1 FROM keys WHERE date = ? AND account = ? AND '
+                    'amount = ? AND currency = ? AND description = ?',
+                    (date, account, str(amount), currency,
+                     description)).fetchone() is None:
+                self._keys.discard(key)
+
+    def _store(self, keys, rebuilt):
+        with self._db:
+            if rebuilt:
+                self._db.execute('DELETE FROM keys')
+            self._db.execute('DELETE FROM indexed')
+            self._db.execute('INSERT INTO indexed VALUES (?, ?, ?)',
+                             (VERSION, self.offset,
+                              self._checksum.hexdigest()))
+            self._db.executemany(
+                'INSERT OR IGNORE INTO keys VALUES (?, ?, ?, ?, ?)',
+                ((date, account, str(amount), currency, description)
+                 for date, account, amount, currency, description in keys))
@@ -0,0 +1,167 @@
+"""Journals split over several files with include directives.
+
+A root journal that includes one file per year or per account is read
+as one: each file is parsed on its own, those found at each level of
+includes in parallel on a process pool, and their transactions are put
+together in document order, each included file's where its include
+directive is.
+
+With a cache directory, each file's parse is stored there under its
+modification time and size, so that only files changed since the last
+run (usually just the current year's) are parsed again.
+"""
+import gc
+import glob
+import hashlib
+import mmap
+import os
+import pickle
+import tempfile
+import profiling
+from _ledger_parser import LedgerSyntaxError, parse_journal_file
+
+__all__ = ['load_journal', 'has_includes']
+
+VERSION = 1
+
+
+def has_includes(filename):
+    """Whether a journal file has any include directives, without
+    parsing it."""
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return False
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = mm.find(b'include')
+            while pos >= 0:
+                start = pos - 1 if mm[pos - 1:pos] == b'!' else pos
+                if start == 0 or mm[start - 1:start] == b'\n':
+                    return True
+                pos = mm.find(b'include', pos + 1)
+    return False
+
+
+def _cache_file(cache_dir, filename):
+    name = hashlib.sha1(filename.encode('utf8')).hexdigest()
+    return os.path.join(cache_dir, 'journal-{}.pickle'.format(name))
+
+
+def _cache_key(filename):
+    st = os.stat(filename)
+    return (VERSION, filename, st.st_mtime_ns, st.st_size)
+
+
+def load_cached(filename, cache_dir):
+    """Return the (transactions, includes) cached for `filename`, or None
+    if there are none or the file has changed since."""
+    try:
+        with open(_cache_file(cache_dir, filename), 'rb') as f:
+            key, parsed = pickle.load(f)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+    if key != _cache_key(filename):
+        return None
+    return parsed
+
+
+def store_cached(filename, cache_dir, key, parsed):
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with open(fd, 'wb') as f:
+            pickle.dump((key, parsed), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, _cache_file(cache_dir, filename))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _parse(filename):
+    """Return the cache key of `filename` as it was when parsed, and the
+    result of parsing it."""
+    # Taken first, so that a change while parsing is seen next time
+    key = _cache_key(filename)
+    return key, parse_journal_file(filename)
+
+
+def _parse_all(filenames, jobs):
+    if jobs > 1 and len(filenames) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(jobs, len(filenames))) \
+                as pool:
+            return list(pool.map(_parse, filenames))
+    return [_parse(f) for f in filenames]
+
+
+def _targets(filename, include):
+    """Return the files an include directive in `filename` names."""
+    _, path, line, lineno = include
+    path = os.path.join(os.path.dirname(filename), os.path.expanduser(path))
+    if not glob.has_magic(path):
+        return [os.path.abspath(path)]
+    found = sorted(os.path.abspath(p) for p in glob.glob(path))
+    if not found:
+        raise LedgerSyntaxError('No files match', line, lineno,
+                                len(line) - len(line.lstrip()) + 1,
+                                filename)
+    return found
+
+
+def load_journal(filename, jobs=1, cache_dir=None):
+    """Return the transactions in the journal `filename` and the files
+    it includes, in document order."""
+    root = os.path.abspath(filename)
+    parsed = {}
+    level = [root]
+    # As with csv_importer.paused_gc(): the collector would otherwise
+    # rescan every transaction loaded so far, which make no cycles, many
+    # times over.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with profiling.stage('parse journal files'):
+            _load_levels(level, parsed, jobs, cache_dir)
+        return list(_flatten(root, parsed, [root]))
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _load_levels(level, parsed, jobs, cache_dir):
+    """Parse, or load from the cache, the files in `level` and those they
+    include, into `parsed`."""
+    while level:
+        missing = []
+        for f in level:
+            cached = None
+            if cache_dir is not None:
+                cached = load_cached(f, cache_dir)
+            if cached is None:
+                missing.append(f)
+            else:
+                parsed[f] = cached
+        profiling.count('journal files parsed', len(missing))
+        profiling.count('journal files cached', len(level) - len(missing))
+        for f, (key, result) in zip(missing, _parse_all(missing, jobs)):
+            parsed[f] = result
+            if cache_dir is not None:
+                store_cached(f, cache_dir, key, result)
+        level = list(dict.fromkeys(
+            target for f in level for include in parsed[f][1]
+            for target in _targets(f, include)
+            if target not in parsed))
+
+
+def _flatten(filename, parsed, stack):
+    transactions, includes = parsed[filename]
+    done = 0
+    for include in includes:
+        count, _, line, lineno = include
+        yield from transactions[done:count]
+        done = count
+        for target in _targets(filename, include):
+            if target in stack:
+                raise LedgerSyntaxError('Include cycle', line, lineno, 1,
+                                        filename)
+            yield from _flatten(target, parsed, stack + [target])
+    yield from transactions[done:]
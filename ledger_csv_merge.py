@@ -1,33 +1,118 @@
 #!/usr/bin/env python
 
 import os.path
+import tempfile
 import time
 import click
 import logging
+import profiling
+from collections import Counter
+from itertools import groupby
 from datetime import datetime
-from watchdog.observers import Observer
-from watchdog.events import PatternMatchingEventHandler
-from csv_importer import Rules, get_transactions
+from contextlib import nullcontext
+from functools import partial
+from _rules_cache import default_cache_dir
+from balance_check import journal_balances, check_balances
+from ledger_index import FuzzyMatch
+from row_fingerprints import RowFingerprints, default_path
+from statement_daemon import StatementDaemon, STATE_FILE
+from journal_index import JournalIndex
+from _ledger_parser import LedgerSyntaxError, format_syntax_error
+from csv_importer import (Rules, StatementCache, MemoizedLedger,
+                          get_transactions, open_ledger, deduplicate,
+                          date_range, deduplicate_concurrently,
+                          append_transactions, append_spool,
+                          write_statement, chunk_ranges, INGEST_MODES)
+
+
+# Transactions with unknown accounts listed by --stream
+MAX_UNKNOWN_SHOWN = 20
+
+# State of a worker process importing CSV files in parallel
+_worker = {}
+
+
+def _init_worker(rules_file, cache_dir, existing_ledger, use_hledger, ingest,
+                 fuzzy, fingerprints_file):
+    _worker['rules'] = _make_rules(rules_file, cache_dir, ingest)
+    # A ledger filename is indexed by get_transactions for each file's
+    # dates only; an index is shared by all.
+    _worker['existing_ledger'] = existing_ledger
+    _worker['use_hledger'] = use_hledger
+    _worker['fuzzy'] = fuzzy
+    _worker['fingerprints'] = None
+    if fingerprints_file is not None:
+        _worker['fingerprints'] = RowFingerprints(fingerprints_file)
+
+
+def _import_file(csv_file, chunk=None):
+    """Return the new transactions of a CSV file, or of a chunk of it,
+    and the fingerprints of its rows to record."""
+    fingerprints = _worker['fingerprints']
+    transactions = list(get_transactions(csv_file, _worker['rules'],
+                                         _worker['existing_ledger'],
+                                         _worker['use_hledger'],
+                                         _worker['fuzzy'], fingerprints,
+                                         chunk))
+    if fingerprints is None:
+        return transactions, None
+    return transactions, fingerprints.pending.pop(csv_file, None)
+
+
+def _make_rules(rules_file, cache_dir, ingest):
+    rules = Rules(rules_file, cache_dir=cache_dir)
+    if ingest is not None:
+        # The command line overrides the rules file
+        rules.options['ingest'] = ingest
+    return rules
 
 
 class Merger:
-    def __init__(self, ledger_file, rules_file, yes_append, csv_files):
+    def __init__(self, ledger_file, rules_file, yes_append, csv_files,
+                 use_hledger=False, jobs=1, cache_dir=None, ingest=None,
+                 hledger_concurrency=1, fuzzy=None, fingerprints=None,
+                 stream=False, split=False):
         self._ledger_file = ledger_file
         self._rules_file = rules_file
         self._yes_append = yes_append
         self._csv_files = csv_files
+        self._use_hledger = use_hledger
+        self._jobs = jobs
+        self._cache_dir = cache_dir
+        self._ingest = ingest
+        self._hledger_concurrency = hledger_concurrency
+        self._fuzzy = fuzzy
+        self._fingerprints = fingerprints
+        self._stream = stream
+        self._split = split
+        self._rules = None
+        self._rules_contents = None
+        # Match cache hits and misses of the rules replaced on reload
+        self._cache_counts = Counter()
+        self._statements = None
+        self._ledger = None
+        self._printed = {}
+        self._balances = None
         self._observer = None
 
+    def _watch_rules(self):
+        """Reload whenever the rules file is modified."""
+        # watchdog is only imported once there is something to watch
+        from watchdog.observers import Observer
+        from watchdog.events import PatternMatchingEventHandler
+
         def on_rules_modified(event):
             print()
             self.reload()
             self.print_transactions()
             self._prompt_append(wait=False)
-        self._event_handler = PatternMatchingEventHandler([rules_file])
+        self._event_handler = PatternMatchingEventHandler(
+            patterns=[self._rules_file])
         self._event_handler.on_modified = on_rules_modified
         self._observer = Observer()
         self._observer.schedule(self._event_handler,
-                                os.path.dirname(rules_file))
+                                os.path.dirname(self._rules_file))
+        self._observer.start()
 
     def __del__(self):
         if self._observer and self._observer.is_alive():
@@ -44,22 +129,153 @@ class Merger:
             click.secho(' [y/N]: ', nl=False)
             return
 
+    def _load_rules(self):
+        # Keep the previous rules, and their match cache, if the rules
+        # file has not actually changed.
+        with open(self._rules_file, 'rb') as f:
+            contents = f.read()
+        if self._rules is None or contents != self._rules_contents:
+            if self._rules is not None:
+                info = self._rules.cache_info()
+                self._cache_counts.update(hits=info.hits,
+                                          misses=info.misses)
+            self._rules = _make_rules(self._rules_file, self._cache_dir,
+                                      self._ingest)
+            self._rules_contents = contents
+        return self._rules
+
+    def _tasks(self, rules):
+        """Return (index of CSV file, chunk) for each piece of work."""
+        if not self._split:
+            return [(i, None) for i in range(len(self._csv_files))]
+        skip = rules.options.get('skip', 0)
+        return [(i, chunk) for i, f in enumerate(self._csv_files)
+                for chunk in chunk_ranges(f, self._jobs, skip) or [None]]
+
+    def _import_files_parallel(self, rules):
+        """Yield (csv_file, transactions) for each CSV file, in order.
+
+        With split, each file is imported in chunks of whole rows, put
+        back together in file order.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+        tasks = self._tasks(rules)
+        existing_ledger = self._ledger_file
+        if self._split and self._ledger_file and not self._use_hledger:
+            # Chunks of a file span much of the same dates, so the
+            # journal is indexed once, here, rather than for each.
+            if self._ledger is None or not self._ledger.covers(None):
+                self._ledger = open_ledger(self._ledger_file,
+                                           jobs=self._jobs,
+                                           cache_dir=self._cache_dir)
+            existing_ledger = self._ledger
+        # Each worker gets these once, and loads the rules (and any
+        # ledger index not shared) itself, rather than having them
+        # pickled for every file.
+        fingerprints_file = None
+        if self._fingerprints is not None:
+            fingerprints_file = self._fingerprints.path
+        with ProcessPoolExecutor(
+                max_workers=min(self._jobs, len(tasks)),
+                initializer=_init_worker,
+                initargs=(self._rules_file, self._cache_dir,
+                          existing_ledger, self._use_hledger,
+                          self._ingest, self._fuzzy,
+                          fingerprints_file)) as pool:
+            # Workers are not profiled; their time shows up here.
+            results = profiling.timed('import in workers', pool.map(
+                _import_file, [self._csv_files[i] for i, _ in tasks],
+                [chunk for _, chunk in tasks]))
+            for i, done in groupby(zip(tasks, results),
+                                   key=lambda done: done[0][0]):
+                csv_file = self._csv_files[i]
+                transactions = []
+                for _, (part, pending) in done:
+                    transactions.extend(part)
+                    if pending is not None:
+                        self._fingerprints.pending[csv_file] = pending
+                yield csv_file, transactions
+
+    def _import_files_incremental(self, rules):
+        """Yield (csv_file, transactions) for each CSV file, in order,
+        reusing the rows and duplicate checks from the last reload."""
+        if self._statements is None:
+            self._statements = [StatementCache(f, self._fingerprints)
+                                for f in self._csv_files]
+        for statement in self._statements:
+            statement.update(rules)
+
+        if self._ledger_file and self._use_hledger:
+            if self._ledger is None:
+                self._ledger = MemoizedLedger(
+                    open_ledger(self._ledger_file, self._use_hledger))
+        elif self._ledger_file:
+            # Index only the statements' dates, re-indexing if new
+            # rules move a transaction outside them.
+            dates = date_range((t for statement in self._statements
+                                for t in statement.transactions),
+                               self._fuzzy.days if self._fuzzy else 0)
+            if self._ledger is None or not self._ledger.covers(dates):
+                self._ledger = open_ledger(self._ledger_file, dates=dates,
+                                           jobs=self._jobs,
+                                           cache_dir=self._cache_dir)
+
+        if self._use_hledger and self._ledger is not None and \
+                self._hledger_concurrency > 1:
+            # Query hledger for all the statements at once, so that the
+            # wait is for the slowest query rather than for all of them.
+            with profiling.stage('deduplicate'):
+                unique = deduplicate_concurrently(
+                    [s.transactions for s in self._statements],
+                    self._ledger, self._hledger_concurrency)
+            yield from zip(self._csv_files, unique)
+            return
+
+        for statement in self._statements:
+            transactions = statement.transactions
+            if self._ledger is not None:
+                transactions = list(deduplicate(transactions, self._ledger,
+                                                self._fuzzy))
+            yield statement.filename, transactions
+
     def reload(self):
         print('\rReloading...\n')
-        rules = Rules(self._rules_file)
+        rules = self._load_rules()
         self.transactions = []
         self.unknown = []
+        self.mismatch = None
 
-        for csv_file in self._csv_files:
+        if self._statements is None and self._jobs > 1 and \
+                (len(self._csv_files) > 1 or self._split):
+            imported = self._import_files_parallel(rules)
+        else:
+            imported = self._import_files_incremental(rules)
+
+        for csv_file, transactions in imported:
             click.secho('>>> {}'.format(csv_file), fg='blue')
             ts = []
             self.transactions.append((csv_file, ts))
-            for t in get_transactions(csv_file, rules, self._ledger_file):
-                print(t)
-                print()
+            # Only show what changed since the last reload
+            previous = self._printed.get(csv_file, Counter())
+            printed = Counter()
+            unchanged = 0
+            for t in transactions:
+                s = str(t)
+                printed[s] += 1
+                if previous[s] > 0:
+                    previous[s] -= 1
+                    unchanged += 1
+                else:
+                    with profiling.stage('output'):
+                        print(s)
+                        print()
                 ts.append(t)
                 if t.account2 == 'expenses:unknown':
                     self.unknown.append(t)
+            if unchanged:
+                click.secho('({} unchanged transactions not shown)\n'
+                            .format(unchanged), dim=True)
+            self._printed[csv_file] = printed
 
     def print_transactions(self):
         if not any(x for (_, x) in self.transactions):
@@ -73,23 +289,150 @@ class Merger:
                 click.secho('   {}: {} (£{:0.2f})'
                             .format(t.date, t.description, t.amount))
 
+        self.mismatch = self._check_balances()
+        if self.mismatch is not None:
+            t, expected = self.mismatch
+            click.secho('Balance assertion would fail:', fg='red')
+            click.secho('   {}: {} states {}{} but the journal and earlier '
+                        'transactions give {}{}'
+                        .format(t.date, t.description, t.currency,
+                                t.balance.quantize(expected), t.currency,
+                                expected), fg='red')
+
+    def _check_balances(self):
+        """Return the first balance assertion of the new transactions
+        that would fail once appended, or None.
+
+        A journal that cannot be parsed stops the import, as it does
+        when deduplicating, rather than being checked as if empty; with
+        --hledger, which may read it, the check is skipped instead.
+        """
+        if not self._ledger_file:
+            return None
+        transactions = [t for _, ts in self.transactions for t in ts]
+        accounts = set(t.account1 for t in transactions)
+        # The journal only changes when appended to, but new rules may
+        # bring in other accounts.
+        if self._balances is None or \
+                not accounts.issubset(self._balances[0]):
+            try:
+                balances = journal_balances(self._ledger_file, accounts,
+                                            self._jobs, self._cache_dir)
+            except LedgerSyntaxError as err:
+                if not self._use_hledger:
+                    raise
+                logging.warning('Balance assertions not checked: %s', err)
+                return None
+            self._balances = (accounts, balances)
+        return check_balances(transactions, self._balances[1])
+
     def main(self):
+        if self._stream:
+            return self._main_streaming()
         self.reload()
         if self.print_transactions() is False:
+            # Any rows read are in the journal already
+            with self._recording():
+                pass
             return
 
-        self._observer.start()
+        self._watch_rules()
+        if self._ledger_file and self._yes_append and \
+                self.mismatch is not None:
+            click.secho('Not appending', fg='red')
+            return
         if self._ledger_file and (self._yes_append or self._prompt_append()):
             print('Appending...', end=' ')
-            now = datetime.now().replace(microsecond=0)
-            with open(self._ledger_file, 'ta') as f:
-                for filename, txns in self.transactions:
-                    print('; Converted from {}'.format(filename), file=f)
-                    print('; [{}]\n'.format(now), file=f)
-                    for t in txns:
-                        print(str(t) + '\n', file=f)
+            with self._recording():
+                append_transactions(self._ledger_file, self.transactions)
+                self._update_index()
             print('done')
 
+    def _main_streaming(self):
+        """main(), holding only counts in memory: the new transactions
+        are written to a spool file, which is appended if confirmed."""
+        # Next to the journal rather than in the temporary directory,
+        # which may be too small for it.
+        fd, spool = tempfile.mkstemp(
+            prefix='.ledger-csv-merge-', suffix='.spool',
+            dir=os.path.dirname(os.path.abspath(self._ledger_file)))
+        try:
+            with open(fd, 'w') as f:
+                total = self._spool(f)
+            if not total:
+                click.secho('No new transactions found')
+                return
+            if self._unknown_count:
+                click.secho('{} transactions with unknown account:'
+                            .format(self._unknown_count), fg='yellow')
+                for t in self.unknown:
+                    click.secho('   {}: {} (£{:0.2f})'
+                                .format(t.date, t.description, t.amount))
+                if self._unknown_count > len(self.unknown):
+                    click.secho('   ... and {} more'.format(
+                        self._unknown_count - len(self.unknown)))
+            if self._yes_append or self._prompt_append():
+                print('Appending...', end=' ')
+                append_spool(self._ledger_file, spool)
+                self._update_index()
+                print('done')
+        finally:
+            os.unlink(spool)
+
+    def _spool(self, f):
+        """Write the new transactions of each CSV file to the journal file
+        object `f`, returning how many there were."""
+        rules = self._load_rules()
+        # The statements' dates are not known until they have been
+        # read, so the whole journal is indexed.
+        ledger = self._ledger = open_ledger(
+            self._ledger_file, self._use_hledger, jobs=self._jobs,
+            cache_dir=self._cache_dir)
+        now = datetime.now().replace(microsecond=0)
+        self.unknown = []
+        self._unknown_count = 0
+        total = 0
+        for csv_file in self._csv_files:
+            click.secho('>>> {}'.format(csv_file), fg='blue')
+            counts = Counter()
+            write_statement(f, csv_file, self._counted(get_transactions(
+                csv_file, rules, ledger, self._use_hledger, self._fuzzy),
+                counts), now)
+            click.secho('{} new transactions\n'.format(counts['new']))
+            total += counts['new']
+        return total
+
+    def _counted(self, transactions, counts):
+        for t in transactions:
+            counts['new'] += 1
+            if t.account2 == 'expenses:unknown':
+                self._unknown_count += 1
+                if len(self.unknown) < MAX_UNKNOWN_SHOWN:
+                    self.unknown.append(t)
+            yield t
+
+    def _update_index(self):
+        """Index what has just been appended to the journal."""
+        if isinstance(self._ledger, JournalIndex):
+            self._ledger.update()
+
+    def _recording(self):
+        """Record the rows read as imported if the block succeeds."""
+        if self._fingerprints is None:
+            return nullcontext()
+        return self._fingerprints.recording()
+
+    def record_profile(self):
+        """Add the rules' match cache counts, over every reload, to the
+        current profile."""
+        counts = Counter(self._cache_counts)
+        if self._rules is not None:
+            info = self._rules.cache_info()
+            counts.update(hits=info.hits, misses=info.misses)
+        if counts:
+            profiling.count('rules match cache hits', counts['hits'])
+            profiling.count('rules match cache misses', counts['misses'])
+
 
 @click.command()
 @click.option('-f', '--ledger-file', type=click.Path(exists=True),
@@ -98,7 +441,125 @@ class Merger:
               help='hledger-compatible rules file')
 @click.option('-y', '--yes-append', default=False, is_flag=True,
               help='don\'t ask for confirmation to append to Ledger file')
+@click.option('--hledger', 'use_hledger', default=False, is_flag=True,
+              help='query hledger for duplicates instead of indexing the '
+              'Ledger file')
+@click.option('--hledger-concurrency', default=1,
+              type=click.IntRange(min=1),
+              help='with --hledger, number of hledger queries to run at '
+              'once')
+@click.option('--fuzzy-days', type=click.IntRange(min=0),
+              help='also take as duplicates transactions in the Ledger '
+              'file up to this many days apart, with the same account '
+              'and amount and similar descriptions')
+@click.option('--similarity', default=0.8,
+              type=click.FloatRange(min=0, max=1),
+              help='with --fuzzy-days, how alike descriptions must be, '
+              'from 0 to 1 (default 0.8)')
+@click.option('-j', '--jobs', default=1, type=click.IntRange(min=1),
+              help='number of CSV files to import, or of files included '
+              'by the Ledger file to parse, in parallel')
+@click.option('--split', default=False, is_flag=True,
+              help='with --jobs, also split each CSV file into chunks of '
+              'whole rows to convert and check for duplicates in '
+              'parallel, for very large files (rows are then not '
+              'recorded as imported)')
+@click.option('--no-cache', default=False, is_flag=True,
+              help='parse the rules file and Ledger files without using '
+              'or updating the cache in {}'.format(default_cache_dir()))
+@click.option('--ingest', type=click.Choice(INGEST_MODES),
+              help='convert CSV rows one at a time, or column by column '
+              'using NumPy (default: the rules file\'s "ingest" option, '
+              'or rows)')
+@click.option('--stream', default=False, is_flag=True,
+              help='for very large CSV files: write the new transactions '
+              'to a temporary file next to the Ledger file, rather than '
+              'holding and printing them all, so that memory use does '
+              'not grow with the number of rows (balance assertions are '
+              'then left to hledger, and rows are not recorded as '
+              'imported)')
+@click.option('--recheck', default=False, is_flag=True,
+              help='check every row against the Ledger file, including '
+              'those that earlier runs recorded as imported (in '
+              '.LEDGER_FILE.rows.sqlite next to it); the rows recorded '
+              'are forgotten anyway, and checked again, once the Ledger '
+              'file is changed other than by appending to it, as when a '
+              'transaction is deleted to be imported again')
+@click.option('--watch-dir', type=click.Path(exists=True, file_okay=False),
+              help='keep running, appending the new transactions in the '
+              'CSV files in this directory as they are written, without '
+              'asking')
+@click.option('--state-file', type=click.Path(dir_okay=False),
+              help='with --watch-dir, where to record what has been '
+              'appended (default: {} in the directory)'.format(STATE_FILE))
+@click.option('--profile', default=False, is_flag=True,
+              help='print the time spent in each stage, and other counts')
+@click.option('--profile-json', type=click.File('w'),
+              help='write the --profile results to this JSON file')
 @click.argument('csv_files', type=click.Path(), nargs=-1)
-def main(ledger_file, rules_file, yes_append, csv_files):
-    m = Merger(ledger_file, rules_file, yes_append, csv_files)
-    m.main()
+def main(ledger_file, rules_file, yes_append, use_hledger,
+         hledger_concurrency, fuzzy_days, similarity, jobs, split, no_cache,
+         ingest, stream, recheck, watch_dir, state_file, profile, profile_json,
+         csv_files):
+    fuzzy = None
+    if fuzzy_days is not None:
+        if use_hledger:
+            raise click.UsageError('--fuzzy-days needs the Ledger file to '
+                                   'be indexed, not --hledger')
+        fuzzy = FuzzyMatch(fuzzy_days, similarity)
+    if profile or profile_json:
+        profiling.start()
+    cache_dir = None if no_cache else default_cache_dir()
+    if watch_dir:
+        if not ledger_file or csv_files or use_hledger:
+            raise click.UsageError('--watch-dir needs a Ledger file, and '
+                                   'neither CSV files nor --hledger')
+        daemon = StatementDaemon(
+            ledger_file, partial(_make_rules, rules_file, cache_dir, ingest),
+            watch_dir, state_file, fuzzy=fuzzy)
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            pass
+        except LedgerSyntaxError as err:
+            raise click.ClickException(format_syntax_error(err))
+        finally:
+            _report_profile(profile, profile_json)
+        return
+    if stream:
+        if not ledger_file or ingest == 'columnar':
+            raise click.UsageError('--stream needs a Ledger file, and reads '
+                                   'rows one at a time')
+        ingest = 'rows'
+    if split and stream:
+        raise click.UsageError('--split holds the new transactions, '
+                               'which --stream does not')
+    fingerprints = None
+    # Rows are told apart by how many identical rows come before them
+    # in the file, which chunks of it cannot know.
+    if ledger_file and not recheck and not stream and not split:
+        fingerprints = RowFingerprints(default_path(ledger_file),
+                                       ledger_file)
+    m = Merger(ledger_file, rules_file, yes_append, csv_files, use_hledger,
+               jobs, cache_dir, ingest, hledger_concurrency, fuzzy,
+               fingerprints, stream, split)
+    try:
+        m.main()
+    except LedgerSyntaxError as err:
+        # Nothing can be deduplicated against a journal that cannot be
+        # read, so nothing is imported.
+        raise click.ClickException(format_syntax_error(err))
+    finally:
+        if profiling.current is not None:
+            m.record_profile()
+        _report_profile(profile, profile_json)
+
+
+def _report_profile(profile, profile_json):
+    if profiling.current is None:
+        return
+    result = profiling.stop()
+    if profile:
+        click.echo(result.format_table(), err=True)
+    if profile_json:
+        result.write_json(profile_json)
@@ -0,0 +1,202 @@
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import date as date_type
+from decimal import Decimal
+import profiling
+from _ledger_parser import load_ledger, iter_ledger
+from journal_tree import has_includes
+
+__all__ = ['LedgerIndex', 'FuzzyMatch']
+
+# How close a transaction must be to one in the ledger to be taken as
+# a duplicate of it: within `days` days, with descriptions at least
+# `similarity` alike (difflib's ratio, from 0 to 1).
+FuzzyMatch = namedtuple('FuzzyMatch', 'days similarity')
+
+
+def normalize_description(description):
+    return ' '.join(description.split()).casefold()
+
+
+def normalize_date(date):
+    return date.replace('/', '-').replace('.', '-')
+
+
+def normalize_amount(amount):
+    if isinstance(amount, float):
+        amount = '{:f}'.format(amount)
+    return Decimal(str(amount).replace(',', ''))
+
+
+def make_key(date, account, amount, currency, description):
+    return (normalize_date(date),
+            account.casefold(),
+            normalize_amount(amount),
+            currency,
+            normalize_description(description))
+
+
+def date_ordinal(date):
+    """Return the day ordinal of a normalized date, or None."""
+    try:
+        return date_type.fromisoformat(date).toordinal()
+    except ValueError:
+        return None
+
+
+def posting_amounts(postings):
+    """Yield (account, CurrencyAmount) for each posting.
+
+    A single posting with an elided amount is given the balancing
+    amount, as long as the other postings share one currency.
+    """
+    elided = [p for p in postings if p['amount'] is None]
+    for p in postings:
+        if p['amount'] is not None:
+            yield p['account'], p['amount']
+    if len(elided) != 1:
+        return
+    currencies = set(p['amount'].currency for p in postings
+                     if p['amount'] is not None)
+    if len(currencies) != 1:
+        return
+    total = sum(normalize_amount(p['amount'].amount) for p in postings
+                if p['amount'] is not None)
+    yield elided[0]['account'], (currencies.pop(), -total)
+
+
+def transaction_keys(transaction):
+    """Yield the key of each posting of a parsed transaction."""
+    for account, (currency, amount) in posting_amounts(
+            transaction['postings']):
+        yield make_key(transaction['date'], account, amount, currency,
+                       transaction['description'])
+
+
+class LedgerIndex:
+    """In-memory index of the postings in a ledger file.
+
+    The journal is parsed once, and each posting is stored under a
+    (date, account, amount, currency, description) key, so checking
+    whether a transaction has already been entered is a hash lookup
+    rather than an hledger call.
+
+    Given `start` and/or `end` dates (inclusive, 'YYYY-MM-DD'), only
+    the transactions in that range are indexed, and only that part of
+    a journal file in date order is read. A journal with include
+    directives is read whole, as load_ledger()
+    reads it with `jobs` and `cache_dir`, and then limited to the dates.
+
+    For find_similar(), the postings are also grouped by (account,
+    amount, currency) into lists sorted by date, built on first use.
+    """
+
+    def __init__(self, ledger_file=None, start=None, end=None, jobs=1,
+                 cache_dir=None):
+        self.ledger_file = ledger_file
+        self.start = start
+        self.end = end
+        self._jobs = jobs
+        self._cache_dir = cache_dir
+        self._keys = set()
+        self._buckets = None
+        if ledger_file is not None:
+            self.load(ledger_file)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def covers(self, dates):
+        """Whether all transactions in the (start, end) range `dates` are
+        indexed; None stands for the whole file."""
+        if dates is None:
+            return self.start is None and self.end is None
+        start, end = dates
+        return ((self.start is None or start >= self.start) and
+                (self.end is None or end <= self.end))
+
+    def load(self, ledger_file):
+        with profiling.stage('index ledger'):
+            self._load(ledger_file)
+        profiling.count('postings indexed', len(self._keys))
+
+    def _load(self, ledger_file):
+        window = self.start or self.end
+        if isinstance(ledger_file, str) and window and \
+                not has_includes(ledger_file):
+            transactions = iter_ledger(ledger_file, self.start, self.end)
+        else:
+            transactions = load_ledger(ledger_file, jobs=self._jobs,
+                                       cache_dir=self._cache_dir)
+            if window:
+                transactions = (t for t in transactions
+                                if self._in_window(t['date']))
+        for transaction in transactions:
+            self.add(transaction)
+
+    def _in_window(self, date):
+        return ((self.start is None or date >= self.start) and
+                (self.end is None or date <= self.end))
+
+    def add(self, transaction):
+        self._keys.update(transaction_keys(transaction))
+        self._buckets = None
+
+    def find_transaction(self, date, desc, acct, amt, cur):
+        return make_key(date, acct, amt, cur, desc) in self._keys
+
+    def find_similar(self, date, desc, acct, amt, cur, fuzzy, claimed=None):
+        """Whether a posting matching exactly in account, amount and
+        currency is within the FuzzyMatch `fuzzy` of `date` and `desc`.
+
+        With a set `claimed`, each posting near matches once at most: the
+        nearest in date not yet in `claimed` is taken, and added to it,
+        so that last week's entry does not swallow this week's same
+        purchase. An exact match always counts, and claims its posting.
+        """
+        key = make_key(date, acct, amt, cur, desc)
+        date, acct, amt, cur, desc = key
+        ordinal = date_ordinal(date)
+        if key in self._keys:
+            if claimed is not None:
+                claimed.add((acct, amt, cur, ordinal, desc))
+            return True
+        if ordinal is None:
+            return False
+        if self._buckets is None:
+            self._buckets = self._make_buckets()
+        days, descriptions = self._buckets.get((acct, amt, cur), ((), ()))
+        lo = bisect_left(days, ordinal - fuzzy.days)
+        hi = bisect_right(days, ordinal + fuzzy.days)
+        if lo == hi:
+            return False
+        from difflib import SequenceMatcher
+        # SequenceMatcher caches what it works out about its second
+        # sequence, so that is the one kept the same.
+        matcher = SequenceMatcher(None, b=desc, autojunk=False)
+        for i in sorted(range(lo, hi), key=lambda i: abs(days[i] - ordinal)):
+            posting = (acct, amt, cur, days[i], descriptions[i])
+            if claimed is not None and posting in claimed:
+                continue
+            matcher.set_seq1(descriptions[i])
+            if matcher.real_quick_ratio() >= fuzzy.similarity and \
+                    matcher.quick_ratio() >= fuzzy.similarity and \
+                    matcher.ratio() >= fuzzy.similarity:
+                if claimed is not None:
+                    claimed.add(posting)
+                return True
+        return False
+
+    def _make_buckets(self):
+        with profiling.stage('index ledger'):
+            buckets = {}
+            for date, account, amount, currency, description in self._keys:
+                ordinal = date_ordinal(date)
+                if ordinal is not None:
+                    buckets.setdefault((account, amount, currency), []) \
+                        .append((ordinal, description))
+            for key, postings in buckets.items():
+                postings.sort()
+                buckets[key] = ([day for day, _ in postings],
+                                [desc for _, desc in postings])
+        return buckets
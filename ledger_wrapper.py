@@ -1,5 +1,13 @@
+import re
+import csv
 import subprocess
 import logging
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+import profiling
+
+
+AMOUNT_RE = re.compile(r'^(-?)\s*([^\d\s.,-]*)\s*(-?[\d.,]+)\s*([^\d\s.,-]*)$')
 
 
 class LedgerError(Exception):
@@ -10,13 +18,17 @@ class Ledger:
     def __init__(self, ledger_file=None):
         self.ledger_file = ledger_file
 
-    def _run_ledger(self, args):
+    def _command(self, args):
         cmdline = ['hledger']
         if self.ledger_file:
             cmdline += ['-f', self.ledger_file]
-        cmdline += args
+        return cmdline + args
+
+    def _run_ledger(self, args):
+        cmdline = self._command(args)
         try:
-            result = subprocess.check_output(cmdline)
+            with profiling.stage('hledger'):
+                result = subprocess.check_output(cmdline)
         except subprocess.CalledProcessError as err:
             logging.error("Error calling hledger [ret {}]. Command line: {}"
                           .format(err.returncode, cmdline))
@@ -24,16 +36,153 @@ class Ledger:
         result = result.decode('utf8')
         return result
 
+    async def _run_ledger_async(self, args):
+        """_run_ledger(), without blocking the event loop while hledger
+        runs."""
+        # asyncio is slow to import, and only used for these queries
+        import asyncio
+        cmdline = self._command(args)
+        # Concurrent calls overlap, so they are counted but not timed
+        profiling.count('hledger calls')
+        process = await asyncio.create_subprocess_exec(
+            *cmdline, stdout=asyncio.subprocess.PIPE)
+        result, _ = await process.communicate()
+        if process.returncode:
+            logging.error("Error calling hledger [ret {}]. Command line: {}"
+                          .format(process.returncode, cmdline))
+            raise LedgerError("Error calling hledger")
+        return result.decode('utf8')
+
     def find_transaction(self, **query):
-        # Need to use reg not print command: matches postings rather
-        # than whole transactions.
-        args = ['reg']
-        for k, v in query.items():
-            if k == 'amt':
-                v = '{:+f}'.format(v)
-            args.append('{}:{}'.format(k, v))
-        result = self._run_ledger(args)
+        result = self._run_ledger(_query_args(query))
         if result:
             return result
         else:
             return None
+
+    async def find_transaction_async(self, **query):
+        result = await self._run_ledger_async(_query_args(query))
+        if result:
+            return result
+        else:
+            return None
+
+    def find_transactions(self, queries):
+        """Run several find_transaction() queries with one hledger call.
+
+        `queries` is a list of dicts of find_transaction() keywords,
+        each of which must include `date`. One register report covering
+        the queries' date span and accounts is fetched as CSV and the
+        queries are matched against it in memory. Returns a list with
+        the matching postings (or None) for each query.
+        """
+        if not queries:
+            return []
+        batch = _batch_args(queries)
+        if batch is None:
+            return [self.find_transaction(**q) for q in queries]
+        args, dates = batch
+        return _match_batch(queries, dates, self._run_ledger(args))
+
+    async def find_transactions_async(self, queries):
+        """find_transactions(), as a coroutine.
+
+        It runs one hledger process at a time, so that callers bound
+        how many run at once by how many calls they make at once.
+        """
+        if not queries:
+            return []
+        batch = _batch_args(queries)
+        if batch is None:
+            # One query after another, as find_transactions() does
+            return [await self.find_transaction_async(**q) for q in queries]
+        args, dates = batch
+        return _match_batch(queries, dates,
+                            await self._run_ledger_async(args))
+
+
+def _query_args(query):
+    # Need to use reg not print command: matches postings rather
+    # than whole transactions.
+    args = ['reg']
+    for k, v in query.items():
+        if k == 'amt':
+            v = '{:+f}'.format(v)
+        args.append('{}:{}'.format(k, v))
+    return args
+
+
+def _batch_args(queries):
+    """Return the hledger arguments for a register report covering
+    `queries`, and the queries' dates; or None if a date is missing or
+    unparseable."""
+    try:
+        dates = [_parse_date(q['date']) for q in queries]
+    except (KeyError, ValueError):
+        return None
+    args = ['reg', '-O', 'csv', 'date:{}..{}'.format(
+        min(dates), max(dates) + timedelta(days=1))]
+    accounts = set(q['acct'] for q in queries if 'acct' in q)
+    if all('acct' in q for q in queries):
+        args += ['acct:{}'.format(a) for a in sorted(accounts)]
+    return args, dates
+
+
+def _match_batch(queries, dates, report):
+    postings = [_convert_posting(row) for row in
+                csv.DictReader(report.splitlines())]
+    by_date = {}
+    for p in postings:
+        by_date.setdefault(p['date'], []).append(p)
+    results = []
+    for date, query in zip(dates, queries):
+        found = [p for p in by_date.get(date, [])
+                 if _posting_matches(p, query)]
+        results.append(found or None)
+    return results
+
+
+def _parse_date(s):
+    return datetime.strptime(s.replace('/', '-').replace('.', '-'),
+                             '%Y-%m-%d').date()
+
+
+def _convert_posting(row):
+    amounts = []
+    for a in row['amount'].split(', '):
+        m = AMOUNT_RE.match(a.strip())
+        if m is None:
+            continue
+        sign, prefix, number, suffix = m.groups()
+        try:
+            value = Decimal(sign + number.replace(',', ''))
+        except InvalidOperation:
+            continue
+        amounts.append((prefix or suffix, value))
+    return {'date': _parse_date(row['date']),
+            'description': row['description'],
+            'account': row['account'],
+            'amounts': amounts}
+
+
+def _posting_matches(posting, query):
+    """Match a posting the way the equivalent hledger query terms would."""
+    for k, v in query.items():
+        if k == 'desc':
+            if not re.search(v, posting['description'], re.I):
+                return False
+        elif k == 'acct':
+            if not re.search(v, posting['account'], re.I):
+                return False
+        elif k == 'amt':
+            if len(posting['amounts']) != 1:
+                return False
+            if posting['amounts'][0][1] != Decimal('{:f}'.format(v)):
+                return False
+        elif k == 'cur':
+            if not any(re.fullmatch(v, c, re.I)
+                       for c, _ in posting['amounts']):
+                return False
+        elif k != 'date':
+            raise ValueError("Unsupported query term: {}".format(k))
+    return True
@@ -0,0 +1,163 @@
+"""Timings and counters for the stages of an import.
+
+Nothing is recorded unless start() has been called. Until then the
+hooks below return their arguments unchanged or do nothing, so the
+cost in the pipeline is a check of `current`.
+
+Time is attributed exclusively: while a nested stage runs (such as
+rule matching inside CSV conversion, or CSV reading pulled through a
+deduplication generator) the enclosing stage's clock is stopped.
+"""
+import json
+import time
+from contextlib import contextmanager
+
+__all__ = ['start', 'stop', 'stage', 'timed', 'timed_call', 'count']
+
+current = None
+
+
+class Profile:
+    def __init__(self):
+        self.stages = {}    # name -> [calls, seconds]
+        self.counters = {}
+        # rule index (None: no rule) -> [rows converted with it, seconds
+        # spent finding it for descriptions not in the match cache]
+        self.rules = {}
+        self._stack = []
+        self._started = self._mark = time.perf_counter()
+
+    def _switch(self):
+        now = time.perf_counter()
+        if self._stack:
+            self.stages[self._stack[-1]][1] += now - self._mark
+        self._mark = now
+
+    def enter(self, name):
+        self._switch()
+        self._stack.append(name)
+        self.stages.setdefault(name, [0, 0.0])[0] += 1
+
+    def exit(self):
+        self._switch()
+        self._stack.pop()
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def rule_hit(self, index):
+        self.rules.setdefault(index, [0, 0.0])[0] += 1
+
+    def rule_match_time(self, index, seconds):
+        """Charge the time taken to find rule `index`, trying every rule
+        before it, to that rule: it is not split among the rules tried.
+        Only match cache misses are timed."""
+        self.rules.setdefault(index, [0, 0.0])[1] += seconds
+
+    def as_dict(self):
+        return {
+            'wall_seconds': time.perf_counter() - self._started,
+            'stages': {name: {'calls': calls, 'seconds': seconds}
+                       for name, (calls, seconds) in self.stages.items()},
+            'counters': dict(self.counters),
+            'rules': [{'rule': index, 'hits': hits,
+                       'match_seconds_uncached': seconds}
+                      for index, (hits, seconds) in self._rules_by_hits()],
+        }
+
+    def _rules_by_hits(self):
+        return sorted(self.rules.items(), key=lambda x: -x[1][0])
+
+    def write_json(self, f):
+        json.dump(self.as_dict(), f, indent=2)
+        f.write('\n')
+
+    def format_table(self, top_rules=10):
+        wall = time.perf_counter() - self._started
+        lines = ['{:24} {:>10} {:>10} {:>6}'.format('stage', 'calls',
+                                                    'seconds', '%')]
+        for name, (calls, seconds) in sorted(self.stages.items(),
+                                             key=lambda x: -x[1][1]):
+            lines.append('{:24} {:10d} {:10.3f} {:6.1f}'
+                         .format(name, calls, seconds,
+                                 100 * seconds / wall if wall else 0))
+        lines.append('{:24} {:10} {:10.3f}'.format('total', '', wall))
+        if self.counters:
+            lines.append('')
+            for name, value in sorted(self.counters.items()):
+                lines.append('{:35} {:10d}'.format(name, value))
+        if self.rules:
+            lines.append('')
+            # Time to find the winning rule on match cache misses
+            lines.append('{:24} {:>10} {:>10}'.format('rule', 'hits',
+                                                      'uncached s'))
+            for index, (hits, seconds) in \
+                    self._rules_by_hits()[:top_rules]:
+                name = 'no rule' if index is None else '#{}'.format(index)
+                lines.append('{:24} {:10d} {:10.3f}'
+                             .format(name, hits, seconds))
+        return '\n'.join(lines)
+
+
+def start():
+    global current
+    current = Profile()
+    return current
+
+
+def stop():
+    global current
+    profile, current = current, None
+    return profile
+
+
+@contextmanager
+def stage(name):
+    profile = current
+    if profile is None:
+        yield
+        return
+    profile.enter(name)
+    try:
+        yield
+    finally:
+        profile.exit()
+
+
+def timed(name, iterable):
+    """Return `iterable`, timing each step of it as stage `name`."""
+    if current is None:
+        return iterable
+    return _timed(current, name, iter(iterable))
+
+
+def _timed(profile, name, iterator):
+    while True:
+        profile.enter(name)
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            profile.exit()
+        yield item
+
+
+def timed_call(name, f):
+    """Return `f`, timing each call of it as stage `name`."""
+    profile = current
+    if profile is None:
+        return f
+
+    def timed_f(*args, **kw):
+        profile.enter(name)
+        try:
+            return f(*args, **kw)
+        finally:
+            profile.exit()
+    return timed_f
+
+
+def count(name, n=1):
+    if current is not None:
+        current.count(name, n)
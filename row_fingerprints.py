@@ -0,0 +1,163 @@
+"""A record of the CSV rows already imported into a journal.
+
+Statements overlap: the same rows come back in each day's download of
+the current statement. A hash of each row imported is stored, under
+the statement's source account, in an SQLite file next to the journal,
+so that rows seen before are dropped as they are read, before any rule
+matching or duplicate check.
+
+Identical rows in one file (two coffees on the same day) are told apart
+by how many of them came before, so each is recorded on its own.
+
+The rows are only as good as the journal they were appended to: the
+length of the journal and a checksum of it are stored with them, and
+if it has since been changed other than by appending (a transaction
+deleted, say, to import it again), the rows recorded are forgotten
+and every row is checked against the journal again.
+"""
+import hashlib
+import os
+import sqlite3
+from collections import Counter
+from contextlib import contextmanager
+import profiling
+
+# Bytes read at a time to checksum the journal
+READ_SIZE = 1 << 20
+
+__all__ = ['RowFingerprints', 'default_path']
+
+
+def default_path(ledger_file):
+    directory, name = os.path.split(os.path.abspath(ledger_file))
+    return os.path.join(directory, '.{}.rows.sqlite'.format(name))
+
+
+def source_account(rules):
+    """The account a CSV file's rows are imported from, as far as can be
+    told without matching rules."""
+    return rules.defaults.get('account1', '')
+
+
+def fingerprint(row, seen):
+    """Return a hash of `row`, and of how many identical rows are counted
+    in the Counter `seen`, which it is then counted in."""
+    text = '\x1f'.join(row)
+    n = seen[text]
+    seen[text] += 1
+    return hashlib.blake2b('{}\x1e{}'.format(text, n).encode('utf8'),
+                           digest_size=16).digest()
+
+
+class RowFingerprints:
+    """The fingerprints of imported rows stored in the SQLite file `path`.
+
+    filter() drops the rows of a file imported before and notes the
+    fingerprints of all its rows; recording() stores those once the
+    transactions made from them have been appended.
+
+    Given the journal `ledger_file` the rows are appended to, rows
+    recorded before it was last changed other than by appending are
+    forgotten.
+    """
+
+    def __init__(self, path, ledger_file=None):
+        self.path = path
+        self.ledger_file = ledger_file
+        self._db = sqlite3.connect(path)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS rows ('
+                             'account TEXT NOT NULL, '
+                             'fingerprint BLOB NOT NULL, '
+                             'PRIMARY KEY (account, fingerprint)) '
+                             'WITHOUT ROWID')
+            self._db.execute('CREATE TABLE IF NOT EXISTS journal ('
+                             'offset INTEGER, checksum TEXT)')
+        self._known = {}
+        # filename -> (account, fingerprints) of the rows last read
+        self.pending = {}
+        self._offset = 0
+        self._checksum = hashlib.blake2b()
+        if ledger_file is not None:
+            self._check_journal()
+
+    def close(self):
+        self._db.close()
+
+    def _read_journal(self):
+        """Checksum the journal from where the checksum ends."""
+        with open(self.ledger_file, 'rb') as f:
+            f.seek(self._offset)
+            for data in iter(lambda: f.read(READ_SIZE), b''):
+                self._checksum.update(data)
+                self._offset += len(data)
+
+    def _check_journal(self):
+        """Forget the rows recorded if the journal has been changed other
+        than by appending since they were."""
+        stored = self._db.execute('SELECT offset, checksum '
+                                  'FROM journal').fetchone()
+        if stored is not None:
+            offset, expected = stored
+            with open(self.ledger_file, 'rb') as f:
+                while self._offset < offset:
+                    data = f.read(min(offset - self._offset, READ_SIZE))
+                    if not data:
+                        break
+                    self._checksum.update(data)
+                    self._offset += len(data)
+            if self._offset == offset and \
+                    self._checksum.hexdigest() == expected:
+                return
+            self._offset = 0
+            self._checksum = hashlib.blake2b()
+        if self._db.execute('SELECT 1 FROM rows LIMIT 1').fetchone():
+            profiling.count('recorded rows forgotten')
+        with self._db:
+            self._db.execute('DELETE FROM rows')
+            self._db.execute('DELETE FROM journal')
+
+    def known(self, account):
+        if account not in self._known:
+            self._known[account] = set(fp for fp, in self._db.execute(
+                'SELECT fingerprint FROM rows WHERE account = ?',
+                (account,)))
+        return self._known[account]
+
+    def filter(self, filename, rules, rows):
+        """Yield those of `rows`, read from `filename` with `rules`, that
+        have not been imported before."""
+        account = source_account(rules)
+        known = self.known(account)
+        fingerprints = []
+        self.pending[filename] = account, fingerprints
+        seen = Counter()
+        skipped = 0
+        for row in rows:
+            fp = fingerprint(row, seen)
+            fingerprints.append(fp)
+            if fp in known:
+                skipped += 1
+            else:
+                yield row
+        profiling.count('rows already imported', skipped)
+
+    @contextmanager
+    def recording(self):
+        """Store the pending fingerprints if the block, which appends the
+        rows' transactions to the journal, succeeds."""
+        # The connection commits, or rolls back if the block raises
+        with self._db:
+            for account, fingerprints in self.pending.values():
+                self._db.executemany(
+                    'INSERT OR IGNORE INTO rows VALUES (?, ?)',
+                    ((account, fp) for fp in fingerprints))
+            yield
+            if self.ledger_file is not None:
+                self._read_journal()
+                self._db.execute('DELETE FROM journal')
+                self._db.execute('INSERT INTO journal VALUES (?, ?)',
+                                 (self._offset, self._checksum.hexdigest()))
+        for account, fingerprints in self.pending.values():
+            self.known(account).update(fingerprints)
+        self.pending = {}
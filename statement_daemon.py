@@ -0,0 +1,284 @@
+"""Ingest a directory of CSV statements as they are written.
+
+StatementDaemon watches a directory and appends the new transactions
+in its CSV files to a journal, unattended. Bursts of events for a file,
+as a download or a bank export produces, are coalesced: a file is read
+once no event for it has arrived for `delay` seconds.
+
+A state file records, for each CSV file, how many bytes of it have been
+appended and the SHA-256 hash of those bytes. While they are unchanged,
+only what has been added to the file since is converted, so each row is
+read and appended once, across restarts too. A file whose recorded
+bytes have changed is read again from the start, and what is already in
+the journal is dropped by the usual duplicate check.
+
+Many exports have no newline after their last row, but a row cut short
+by a writer that paused looks the same. Such a row is held back, and
+only taken as complete once the file has stayed the same size and age
+for another `delay` seconds.
+"""
+import csv
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+import time
+import click
+import profiling
+from balance_check import journal_balances, check_balances
+from csv_importer import (RowPlan, convert_rows, open_ledger, deduplicate,
+                          date_range, append_transactions)
+
+__all__ = ['StatementDaemon', 'default_state_file']
+
+VERSION = 1
+
+STATE_FILE = '.ledger-csv-merge-state.json'
+
+
+def default_state_file(directory):
+    return os.path.join(directory, STATE_FILE)
+
+
+def load_state(state_file):
+    """Return the {name: {'offset', 'sha256'}} recorded in `state_file`,
+    or an empty dict if there is none."""
+    try:
+        with open(state_file, 'r') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if state.get('version') != VERSION:
+        raise ValueError('{}: unknown state file version'.format(state_file))
+    return state['files']
+
+
+def store_state(state_file, files):
+    # Replace the file, so that it is never seen half written
+    tmp = '{}.{}.tmp'.format(state_file, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump({'version': VERSION, 'files': files}, f, indent=1,
+                  sort_keys=True)
+    os.replace(tmp, state_file)
+
+
+def record_end(data, start=0, complete=False):
+    """Return the end of the last complete record in data[start:], which
+    must begin a record: just after a newline outside quotes.
+
+    With `complete`, for a file taken to be fully written, the end of
+    the data also ends a record, unless it is inside quotes: many
+    exports have no newline after their last row.
+    """
+    end = len(data)
+    if complete and end > start and not data.endswith(b'\n') and \
+            data.count(b'"', start) % 2 == 0:
+        return end
+    while True:
+        end = data.rfind(b'\n', start, end) + 1
+        if end <= start:
+            return start
+        if data.count(b'"', start, end) % 2 == 0:
+            return end
+        # That newline is inside a quoted field
+        end -= 1
+
+
+def unread(data, entry, complete=False):
+    """Return the (start, end) of the complete records of a file's
+    contents `data` not yet appended according to its state `entry`;
+    `complete` is as for record_end()."""
+    start = 0
+    if entry is not None and entry['offset'] <= len(data) and \
+            hashlib.sha256(data[:entry['offset']]).hexdigest() == \
+            entry['sha256']:
+        start = entry['offset']
+        if data[start - 1:start] not in (b'', b'\n'):
+            # The last record appended had no newline then; skip the one
+            # written after it since.
+            for newline in (b'\r\n', b'\n'):
+                if data.startswith(newline, start):
+                    start += len(newline)
+                    break
+    return start, record_end(data, start, complete)
+
+
+def rows_from_bytes(data, rules, skip_header):
+    # As csv_importer.read_rows() reads a file
+    f = io.TextIOWrapper(io.BytesIO(data))
+    if skip_header:
+        for i in range(rules.options.get('skip', 0)):
+            f.readline()
+    return list(csv.reader(f))
+
+
+class StatementDaemon:
+    """Append the new transactions of the CSV files in `directory` to
+    `ledger_file` as the files are written.
+
+    `load_rules` is called for the rules to convert each batch of files
+    with, so that changes to them are picked up.
+    """
+
+    def __init__(self, ledger_file, load_rules, directory, state_file=None,
+                 delay=2.0, fuzzy=None):
+        self._ledger_file = ledger_file
+        self._load_rules = load_rules
+        self._directory = directory
+        self._state_file = state_file or default_state_file(directory)
+        self._delay = delay
+        self._fuzzy = fuzzy
+        self._files = load_state(self._state_file)
+        # name -> (size, mtime) of files whose last row, with no newline
+        # after it, was held back
+        self._held = {}
+        self._pending = {}
+        self._changed = threading.Condition()
+        self._stopped = False
+
+    def _on_event(self, event):
+        # A file moved into place is known by its new name
+        path = getattr(event, 'dest_path', None) or event.src_path
+        if not path.lower().endswith('.csv'):
+            return
+        self._read_later(path)
+
+    def _read_later(self, path):
+        """Read `path` once it has had no events for self._delay
+        seconds from now."""
+        with self._changed:
+            self._pending[path] = time.monotonic()
+            self._changed.notify()
+
+    def _wait_for_files(self, timeout=None):
+        """Return the files that have had no events for self._delay
+        seconds, waiting for some if there are none; or [] after
+        `timeout` seconds or once stopped."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while not self._stopped:
+                now = time.monotonic()
+                quiet = sorted(path for path, last in self._pending.items()
+                               if now - last >= self._delay)
+                if quiet:
+                    for path in quiet:
+                        del self._pending[path]
+                    return quiet
+                waits = [last + self._delay - now
+                         for last in self._pending.values()]
+                if deadline is not None:
+                    waits.append(deadline - now)
+                    if deadline <= now:
+                        break
+                self._changed.wait(min(waits) if waits else None)
+        return []
+
+    def stop(self):
+        with self._changed:
+            self._stopped = True
+            self._changed.notify()
+
+    def csv_files(self):
+        return sorted(os.path.join(self._directory, name)
+                      for name in os.listdir(self._directory)
+                      if name.lower().endswith('.csv'))
+
+    def run(self):
+        """Ingest the directory's CSV files, then any written to it,
+        until stop() is called."""
+        from watchdog.observers import Observer
+        from watchdog.events import PatternMatchingEventHandler
+        handler = PatternMatchingEventHandler(patterns=['*.csv'],
+                                              ignore_directories=True)
+        handler.on_created = handler.on_modified = handler.on_moved = \
+            self._on_event
+        observer = Observer()
+        observer.schedule(handler, self._directory)
+        # Watch before catching up, so that nothing written meanwhile is
+        # missed; files seen twice have nothing left to read the second
+        # time.
+        observer.start()
+        try:
+            self.ingest(self.csv_files())
+            while not self._stopped:
+                filenames = self._wait_for_files()
+                if filenames:
+                    self.ingest(filenames)
+        finally:
+            observer.stop()
+            observer.join()
+
+    def ingest(self, filenames):
+        """Append the new transactions of each of `filenames`, returning
+        how many were appended.
+
+        A file that cannot be ingested is reported and left as it was
+        recorded, to be tried again when it next changes.
+        """
+        rules = self._load_rules()
+        appended = 0
+        for filename in filenames:
+            if not os.path.exists(filename):
+                continue
+            try:
+                appended += self._ingest_file(filename, rules)
+            except Exception as err:
+                logging.error('%s: not appended: %s', os.path.relpath(
+                    filename, self._directory), err)
+        return appended
+
+    def _ingest_file(self, filename, rules):
+        name = os.path.relpath(filename, self._directory)
+        with profiling.stage('read csv'), open(filename, 'rb') as f:
+            data = f.read()
+            st = os.fstat(f.fileno())
+        entry = self._files.get(name)
+        start, end = unread(data, entry)
+        if record_end(data, end, complete=True) > end:
+            # A last row with no newline after it
+            seen = (st.st_size, st.st_mtime_ns)
+            if self._held.pop(name, None) == seen:
+                end = len(data)
+            else:
+                self._held[name] = seen
+                self._read_later(filename)
+        if end == start:
+            return 0
+        if entry is not None and start == 0:
+            logging.warning('%s has changed, reading it again', name)
+
+        rows = rows_from_bytes(data[start:end], rules, start == 0)
+        transactions = [t for _, t in profiling.timed(
+            'convert rows', convert_rows(RowPlan(rules), rows))]
+        dates = date_range(transactions,
+                           self._fuzzy.days if self._fuzzy else 0)
+        transactions = list(deduplicate(
+            transactions, open_ledger(self._ledger_file, dates=dates),
+            self._fuzzy))
+
+        mismatch = check_balances(transactions, journal_balances(
+            self._ledger_file, set(t.account1 for t in transactions)))
+        if mismatch is not None:
+            # Left unrecorded, to be tried again when the file changes
+            t, expected = mismatch
+            click.secho('{}: not appending: {} {} states {}{} but the '
+                        'journal and earlier transactions give {}{}'
+                        .format(name, t.date, t.description, t.currency,
+                                t.balance.quantize(expected), t.currency,
+                                expected), fg='red')
+            return 0
+
+        if transactions:
+            append_transactions(self._ledger_file, [(filename, transactions)])
+        # Recorded after appending: if interrupted in between, the rows
+        # are read again and found to be duplicates.
+        self._files[name] = {'offset': end,
+                             'sha256': hashlib.sha256(data[:end]).hexdigest()}
+        store_state(self._state_file, self._files)
+        unknown = sum(t.account2 == 'expenses:unknown' for t in transactions)
+        click.secho('{}: appended {} transactions ({} with unknown account)'
+                    .format(name, len(transactions), unknown),
+                    fg='yellow' if unknown else None)
+        return len(transactions)
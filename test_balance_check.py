@@ -0,0 +1,96 @@
+import unittest
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+JOURNAL = """
+2014-09-01 Opening
+    assets:bank  £100.00
+    equity:opening
+
+2014-09-03 Shop
+    expenses:food  £10.15
+    assets:bank
+
+2014-09-05 Other account
+    assets:savings  £50
+    assets:bank  £-50 = £39.85
+"""
+
+
+def transaction(date, amount, balance=None, account1='assets:bank'):
+    from csv_importer import Transaction
+    return Transaction(date, account1, 'expenses:unknown', amount, '£',
+                       'x', balance)
+
+
+class TestJournalBalances(unittest.TestCase):
+    def test_running_balances(self):
+        from balance_check import journal_balances
+        balances = journal_balances(StringIO(JOURNAL), ['assets:bank'])
+        days, running = balances[('assets:bank', '£')]
+        self.assertEqual(days, [735477, 735479, 735481])
+        self.assertEqual(running, [Decimal('100.00'), Decimal('89.85'),
+                                   Decimal('39.85')])
+
+    def test_assertion_sets_balance(self):
+        from balance_check import journal_balances
+        balances = journal_balances(StringIO(
+            JOURNAL.replace('= £39.85', '= £1000')), ['assets:bank'])
+        self.assertEqual(balances[('assets:bank', '£')][1][-1],
+                         Decimal('1000'))
+
+
+class TestCheckBalances(unittest.TestCase):
+    def _check(self, transactions, numpy=True):
+        import balance_check
+        balances = balance_check.journal_balances(StringIO(JOURNAL),
+                                                  ['assets:bank'])
+        if numpy:
+            return balance_check.check_balances(transactions, balances)
+        with mock.patch('balance_check._first_mismatch_numpy',
+                        balance_check._first_mismatch):
+            return balance_check.check_balances(transactions, balances)
+
+    def _both(self, transactions):
+        result = self._check(transactions, numpy=False)
+        self.assertEqual(self._check(transactions), result)
+        return result
+
+    def test_consistent(self):
+        self.assertIsNone(self._both([
+            transaction('2014-09-06', '-9.85', '30.00'),
+            transaction('2014-09-07', '5', None),
+            transaction('2014-09-07', '0.005', '35.005'),
+        ]))
+
+    def test_gap(self):
+        ts = [transaction('2014-09-06', '-9.85', '30.00'),
+              transaction('2014-09-08', '-5', '20.00'),
+              transaction('2014-09-09', '-5', '15.00')]
+        self.assertEqual(self._both(ts), (ts[1], Decimal('25.00')))
+
+    def test_anchored_on_balance_at_date(self):
+        # Before the 2014-09-05 transfer out of the account
+        self.assertIsNone(self._both([
+            transaction('2014-09-04', '0.15', '90.00')]))
+
+    def test_applied_in_date_order(self):
+        ts = [transaction('2014-09-07', '-5', '30.00'),
+              transaction('2014-09-06', '-4.85', '35.00'),
+              transaction('2014-09-08', '1', '99')]
+        self.assertEqual(self._both(ts), (ts[2], Decimal('31.00')))
+
+    def test_first_in_append_order(self):
+        ts = [transaction('2014-09-06', '1', '1', account1='assets:other'),
+              transaction('2014-09-06', '1', '1')]
+        self.assertEqual(self._both(ts), (ts[1], Decimal('40.85')))
+
+    def test_unplaceable_dates_are_not_checked(self):
+        self.assertIsNone(self._both([
+            transaction('2014-09-06', '1', '1'),
+            transaction('06/09/2014', '1', '2')]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,373 @@
+import os
+import unittest
+from io import StringIO
+from tempfile import NamedTemporaryFile
+
+RULES = """
+skip 1
+fields date, description, amount, balance, reference
+currency £
+account1 assets:bank
+account2 expenses:unknown
+
+if TESCO
+  account2 expenses:food
+
+if ^CHQ
+  description Cheque {reference:>6} ({description})
+  code {reference}
+
+if {{
+  description literal {{braces}}
+"""
+
+CSV = """Date,Description,Amount,Balance,Reference
+2014-09-01,TESCO STORES,-10.15,89.85,
+2014-09-02,*CHQ 100,250.00,339.85,123
+2014-09-03,{{odd},-1,,
+"""
+
+
+class TestReadTransactions(unittest.TestCase):
+    def _read(self, rules_contents, csv_contents):
+        from csv_rules import Rules
+        from csv_importer import read_transactions_from_csv
+        rules = Rules(StringIO(rules_contents))
+        with NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(csv_contents)
+        try:
+            return [str(t) for t in read_transactions_from_csv(f.name, rules)]
+        finally:
+            os.unlink(f.name)
+
+    def test_reads_transactions(self):
+        self.assertEqual(self._read(RULES, CSV), [
+            '2014-09-01 TESCO STORES\n'
+            '    assets:bank  £-10.15 = £89.85\n'
+            '    expenses:food  £10.15',
+            '2014-09-02 (123) Cheque    123 (*CHQ 100)\n'
+            '    assets:bank  £250.00 = £339.85\n'
+            '    expenses:unknown  £-250.00',
+            '2014-09-03 literal {braces}\n'
+            '    assets:bank  £-1.00\n'
+            '    expenses:unknown  £1.00',
+        ])
+
+    def test_rules_testing_other_fields(self):
+        rules = RULES + """
+if %reference ^123$
+  account2 expenses:rent
+
+if %amount ^-1$
+& %5 ^$
+  account2 expenses:fee
+"""
+        csv = ('Date,Description,Amount,Balance,Reference\n'
+               '2014-09-01,TESCO,-10.15,,123\n'
+               '2014-09-02,SO,-250.00,,123\n'
+               '2014-09-03,SO,-250.00,,124\n'
+               '2014-09-04,FEE,-1,,\n'
+               '2014-09-05,FEE,-1,,1\n')
+        self.assertEqual([t.splitlines()[-1] for t in self._read(rules, csv)],
+                         ['    expenses:food  £10.15',
+                          '    expenses:rent  £250.00',
+                          '    expenses:unknown  £250.00',
+                          '    expenses:fee  £1.00',
+                          '    expenses:unknown  £1.00'])
+
+    def test_unknown_condition_field(self):
+        with self.assertRaises(RuntimeError):
+            self._read(RULES + 'if %payee x\n  account2 y\n', CSV)
+
+    def test_missing_required_field(self):
+        with self.assertRaises(RuntimeError):
+            self._read('fields date, description, amount\n',
+                       '2014-09-01,x,1\n')
+
+    def test_unknown_template_field(self):
+        with self.assertRaises(KeyError):
+            self._read('fields date, description, amount\n'
+                       'currency £\naccount1 a\naccount2 b\n'
+                       'comment {nonexistent}\n',
+                       '2014-09-01,x,1\n')
+
+
+class TestChunkRanges(unittest.TestCase):
+    CSV = ('Date,Description,Amount\n' +
+           ''.join('2014-09-{:02},"SHOP\n{}, ""A""",-{}\n'.format(
+               i % 28 + 1, i, i) for i in range(50)))
+
+    def setUp(self):
+        from csv_rules import Rules
+        self.rules = Rules(StringIO(RULES.replace(
+            'balance, reference', 'x')))
+        with NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(self.CSV)
+        self.addCleanup(os.unlink, f.name)
+        self.filename = f.name
+
+    def test_chunks_are_whole_rows(self):
+        from csv_importer import chunk_ranges, read_rows
+        whole = list(read_rows(self.filename, self.rules))
+        self.assertEqual(len(whole), 50)
+        for chunks in [1, 2, 7, 100]:
+            ranges = chunk_ranges(self.filename, chunks, skip=1)
+            self.assertLessEqual(len(ranges), chunks)
+            self.assertEqual(ranges[0][0], len(self.CSV.splitlines()[0]) + 1)
+            self.assertEqual(ranges[-1][1], len(self.CSV))
+            self.assertEqual([row for chunk in ranges
+                              for row in read_rows(self.filename, self.rules,
+                                                   chunk=chunk)], whole)
+
+    def test_transactions_in_chunks(self):
+        from csv_importer import chunk_ranges, get_transactions
+        whole = [str(t) for t in get_transactions(self.filename, self.rules)]
+        self.assertEqual([str(t) for chunk in chunk_ranges(self.filename, 3,
+                                                           skip=1)
+                          for t in get_transactions(self.filename,
+                                                    self.rules,
+                                                    chunk=chunk)], whole)
+
+    def test_only_header(self):
+        from csv_importer import chunk_ranges
+        with open(self.filename, 'w') as f:
+            f.write('Date,Description,Amount\n')
+        self.assertEqual(chunk_ranges(self.filename, 4, skip=1), [])
+
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class TestColumnarIngest(TestReadTransactions):
+    def _read(self, rules_contents, csv_contents):
+        rows = super()._read(rules_contents, csv_contents)
+        columnar = super()._read('ingest columnar\n' + rules_contents,
+                                 csv_contents)
+        self.assertEqual(columnar, rows)
+        return columnar
+
+    def test_amounts_and_dates(self):
+        self._read(
+            'fields date, description, amount, balance\n'
+            'currency £\naccount1 a\naccount2 b\n',
+            '2014-09-01,x,-0.50,+1\n'
+            '2014-02-30,x, 1.5e2 ,\n'
+            '01/09/2014,**x,-.5,1_000.1\n'
+            '"2014-09-01\n",x,12345678901234567890.12,one\n'
+            '2014-09-01,x,1.005,- 1\n')
+
+    def test_missing_amount(self):
+        with self.assertRaises(RuntimeError):
+            self._read('fields date, description, amount\n'
+                       'currency £\naccount1 a\naccount2 b\n',
+                       '2014-09-01,x,1\n2014-09-02,y,\n')
+
+    def test_short_row(self):
+        with self.assertRaises(IndexError):
+            self._read('fields date, description, amount\n'
+                       'currency £\naccount1 a\naccount2 b\n',
+                       '2014-09-01,x,1\n2014-09-02,y\n')
+
+    def test_unknown_mode(self):
+        with self.assertRaises(ValueError):
+            super()._read('ingest sideways\n' + RULES, CSV)
+
+
+class TestTransaction(unittest.TestCase):
+    def test_parse_amount(self):
+        from csv_importer import parse_amount
+        self.assertEqual(parse_amount('-10.15'), (-1015, 2))
+        self.assertEqual(parse_amount(' 250 '), (250, 0))
+        self.assertEqual(parse_amount('-.5'), (-5, 1))
+        self.assertEqual(parse_amount('1.5e2'), (150, 0))
+        for text in ['', 'x', '1.2.3', 'nan', 'inf']:
+            with self.assertRaises(ValueError):
+                parse_amount(text)
+
+    def test_amounts_are_exact(self):
+        from decimal import Decimal
+        from csv_importer import Transaction
+        t = Transaction('2014-09-01', 'a', 'b', '0.10', '£', 'x',
+                        balance='0.30')
+        self.assertEqual(t.amount, Decimal('0.10'))
+        self.assertEqual(t.balance, Decimal('0.30'))
+        self.assertEqual(Transaction('2014-09-01', 'a', 'b', 0.1, '£')
+                         .amount, Decimal('0.1'))
+
+    def test_str(self):
+        from csv_importer import Transaction
+        self.assertEqual(
+            str(Transaction('2014-09-01', 'a', 'b', '1.005', '£', 'x',
+                            balance='-3', code='7')),
+            '2014-09-01 (7) x\n'
+            '    a  £1.005 = £-3.00\n'
+            '    b  £-1.005')
+        for zero in ['0', '-0.00', 0.0, -0.0]:
+            self.assertEqual(
+                str(Transaction('2014-09-01', 'a', 'b', zero, '£', 'x',
+                                balance='-0')),
+                '2014-09-01 x\n'
+                '    a  £0.00 = £0.00\n'
+                '    b  £0.00')
+
+    def test_other_dates_are_kept(self):
+        from csv_importer import Transaction
+        for date in ['2014-09-01', '2014/09/01', '01/09/2014',
+                     '2014-02-30']:
+            self.assertEqual(
+                Transaction(date, 'a', 'b', '1', '£').date, date)
+
+
+class FakeLedger:
+    """Answers find_transactions_async() after a delay, with amounts
+    over 100 already entered."""
+
+    def __init__(self, delays):
+        self.delays = list(delays)
+        self.running = self.most_running = 0
+
+    async def find_transactions_async(self, queries):
+        import asyncio
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+        await asyncio.sleep(self.delays.pop(0))
+        self.running -= 1
+        return [q['amt'] > 100 for q in queries]
+
+
+class TestDeduplicateAsync(unittest.TestCase):
+    def _transactions(self, n):
+        from csv_importer import Transaction
+        return [Transaction('2014-09-01', 'a', 'b', str(i), '£')
+                for i in range(n)]
+
+    def test_order_is_kept(self):
+        import asyncio
+        from csv_importer import deduplicate_async
+        transactions = self._transactions(250)
+        # Later chunks finish first
+        ledger = FakeLedger([0.05, 0.04, 0.03, 0.02, 0.01])
+
+        async def run():
+            return [t async for t in deduplicate_async(
+                transactions, ledger, chunk_size=50,
+                limit=asyncio.Semaphore(3))]
+        self.assertEqual(asyncio.run(run()), transactions[:101])
+        self.assertEqual(ledger.most_running, 3)
+
+    def test_concurrently(self):
+        from csv_importer import deduplicate_concurrently
+        statements = [self._transactions(120), self._transactions(90)]
+        ledger = FakeLedger([0.01] * 4)
+        self.assertEqual(
+            deduplicate_concurrently(statements, ledger, concurrency=2),
+            [statements[0][:101], statements[1]])
+        self.assertEqual(ledger.most_running, 2)
+
+
+class TestFuzzyDeduplicate(unittest.TestCase):
+    JOURNAL = """
+2014-08-30 TESCO STORES 1234
+    assets:bank  £-10.15
+    expenses:food
+"""
+
+    def _get(self, fuzzy):
+        from csv_rules import Rules
+        from csv_importer import get_transactions
+        files = []
+        for suffix, contents in [('.csv', CSV), ('.journal', self.JOURNAL)]:
+            with NamedTemporaryFile('w', suffix=suffix, delete=False) as f:
+                f.write(contents)
+            self.addCleanup(os.unlink, f.name)
+            files.append(f.name)
+        return [t.description for t in get_transactions(
+            files[0], Rules(StringIO(RULES)), files[1], fuzzy=fuzzy)]
+
+    def test_near_duplicates_are_dropped(self):
+        from ledger_index import FuzzyMatch
+        self.assertEqual(len(self._get(None)), 3)
+        self.assertEqual(len(self._get(FuzzyMatch(1, 0.8))), 3)
+        # The journal's transaction is two days before the statement's
+        self.assertEqual(len(self._get(FuzzyMatch(2, 0.8))), 2)
+        self.assertEqual(len(self._get(FuzzyMatch(2, 0.95))), 3)
+
+    def test_each_posting_matches_one_row(self):
+        from io import StringIO as Journal
+        from csv_importer import Transaction, deduplicate
+        from ledger_index import FuzzyMatch, LedgerIndex
+        index = LedgerIndex(Journal(self.JOURNAL.replace('2014-08-30',
+                                                         '2014-09-01')))
+        # The same purchase each week, the second not yet entered
+        rows = [Transaction(date, 'assets:bank', 'expenses:food', '-10.15',
+                            '£', 'TESCO STORES')
+                for date in ['2014-09-01', '2014-09-08']]
+        self.assertEqual(list(deduplicate(rows, index, FuzzyMatch(7, 0.8))),
+                         rows[1:])
+
+    def test_date_range_margin(self):
+        from csv_importer import Transaction, date_range
+        ts = [Transaction('2014-09-01', 'a', 'b', '1', '£'),
+              Transaction('2014-09-30', 'a', 'b', '1', '£')]
+        self.assertEqual(date_range(ts), ('2014-09-01', '2014-09-30'))
+        self.assertEqual(date_range(ts, 2), ('2014-08-30', '2014-10-02'))
+
+
+class TestStatementCache(unittest.TestCase):
+    def setUp(self):
+        with NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(CSV)
+        self.filename = f.name
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def _rules(self, contents=RULES):
+        from csv_rules import Rules
+        return Rules(StringIO(contents))
+
+    def test_only_rows_affected_by_new_rules_are_converted(self):
+        from csv_importer import StatementCache
+        statement = StatementCache(self.filename)
+        self.assertEqual(statement.update(self._rules()), 3)
+        # The TESCO row is won by the first rule, which has not changed
+        rules = self._rules(RULES.replace('code {reference}',
+                                          'account2 expenses:cheques'))
+        self.assertEqual(statement.update(rules), 2)
+        self.assertEqual([t.account2 for t in statement.transactions],
+                         ['expenses:food', 'expenses:cheques',
+                          'expenses:unknown'])
+        self.assertEqual(statement.update(rules), 0)
+
+    def test_changed_defaults_convert_every_row(self):
+        from csv_importer import StatementCache
+        statement = StatementCache(self.filename)
+        statement.update(self._rules())
+        rules = self._rules(RULES + 'currency $\n')
+        self.assertEqual(statement.update(rules), 3)
+        self.assertEqual(set(t.currency for t in statement.transactions),
+                         set('$'))
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_columnar_ingest(self):
+        from csv_importer import StatementCache
+        rows = StatementCache(self.filename)
+        rows.update(self._rules())
+        columnar = StatementCache(self.filename)
+        rules = self._rules('ingest columnar\n' + RULES)
+        self.assertEqual(columnar.update(rules), 3)
+        rules = self._rules('ingest columnar\n' + RULES.replace(
+            'code {reference}', 'account2 expenses:cheques'))
+        self.assertEqual(columnar.update(rules), 2)
+        rows.update(self._rules(RULES.replace(
+            'code {reference}', 'account2 expenses:cheques')))
+        self.assertEqual([str(t) for t in columnar.transactions],
+                         [str(t) for t in rows.transactions])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,9 @@
+import os
 import unittest
 import re
 from io import StringIO
+from unittest import mock
+from tempfile import TemporaryDirectory
 
 
 test_rules_file_contents = """
@@ -18,6 +21,11 @@ ATM
 # Put cheque number in ()s
 if [0-9]{6}
   description ({description})
+
+if %amount ^-5$
+SALARY
+& %balance -
+  account2 income
 """
 
 
@@ -26,6 +34,11 @@ class RulesTest(unittest.TestCase):
         from csv_rules import Rules
         return Rules(rules_file)
 
+    def _add_filler_rules(self, rules):
+        # Enough rules that the literal prefilter is used
+        for i in range(100):
+            rules.add('FILLER{}'.format(i), account2='filler')
+
     def test_rules_are_matched_against_description(self):
         rules = self._make_rules()
         rules.add('PATTERN', account2='account')
@@ -48,6 +61,91 @@ class RulesTest(unittest.TestCase):
                          dict(account1='a1',
                               description='new'))
 
+    def test_first_matching_rule_wins(self):
+        rules = self._make_rules()
+        rules.add('SHOP', account2='first')
+        rules.add('[0-9]+', account2='second')
+        rules.add('TESCO SHOP', account2='third')
+        rules.add('(?i)tesco', account2='fourth')
+        self._add_filler_rules(rules)
+        self.assertEqual(rules.match('TESCO SHOP 123')['account2'], 'first')
+        self.assertEqual(rules.match('123 TESCO')['account2'], 'second')
+        self.assertEqual(rules.match('tesco')['account2'], 'fourth')
+        self.assertNotIn('account2', rules.match('SAINSBURY'))
+
+    def test_literal_prefilter_does_not_skip_rules(self):
+        rules = self._make_rules()
+        rules.add('^AB?C', account2='optional')
+        rules.add('Q|Z', account2='branch')
+        rules.add('CARD PAYMENT TO .* ON', account2='card')
+        self._add_filler_rules(rules)
+        self.assertEqual(rules.match('AC')['account2'], 'optional')
+        self.assertEqual(rules.match('Z')['account2'], 'branch')
+        self.assertEqual(rules.match('CARD PAYMENT TO SHOP ON 01')['account2'],
+                         'card')
+        self.assertNotIn('account2', rules.match('CARD PAYMENT TO SHOP'))
+
+    def test_rules_testing_other_fields(self):
+        rules = self._make_rules()
+        self._add_filler_rules(rules)
+        for i in range(100):
+            rules.add([('reference', '^REF{}$'.format(i))],
+                      account2='reference')
+            rules.add([('amount', '^-{}\\.00$'.format(i)),
+                       ('description', 'SHOP')], account2='amount')
+        rules.add([('reference', '[0-9]{4}')], account2='regex')
+        rules.add('SHOP', account2='shop')
+        self.assertEqual(rules.condition_fields, ('amount', 'reference'))
+
+        def match(description, **fields):
+            return rules.match(description, fields).get('account2')
+        self.assertEqual(match('SHOP', reference='REF7'), 'reference')
+        self.assertEqual(match('SHOP', reference='REF77 '), 'shop')
+        self.assertEqual(match('SHOP', amount='-7.00'), 'amount')
+        self.assertEqual(match('FILLER1', amount='-7.00'), 'filler')
+        self.assertEqual(match('PLACE', amount='-7.00'), None)
+        self.assertEqual(match('PLACE', reference='A1234'), 'regex')
+        self.assertEqual(match('SHOP'), 'shop')
+        # Results are cached by the values of the fields tested too
+        self.assertEqual(match('SHOP', amount='-7.00', other='x'), 'amount')
+        self.assertEqual(rules.cache_info().hits, 1)
+
+    def test_rules_added_after_matching_are_used(self):
+        rules = self._make_rules()
+        rules.add('PATTERN', account2='a2')
+        self.assertNotIn('account2', rules.match('OTHER'))
+        rules.add('OTHER', account2='other')
+        self.assertEqual(rules.match('OTHER')['account2'], 'other')
+
+    def test_match_results_are_cached(self):
+        rules = self._make_rules()
+        rules.add('PATTERN', account2='a2')
+        rules.match('PATTERN')
+        result = rules.match('PATTERN')
+        self.assertEqual(rules.cache_info().hits, 1)
+        self.assertEqual(rules.cache_info().misses, 1)
+        # Callers may modify the result without affecting the cache
+        result['account2'] = 'changed'
+        self.assertEqual(rules.match('PATTERN'), dict(account2='a2'))
+
+    def test_cache_is_cleared_when_rules_change(self):
+        rules = self._make_rules()
+        rules.add('PATTERN', account2='a2')
+        self.assertEqual(rules.match('OTHER'), {})
+        rules.add('OTHER', account2='other')
+        self.assertEqual(rules.match('OTHER'), dict(account2='other'))
+        rules.set_defaults(account1='a1')
+        self.assertEqual(rules.match('OTHER'),
+                         dict(account1='a1', account2='other'))
+
+    def test_cache_size_is_bounded(self):
+        from csv_rules import Rules
+        rules = Rules(cache_size=2)
+        for description in ['a', 'b', 'c', 'a']:
+            rules.match(description)
+        self.assertEqual(rules.cache_info().misses, 4)
+        self.assertEqual(rules.cache_info().currsize, 2)
+
     def test_loads_rules_from_file(self):
         rules_file = StringIO(test_rules_file_contents)
         rules = self._make_rules(rules_file)
@@ -63,4 +161,56 @@ class RulesTest(unittest.TestCase):
             (re.compile('LINK'), dict(account2='assets:cash')),
             (re.compile('ATM'), dict(account2='assets:cash')),
             (re.compile('[0-9]{6}'), dict(description='({description})')),
+            ((('amount', re.compile('^-5$')),), dict(account2='income')),
+            ((('description', re.compile('SALARY')),
+              ('balance', re.compile('-'))), dict(account2='income')),
         ])
+        self.assertEqual(rules.condition_fields, ('amount', 'balance'))
+
+
+class RulesCacheTest(unittest.TestCase):
+    def setUp(self):
+        self._dir = TemporaryDirectory()
+        self.cache_dir = os.path.join(self._dir.name, 'cache')
+        self.rules_file = os.path.join(self._dir.name, 'rules')
+        self._write(test_rules_file_contents)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _write(self, contents):
+        with open(self.rules_file, 'w') as f:
+            f.write(contents)
+
+    def _load(self):
+        from csv_rules import Rules
+        return Rules(self.rules_file, cache_dir=self.cache_dir)
+
+    def test_cached_rules_are_not_parsed_again(self):
+        first = self._load()
+        with mock.patch('csv_rules.load_rules') as load_rules:
+            second = self._load()
+        load_rules.assert_not_called()
+        self.assertEqual(second.options, first.options)
+        self.assertEqual(second.defaults, first.defaults)
+        self.assertEqual(second.rules, first.rules)
+
+    def test_changed_file_is_parsed_again(self):
+        self._load()
+        self._write(test_rules_file_contents + 'if NEW\n  account2 new\n')
+        rules = self._load()
+        self.assertEqual(rules.match('NEW')['account2'], 'new')
+
+    def test_file_saved_while_parsed(self):
+        import csv_rules
+        parse = csv_rules.load_rules
+        changed = test_rules_file_contents + 'if NEW\n  account2 new\n'
+
+        def parse_then_save(f):
+            result = parse(f)
+            self._write(changed)
+            return result
+        with mock.patch('csv_rules.load_rules', parse_then_save):
+            self._load()
+        # The first contents' parse is not taken for the second's
+        self.assertEqual(self._load().match('NEW')['account2'], 'new')
@@ -0,0 +1,138 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+FIRST = """2014-09-01 TESCO STORES
+    assets:bank  £-10.15
+    expenses:food
+
+"""
+
+LAST = """2014-09-01 TESCO STORES
+    assets:bank  £-1.00
+    expenses:food
+"""
+
+JOURNAL = FIRST + LAST
+
+APPENDED = """2014-09-02 OTHER
+    assets:bank  £2.50
+    income:misc
+
+"""
+
+
+class TestJournalIndex(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.ledger_file = os.path.join(tmp.name, 'ledger.journal')
+        self._write(JOURNAL)
+
+    def _write(self, contents, mode='w'):
+        with open(self.ledger_file, mode) as f:
+            f.write(contents)
+
+    def _index(self):
+        import journal_index
+        with mock.patch('journal_index.parse_lines',
+                        wraps=journal_index.parse_lines) as parse:
+            index = journal_index.JournalIndex(self.ledger_file)
+        parsed = ''.join(line for call in parse.call_args_list
+                         for line in call[0][0])
+        return index, parsed
+
+    def _find(self, index, date, amount):
+        return index.find_transaction(date, 'TESCO STORES' if amount < 0
+                                      else 'OTHER', 'assets:bank', amount,
+                                      '£')
+
+    def test_only_appended_bytes_are_parsed(self):
+        from journal_index import default_path
+        index, parsed = self._index()
+        self.assertEqual(parsed, JOURNAL)
+        self.assertTrue(os.path.exists(default_path(self.ledger_file)))
+        self._write(APPENDED, 'a')
+        index, parsed = self._index()
+        # The last transaction indexed is parsed again
+        self.assertEqual(parsed, LAST + APPENDED)
+        self.assertTrue(self._find(index, '2014-09-01', -10.15))
+        self.assertTrue(self._find(index, '2014-09-01', -1))
+        self.assertTrue(self._find(index, '2014-09-02', 2.50))
+        self.assertEqual(self._index()[1], APPENDED)
+
+    def test_update(self):
+        index, _ = self._index()
+        self._write(APPENDED, 'a')
+        index.update()
+        self.assertTrue(self._find(index, '2014-09-02', 2.50))
+        self.assertEqual(self._index()[1], APPENDED)
+
+    def test_edited_history_is_indexed_again(self):
+        self._index()
+        self._write(JOURNAL.replace('-10.15', '-10.16') + APPENDED)
+        index, parsed = self._index()
+        self.assertEqual(parsed, JOURNAL.replace('-10.15', '-10.16') +
+                         APPENDED)
+        self.assertFalse(self._find(index, '2014-09-01', -10.15))
+        self.assertTrue(self._find(index, '2014-09-01', -10.16))
+
+    def test_appended_posting_is_indexed_with_its_transaction(self):
+        self._write(JOURNAL.rstrip('\n'))
+        self._index()
+        self._write('\n    expenses:other  £0.15\n', 'a')
+        index, parsed = self._index()
+        self.assertEqual(parsed, LAST + '    expenses:other  £0.15\n')
+        self.assertTrue(index.find_transaction(
+            '2014-09-01', 'TESCO STORES', 'expenses:food', 0.85, '£'))
+
+    def test_last_transaction_removed(self):
+        index, _ = self._index()
+        self._write(FIRST)
+        index.update()
+        self.assertFalse(self._find(index, '2014-09-01', -1))
+        index, _ = self._index()
+        self.assertTrue(self._find(index, '2014-09-01', -10.15))
+        self.assertFalse(self._find(index, '2014-09-01', -1))
+
+    def test_last_transaction_edited(self):
+        index, _ = self._index()
+        self._write(JOURNAL.replace('-1.00', '-2.00'))
+        index.update()
+        self.assertFalse(self._find(index, '2014-09-01', -1))
+        self.assertTrue(self._find(index, '2014-09-01', -2))
+        self.assertFalse(self._find(self._index()[0], '2014-09-01', -1))
+
+    def test_sent_to_workers_as_plain_index(self):
+        import pickle
+        from ledger_index import LedgerIndex
+        copy = pickle.loads(pickle.dumps(self._index()[0]))
+        self.assertIs(type(copy), LedgerIndex)
+        self.assertTrue(self._find(copy, '2014-09-01', -1))
+
+    def test_merger_updates_index_when_appending(self):
+        from io import StringIO
+        from contextlib import redirect_stdout
+        from ledger_csv_merge import Merger
+        rules_file = os.path.join(self.dir, 'rules')
+        csv_file = os.path.join(self.dir, 'a.csv')
+        with open(rules_file, 'w') as f:
+            f.write('skip 1\nfields date, description, amount\n'
+                    'currency £\naccount1 assets:bank\n'
+                    'account2 income:misc\n')
+        with open(csv_file, 'w') as f:
+            f.write('Date,Description,Amount\n2014-09-02,OTHER,2.50\n')
+        merger = Merger(self.ledger_file, rules_file, True, [csv_file],
+                        cache_dir=os.path.join(self.dir, 'cache'))
+        with redirect_stdout(StringIO()):
+            merger.main()
+        del merger
+        index, parsed = self._index()
+        self.assertTrue(parsed.startswith('2014-09-02 OTHER'))
+        self.assertTrue(self._find(index, '2014-09-02', 2.50))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+
+def transaction(date, description):
+    return '{} {}\n    assets:bank  £1\n    income\n'.format(date,
+                                                            description)
+
+
+class TestLoadJournal(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.cache_dir = os.path.join(tmp.name, 'cache')
+        os.mkdir(os.path.join(self.dir, 'years'))
+        self._write('main.journal',
+                    transaction('2013-12-31', 'opening') +
+                    'include years/*.journal\n' +
+                    transaction('2020-01-01', 'after') +
+                    '!include accounts.journal\n')
+        self._write('years/2014.journal', transaction('2014-09-01', 'one'))
+        self._write('years/2015.journal', transaction('2015-09-01', 'two') +
+                    'include ../nested.journal\n')
+        self._write('nested.journal', transaction('2015-10-01', 'nested'))
+        self._write('accounts.journal', transaction('2021-01-01', 'last'))
+
+    def _write(self, name, contents):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w') as f:
+            f.write(contents)
+        return path
+
+    def _load(self, **kwargs):
+        from journal_tree import load_journal
+        return [t['description'] for t in load_journal(
+            os.path.join(self.dir, 'main.journal'), **kwargs)]
+
+    def test_document_order(self):
+        expected = ['opening', 'one', 'two', 'nested', 'after', 'last']
+        self.assertEqual(self._load(), expected)
+        self.assertEqual(self._load(jobs=2), expected)
+
+    def test_unchanged_files_are_not_parsed_again(self):
+        import journal_tree
+        self._load(cache_dir=self.cache_dir)
+        st = os.stat(os.path.join(self.dir, 'years/2015.journal'))
+        self._write('years/2015.journal', transaction('2015-09-01', 'new'))
+        os.utime(os.path.join(self.dir, 'years/2015.journal'),
+                 ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        with mock.patch('journal_tree.parse_journal_file',
+                        wraps=journal_tree.parse_journal_file) as parse:
+            self.assertEqual(self._load(cache_dir=self.cache_dir),
+                             ['opening', 'one', 'new', 'after', 'last'])
+        parse.assert_called_once_with(
+            os.path.join(self.dir, 'years', '2015.journal'))
+
+    def test_include_cycle(self):
+        from _ledger_parser import LedgerSyntaxError
+        self._write('nested.journal', 'include main.journal\n')
+        with self.assertRaises(LedgerSyntaxError):
+            self._load()
+
+    def test_load_ledger_and_index(self):
+        from _ledger_parser import load_ledger
+        from ledger_index import LedgerIndex
+        path = os.path.join(self.dir, 'main.journal')
+        self.assertEqual(len(load_ledger(path)), 6)
+        index = LedgerIndex(path, '2015-01-01', '2015-12-31')
+        self.assertEqual(len(index), 4)
+        self.assertTrue(index.find_transaction('2015-10-01', 'nested',
+                                               'assets:bank', 1, '£'))
+
+
+if __name__ == '__main__':
+    unittest.main()
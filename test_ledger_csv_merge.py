@@ -0,0 +1,236 @@
+import os
+import re
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+RULES = """
+skip 1
+fields date, description, amount
+currency £
+account1 assets:bank
+account2 expenses:unknown
+
+if TESCO
+  account2 expenses:food
+"""
+
+JOURNAL = """2014-09-01 TESCO STORES
+    assets:bank  £-10.15
+    expenses:food
+"""
+
+CSV = """Date,Description,Amount
+2014-09-01,TESCO STORES,-10.15
+2014-09-02,TESCO STORES,-5
+2014-09-03,OTHER,2.50
+"""
+
+
+class TestStreaming(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.files = {}
+        for name, contents in [('rules', RULES), ('a.csv', CSV),
+                               ('ledger.journal', JOURNAL)]:
+            self.files[name] = os.path.join(tmp.name, name)
+            with open(self.files[name], 'w') as f:
+                f.write(contents)
+
+    def _main(self, stream, yes_append=True):
+        from ledger_csv_merge import Merger
+        merger = Merger(self.files['ledger.journal'], self.files['rules'],
+                        yes_append, [self.files['a.csv']], stream=stream)
+        output = StringIO()
+        with redirect_stdout(output):
+            merger.main()
+        del merger
+        with open(self.files['ledger.journal']) as f:
+            journal = f.read()
+        with open(self.files['ledger.journal'], 'w') as f:
+            f.write(JOURNAL)
+        # Leave out the time of the import
+        return re.sub(r'; \[.*\]', '', journal), output.getvalue()
+
+    def test_appends_as_default_mode_does(self):
+        journal, output = self._main(stream=True)
+        self.assertEqual(journal, self._main(stream=False)[0])
+        self.assertIn('2014-09-03 OTHER', journal)
+        self.assertNotIn('2014-09-03 OTHER', output)
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['a.csv', 'ledger.journal', 'rules'])
+
+    def test_declined(self):
+        with mock.patch('click.confirm', return_value=False):
+            journal, output = self._main(stream=True, yes_append=False)
+        self.assertIn('1 transactions with unknown account', output)
+        self.assertEqual(journal, JOURNAL)
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['a.csv', 'ledger.journal', 'rules'])
+
+
+class TestReload(unittest.TestCase):
+    def test_match_cache_counts_cover_every_reload(self):
+        import profiling
+        from ledger_csv_merge import Merger
+        with TemporaryDirectory() as tmp:
+            files = {}
+            for name, contents in [('rules', RULES), ('a.csv', CSV)]:
+                files[name] = os.path.join(tmp, name)
+                with open(files[name], 'w') as f:
+                    f.write(contents)
+            merger = Merger(None, files['rules'], False, [files['a.csv']])
+            profile = profiling.start()
+            try:
+                with redirect_stdout(StringIO()):
+                    merger.reload()
+                    with open(files['rules'], 'w') as f:
+                        f.write(RULES.replace('food', 'groceries'))
+                    merger.reload()
+                merger.record_profile()
+            finally:
+                profiling.stop()
+        # Two descriptions matched in each of the two reloads
+        self.assertEqual(profile.counters['rules match cache hits'] +
+                         profile.counters['rules match cache misses'], 4)
+
+
+class TestJournalSyntax(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.files = {}
+        for name, contents in [('rules', RULES), ('a.csv', CSV)]:
+            self.files[name] = os.path.join(tmp.name, name)
+            with open(self.files[name], 'w') as f:
+                f.write(contents)
+        self.ledger_file = os.path.join(tmp.name, 'ledger.journal')
+
+    def _run(self, journal):
+        from click.testing import CliRunner
+        from ledger_csv_merge import main
+        with open(self.ledger_file, 'w') as f:
+            f.write(journal)
+        result = CliRunner().invoke(main, [
+            '-f', self.ledger_file, '-r', self.files['rules'], '-y',
+            '--no-cache', self.files['a.csv']])
+        with open(self.ledger_file) as f:
+            return result, f.read()
+
+    def test_hledger_journal_is_deduplicated_against(self):
+        journal = ('account assets:bank\nP 2014/09/01 EUR £0.80\n\n' +
+                   JOURNAL.replace('2014-09-01', '2014/09/01'))
+        result, appended = self._run(journal)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(appended.count('TESCO STORES'), 2)
+        self.assertIn('2014-09-03 OTHER', appended)
+
+    def test_balance_check_reads_hledger_journal(self):
+        with open(self.files['rules'], 'w') as f:
+            f.write(RULES.replace('amount', 'amount, balance'))
+        with open(self.files['a.csv'], 'w') as f:
+            f.write('Date,Description,Amount,Balance\n'
+                    '2014-09-02,OTHER,250.00,339.85\n')
+        journal = 'account assets:bank\n' + JOURNAL.replace(
+            '£-10.15', '£-10.15 = £89.85')
+        result, appended = self._run(journal)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertNotIn('Balance assertion would fail', result.output)
+        self.assertIn('2014-09-02 OTHER', appended)
+
+    def test_unreadable_journal_stops_the_import(self):
+        journal = JOURNAL + '2014-09-02 No postings\n'
+        result, appended = self._run(journal)
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('Expected posting', result.output)
+        self.assertEqual(appended, journal)
+
+
+class TestParallel(unittest.TestCase):
+    def _statement(self, name, account, days):
+        rows = ''.join('2014-09-{:02},{} {},-{}\n'.format(day, name, day, day)
+                       for day in days)
+        journal = ''.join('2014-09-{:02} {} {}\n    {}  £-{}.00\n'
+                          '    expenses:unknown\n\n'.format(
+                              day, name, day, account, day)
+                          for day in days)
+        return rows, journal
+
+    def test_same_output_as_serial(self):
+        from ledger_csv_merge import Merger
+        with TemporaryDirectory() as tmp:
+            rules_file = os.path.join(tmp, 'rules')
+            with open(rules_file, 'w') as f:
+                f.write(RULES + '\nif CARD\n  account1 liabilities:card\n')
+            csv_files = []
+            journal = ''
+            # One statement per account for the same days, appended one
+            # after the other as this tool does
+            for name, account in [('CARD', 'liabilities:card'),
+                                  ('BANK', 'assets:bank')]:
+                rows, _ = self._statement(name, account, range(1, 9))
+                # Days 6 to 8 are new; others are in the journal,
+                # including some after the statements
+                journal += self._statement(
+                    name, account, [1, 2, 3, 4, 5, 10, 11, 12])[1]
+                csv_files.append(os.path.join(tmp, name + '.csv'))
+                with open(csv_files[-1], 'w') as f:
+                    f.write('Date,Description,Amount\n' + rows)
+            ledger_file = os.path.join(tmp, 'ledger.journal')
+            results = []
+            for jobs in [1, 2]:
+                with open(ledger_file, 'w') as f:
+                    f.write(journal)
+                output = StringIO()
+                merger = Merger(ledger_file, rules_file, True, csv_files,
+                                jobs=jobs)
+                with redirect_stdout(output):
+                    merger.main()
+                del merger
+                with open(ledger_file) as f:
+                    appended = f.read()[len(journal):]
+                # Leave out the time of the import
+                results.append([re.sub(r'; \[.*\]', '', text)
+                                for text in (output.getvalue(), appended)])
+        self.assertEqual(results[0], results[1])
+        appended = results[0][1]
+        self.assertEqual(re.findall(r'\d{4}-\d\d-\d\d (\w+ \d)', appended),
+                         ['CARD 6', 'CARD 7', 'CARD 8',
+                          'BANK 6', 'BANK 7', 'BANK 8'])
+
+
+class TestSplit(unittest.TestCase):
+    def test_same_as_whole_files(self):
+        from csv_importer import open_ledger
+        from ledger_csv_merge import Merger
+        with TemporaryDirectory() as tmp:
+            files = []
+            for name, contents in [('rules', RULES), ('a.csv', CSV),
+                                   ('b.csv', CSV.replace('2014', '2015')),
+                                   ('ledger.journal', JOURNAL)]:
+                files.append(os.path.join(tmp, name))
+                with open(files[-1], 'w') as f:
+                    f.write(contents)
+            rules_file, a, b, ledger_file = files
+            imported = []
+            for jobs, split in [(1, False), (3, True)]:
+                merger = Merger(ledger_file, rules_file, False, [a, b],
+                                jobs=jobs, split=split)
+                with redirect_stdout(StringIO()), mock.patch(
+                        'ledger_csv_merge.open_ledger',
+                        wraps=open_ledger) as opened:
+                    merger.reload()
+                imported.append([(f, [str(t) for t in ts])
+                                 for f, ts in merger.transactions])
+            # Indexed once for all the chunks
+            opened.assert_called_once()
+        self.assertEqual(imported[0], imported[1])
+        self.assertEqual([len(ts) for _, ts in imported[0]], [2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
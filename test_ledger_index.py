@@ -0,0 +1,134 @@
+import unittest
+from io import StringIO
+
+SAMPLE_LEDGER = """
+; Converted from statement.csv
+2014-09-01 Description with multiple words
+    assets:bank account  £-10.15
+    expenses:misc
+
+2014-09-02 * (123456) Cheque  ; paid in
+    assets:bank account  £250.00 = £239.85
+    income:misc  £-250.00
+"""
+
+
+class TestLedgerIndex(unittest.TestCase):
+    def _make_index(self, contents):
+        from ledger_index import LedgerIndex
+        return LedgerIndex(StringIO(contents))
+
+    def test_find_works(self):
+        index = self._make_index(SAMPLE_LEDGER)
+        self.assertTrue(
+            index.find_transaction(date='2014-09-01',
+                                   desc='Description with multiple words',
+                                   acct='assets:bank account',
+                                   amt=-10.15,
+                                   cur='£'))
+        self.assertTrue(
+            index.find_transaction(date='2014-09-02',
+                                   desc='Cheque',
+                                   acct='assets:bank account',
+                                   amt=250.0,
+                                   cur='£'))
+
+    def test_find_all_fields_must_match(self):
+        index = self._make_index(SAMPLE_LEDGER)
+        query = dict(date='2014-09-01',
+                     desc='Description with multiple words',
+                     acct='assets:bank account',
+                     amt=-10.15,
+                     cur='£')
+        for k, v in [('date', '2014-09-02'),
+                     ('desc', 'Description'),
+                     ('acct', 'wrong account'),
+                     ('amt', 10.15),
+                     ('cur', '$')]:
+            self.assertFalse(index.find_transaction(**dict(query, **{k: v})))
+
+    def test_date_window_of_journal_out_of_order(self):
+        import os
+        from tempfile import TemporaryDirectory
+        from ledger_index import LedgerIndex
+        card = SAMPLE_LEDGER.replace('assets:bank account',
+                                     'liabilities:card')
+        with TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'ledger.journal')
+            with open(path, 'w') as f:
+                f.write(card + SAMPLE_LEDGER)
+            index = LedgerIndex(path, '2014-09-01', '2014-09-01')
+        # expenses:misc's posting is the same in both
+        self.assertEqual(len(index), 3)
+        self.assertTrue(
+            index.find_transaction(date='2014-09-01',
+                                   desc='Description with multiple words',
+                                   acct='assets:bank account',
+                                   amt=-10.15,
+                                   cur='£'))
+
+    def test_elided_amount_is_inferred(self):
+        index = self._make_index(SAMPLE_LEDGER)
+        self.assertTrue(
+            index.find_transaction(date='2014-09-01',
+                                   desc='Description with multiple words',
+                                   acct='expenses:misc',
+                                   amt=10.15,
+                                   cur='£'))
+
+    def test_description_whitespace_and_case_are_ignored(self):
+        index = self._make_index(SAMPLE_LEDGER)
+        self.assertTrue(
+            index.find_transaction(date='2014/09/01',
+                                   desc='DESCRIPTION  with multiple words',
+                                   acct='assets:bank account',
+                                   amt=-10.15,
+                                   cur='£'))
+
+
+class TestFindSimilar(unittest.TestCase):
+    def setUp(self):
+        from ledger_index import LedgerIndex, FuzzyMatch
+        self.index = LedgerIndex(StringIO(SAMPLE_LEDGER))
+        self.fuzzy = FuzzyMatch(days=2, similarity=0.8)
+        self.query = dict(date='2014-09-01',
+                          desc='Description with multiple words',
+                          acct='assets:bank account',
+                          amt=-10.15,
+                          cur='£')
+
+    def find(self, **changes):
+        return self.index.find_similar(fuzzy=self.fuzzy,
+                                       **dict(self.query, **changes))
+
+    def test_exact_match(self):
+        self.assertTrue(self.find())
+
+    def test_date_window(self):
+        self.assertTrue(self.find(date='2014-08-30'))
+        self.assertTrue(self.find(date='2014/09/03'))
+        self.assertFalse(self.find(date='2014-09-04'))
+        self.assertFalse(self.find(date='01/09/2014'))
+
+    def test_similar_description(self):
+        self.assertTrue(self.find(date='2014-09-02',
+                                  desc='Description with many words'))
+        self.assertFalse(self.find(date='2014-09-02', desc='Description'))
+
+    def test_account_and_amount_must_match(self):
+        for k, v in [('acct', 'wrong account'),
+                     ('amt', -10.16),
+                     ('cur', '$')]:
+            self.assertFalse(self.find(date='2014-09-02', **{k: v}))
+
+    def test_added_transactions_are_found(self):
+        from _ledger_parser import load_ledger
+        self.assertFalse(self.find(date='2014-10-01'))
+        for t in load_ledger(StringIO(
+                SAMPLE_LEDGER.replace('2014-09-01', '2014-09-30'))):
+            self.index.add(t)
+        self.assertTrue(self.find(date='2014-10-01'))
+
+
+if __name__ == '__main__':
+    unittest.main()
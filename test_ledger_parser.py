@@ -0,0 +1,242 @@
+import os
+import unittest
+from io import StringIO
+from contextlib import redirect_stdout
+from tempfile import NamedTemporaryFile
+from unittest import mock
+
+# Journals that the pyparsing grammar accepts; both parsers must give
+# identical results for each.
+CORPUS = [
+    "",
+    "\n\n",
+    """
+2014-09-01 Description with multiple words
+    assets:bank account  £-10.15
+    expenses:misc
+""",
+    """
+2014-09-01 Description with multiple words
+    assets:bank account  £-10.15
+    expenses:misc  £1.25
+    expenses:other
+""",
+    """; Converted from statement.csv
+; [2014-09-30 12:00:00]
+
+2014-09-02 * (123456) Cheque  ; paid in
+    assets:bank account  £250.00 = £239.85
+    income:misc  £-250.00  ; note
+# a comment
+2014-09-03 ! Pending
+\tassets:bank\t$ 1,000.00
+\texpenses:misc
+2014-09-04 () Empty code;comment
+    assets:bank  GBP-3
+    expenses:misc  GBP3
+""",
+    """2014-09-05*(7)No spaces
+    assets:bank  £1.00
+    expenses:misc  £-1.00""",
+    """2014-09-06 #hash description
+    a:b c  £1
+    d  10 GBP
+    e""",
+    "2014-09-01 Blank line in postings\n    a  £1\n\n    b\n",
+    """2014-09-07 Assertions
+    a  = £5
+    b  £1 =£6
+    c  £2 == £3
+    d = £1
+    e  £-3=$ 4  ; note
+""",
+]
+
+INVALID = [
+    "2014-13 not a transaction\n",
+    "2014-09-01 No postings\n\n2014-09-02 x\n    a  £1\n",
+    "    a  £1\n",
+]
+
+
+class TestLedgerParser(unittest.TestCase):
+    def _load(self, contents, implementation):
+        from _ledger_parser import load_ledger
+        with redirect_stdout(StringIO()):
+            return load_ledger(StringIO(contents), implementation)
+
+    def test_parsers_agree(self):
+        for contents in CORPUS:
+            with self.subTest(contents=contents):
+                self.assertEqual(self._load(contents, 'lines'),
+                                 self._load(contents, 'pyparsing'))
+
+    def test_parsers_agree_on_errors(self):
+        from _ledger_parser import LedgerSyntaxError
+        for contents in INVALID:
+            for implementation in ['lines', 'pyparsing']:
+                with self.subTest(contents=contents,
+                                  implementation=implementation):
+                    with self.assertRaises(LedgerSyntaxError):
+                        self._load(contents, implementation)
+
+    def test_parses_transactions(self):
+        from _ledger_parser import CurrencyAmount
+        transactions = self._load(CORPUS[4], 'lines')
+        self.assertEqual(len(transactions), 3)
+        self.assertEqual(transactions[0], {
+            'date': '2014-09-02',
+            'status': '*',
+            'code': '123456',
+            'description': 'Cheque',
+            'postings': [
+                {'account': 'assets:bank account',
+                 'amount': CurrencyAmount('£', '250.00'),
+                 'assertion': CurrencyAmount('£', '239.85')},
+                {'account': 'income:misc',
+                 'amount': CurrencyAmount('£', '-250.00'),
+                 'assertion': None},
+            ]})
+        self.assertEqual(transactions[1]['postings'][0]['amount'],
+                         CurrencyAmount('$', '1,000.00'))
+
+    def test_balance_assertions(self):
+        from _ledger_parser import CurrencyAmount
+        postings = self._load(CORPUS[-1], 'lines')[0]['postings']
+        self.assertEqual([(p['account'], p['amount'], p['assertion'])
+                          for p in postings], [
+            ('a', None, CurrencyAmount('£', '5')),
+            ('b', CurrencyAmount('£', '1'), CurrencyAmount('£', '6')),
+            ('c', CurrencyAmount('£', '2'), None),
+            ('d = £1', None, None),
+            ('e', CurrencyAmount('£', '-3'), CurrencyAmount('$', '4')),
+        ])
+
+    def test_comments_between_postings(self):
+        transactions = self._load("""
+2014-09-01 Description
+    ; transaction comment
+    assets:bank  £-10.15
+    # another
+    expenses:misc
+""", 'lines')
+        self.assertEqual([p['account'] for p in transactions[0]['postings']],
+                         ['assets:bank', 'expenses:misc'])
+
+    def test_hledger_journal(self):
+        transactions = self._load("""account assets:bank
+    ; type: A
+commodity £1,000.00
+P 2014/09/01 EUR £0.80
+alias checking = assets:bank
+
+~ monthly
+    expenses:rent  £500
+    assets:bank
+
+comment
+2014-01-01 Commented out
+end comment
+2014/09/01 TESCO STORES
+    assets:bank  £-10.15
+    expenses:food
+2014.9.2=2014.9.3 * Other
+    assets:bank  £-1
+    expenses:misc
+""", 'lines')
+        self.assertEqual([(t['date'], t['description'], len(t['postings']))
+                          for t in transactions],
+                         [('2014-09-01', 'TESCO STORES', 2),
+                          ('2014-09-02', 'Other', 2)])
+
+
+class TestIterLedger(unittest.TestCase):
+    def setUp(self):
+        lines = ['; Header comment\n']
+        for day in range(1, 29):
+            for n in range(day % 3):
+                lines.append('2014-09-{:02d} Payee {}\n'
+                             '    assets:bank  £-1.00\n'
+                             '    expenses:misc\n\n'.format(day, n))
+        with NamedTemporaryFile('w', suffix='.journal', delete=False) as f:
+            f.write(''.join(lines))
+        self.filename = f.name
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def test_reads_whole_file(self):
+        from _ledger_parser import iter_ledger, load_ledger
+        self.assertEqual(list(iter_ledger(self.filename)),
+                         load_ledger(self.filename))
+
+    def test_reads_date_range(self):
+        from _ledger_parser import iter_ledger, load_ledger
+        transactions = load_ledger(self.filename)
+        for start, end in [('2014-09-01', '2014-09-01'),
+                           ('2014-09-03', '2014-09-04'),
+                           ('2014-09-05', '2014-09-20'),
+                           ('2014-08-01', '2014-09-02'),
+                           ('2014-09-27', '2014-10-01'),
+                           ('2014-10-01', '2014-10-31')]:
+            with self.subTest(start=start, end=end):
+                self.assertEqual(
+                    list(iter_ledger(self.filename, start, end)),
+                    [t for t in transactions if start <= t['date'] <= end])
+
+    def test_reads_date_range_out_of_order(self):
+        from _ledger_parser import iter_ledger, load_ledger
+        # Two statements for the same month, appended one after the other
+        with open(self.filename) as f:
+            card = f.read().replace('assets:bank', 'liabilities:card')
+        with open(self.filename, 'a') as f:
+            f.write('P 2014/09/02 EUR £0.80\n' + card)
+        transactions = load_ledger(self.filename)
+        for start, end in [('2014-09-01', '2014-09-05'),
+                           ('2014-09-27', '2014-10-01')]:
+            with self.subTest(start=start, end=end):
+                self.assertEqual(
+                    list(iter_ledger(self.filename, start, end)),
+                    [t for t in transactions if start <= t['date'] <= end])
+
+    def test_date_order_checked_once_until_changed(self):
+        import _ledger_parser
+        from _ledger_parser import iter_ledger, load_ledger
+        window = '2014-09-01', '2014-09-05'
+        with mock.patch('_ledger_parser._in_date_order',
+                        wraps=_ledger_parser._in_date_order) as check:
+            for _ in range(3):
+                list(iter_ledger(self.filename, *window))
+            self.assertEqual(check.call_count, 1)
+            with open(self.filename, 'a') as f:
+                f.write('2014-09-02 Late\n    assets:bank  £-1.00\n'
+                        '    expenses:misc\n')
+            self.assertEqual(
+                list(iter_ledger(self.filename, *window)),
+                [t for t in load_ledger(self.filename)
+                 if window[0] <= t['date'] <= window[1]])
+            self.assertEqual(check.call_count, 2)
+
+    def test_empty_file(self):
+        from _ledger_parser import iter_ledger
+        with NamedTemporaryFile() as f:
+            self.assertEqual(list(iter_ledger(f.name, '2014-09-01')), [])
+
+
+class TestImports(unittest.TestCase):
+    def test_grammar_is_only_imported_when_used(self):
+        import subprocess
+        import sys
+        code = ('import sys, io, ledger_csv_merge, _ledger_parser\n'
+                '_ledger_parser.load_ledger(io.StringIO({!r}))\n'
+                'print(sorted(m for m in ("pyparsing", "watchdog", '
+                '"asyncio") if m in sys.modules))'.format(CORPUS[0]))
+        result = subprocess.run([sys.executable, '-c', code],
+                                cwd=os.path.dirname(os.path.abspath(
+                                    __file__)),
+                                stdout=subprocess.PIPE, check=True)
+        self.assertEqual(result.stdout.strip(), b'[]')
+
+
+if __name__ == '__main__':
+    unittest.main()
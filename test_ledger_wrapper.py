@@ -1,5 +1,10 @@
+import asyncio
+import os
+import sys
+import tempfile
 from contextlib import contextmanager
 import unittest
+from unittest import mock
 from tempfile import NamedTemporaryFile
 
 SAMPLE_TRANSACTION = """
@@ -74,6 +79,116 @@ class TestLedger(unittest.TestCase):
                                    desc="Description",
                                    amt=10.15))
 
+    def test_find_transactions_matches_each_query(self):
+        with self._temp_ledger_file(SAMPLE_TRANSACTION_SPLIT) as l:
+            found, wrong_sign, wrong_date = l.find_transactions([
+                dict(date='2014-09-01', acct='assets:bank account',
+                     desc='Description', amt=-10.15, cur='£'),
+                dict(date='2014-09-01', acct='assets:bank account',
+                     desc='Description', amt=10.15, cur='£'),
+                dict(date='2014-09-02', acct='assets:bank account',
+                     desc='Description', amt=-10.15, cur='£'),
+            ])
+            self.assertIsNotNone(found)
+            self.assertIsNone(wrong_sign)
+            self.assertIsNone(wrong_date)
+
+    def test_find_transactions_runs_hledger_once(self):
+        l = self._make_ledger()
+        output = (
+            '"txnidx","date","code","description","account","amount","total"\n'
+            '"1","2014-09-01","","Description with multiple words",'
+            '"assets:bank account","£-10.15","£-10.15"\n'
+            '"1","2014-09-01","","Description with multiple words",'
+            '"expenses:misc","£1.25","£-8.90"\n'
+            '"2","2014-09-03","","Other","assets:bank account",'
+            '"£-1,000.00","£-1,008.90"\n')
+        with mock.patch.object(l, '_run_ledger',
+                               return_value=output) as run_ledger:
+            results = l.find_transactions([
+                dict(date='2014-09-01', acct='assets:bank',
+                     desc='Description', amt=-10.15, cur='£'),
+                dict(date='2014-09-01', acct='expenses:misc',
+                     desc='Description', amt=-1.25, cur='£'),
+                dict(date='2014-09-03', acct='assets:bank',
+                     desc='other', amt=-1000.0, cur='£'),
+            ])
+        run_ledger.assert_called_once_with(
+            ['reg', '-O', 'csv', 'date:2014-09-01..2014-09-04',
+             'acct:assets:bank', 'acct:expenses:misc'])
+        self.assertEqual([r is not None for r in results],
+                         [True, False, True])
+
+
+class TestLedgerAsync(unittest.TestCase):
+    REPORT = (
+        '"txnidx","date","code","description","account","amount","total"\n'
+        '"1","2014-09-01","","Description with multiple words",'
+        '"assets:bank account","£-10.15","£-10.15"\n')
+
+    @contextmanager
+    def _fake_hledger(self, script):
+        # An "hledger" on PATH that runs `script`
+        with tempfile.TemporaryDirectory() as bin_dir:
+            path = os.path.join(bin_dir, 'hledger')
+            with open(path, 'w') as f:
+                f.write('#!{}\n{}'.format(sys.executable, script))
+            os.chmod(path, 0o755)
+            with mock.patch.dict(os.environ, PATH=bin_dir + os.pathsep +
+                                 os.environ['PATH']):
+                yield
+
+    def test_find_transactions_async(self):
+        from ledger_wrapper import Ledger
+        script = 'import sys\nprint({!r}, end="")\n'.format(self.REPORT)
+        with self._fake_hledger(script):
+            results = asyncio.run(Ledger('x.journal').find_transactions_async([
+                dict(date='2014-09-01', acct='assets:bank',
+                     desc='Description', amt=-10.15, cur='£'),
+                dict(date='2014-09-01', acct='assets:bank',
+                     desc='Description', amt=10.15, cur='£'),
+            ]))
+        self.assertEqual([r is not None for r in results], [True, False])
+
+    def test_unbatched_queries_are_bounded(self):
+        from csv_importer import Transaction, deduplicate_async
+        from ledger_wrapper import Ledger
+        running = []
+
+        class Process:
+            returncode = 0
+
+            async def communicate(self):
+                await asyncio.sleep(0.01)
+                running.pop()
+                return b'', None
+
+        async def create_subprocess_exec(*args, **kwargs):
+            running.append(args)
+            self.most_running = max(self.most_running, len(running))
+            return Process()
+
+        self.most_running = 0
+        # Dates that cannot be batched into one register report
+        transactions = [Transaction('01/09/2014', 'a', 'b', str(i), '£')
+                        for i in range(20)]
+
+        async def run():
+            return [t async for t in deduplicate_async(
+                transactions, Ledger(), chunk_size=5,
+                limit=asyncio.Semaphore(2))]
+        with mock.patch('asyncio.create_subprocess_exec',
+                        create_subprocess_exec):
+            self.assertEqual(asyncio.run(run()), transactions)
+        self.assertEqual(self.most_running, 2)
+
+    def test_error(self):
+        from ledger_wrapper import Ledger, LedgerError
+        with self._fake_hledger('import sys\nsys.exit(1)\n'), \
+                self.assertLogs(level='ERROR'):
+            with self.assertRaises(LedgerError):
+                asyncio.run(Ledger()._run_ledger_async(['reg']))
+
 
 if __name__ == '__main__':
     unittest.main()
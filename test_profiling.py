@@ -0,0 +1,70 @@
+import unittest
+
+
+class TestProfiling(unittest.TestCase):
+    def tearDown(self):
+        import profiling
+        profiling.stop()
+
+    def test_hooks_do_nothing_when_disabled(self):
+        import profiling
+        items = [1, 2, 3]
+        self.assertIs(profiling.timed('stage', items), items)
+        self.assertIs(profiling.timed_call('stage', len), len)
+        with profiling.stage('stage'):
+            profiling.count('counter')
+        self.assertIsNone(profiling.current)
+
+    def test_records_stages_and_counters(self):
+        import profiling
+        profile = profiling.start()
+        with profiling.stage('outer'):
+            with profiling.stage('inner'):
+                pass
+        self.assertEqual(list(profiling.timed('items', [1, 2])), [1, 2])
+        self.assertEqual(profiling.timed_call('call', len)([1]), 1)
+        profiling.count('counter', 2)
+        profiling.count('counter')
+        self.assertIs(profiling.stop(), profile)
+
+        stages = profile.as_dict()['stages']
+        self.assertEqual(stages['outer']['calls'], 1)
+        self.assertEqual(stages['inner']['calls'], 1)
+        # One call per item, plus the one that finds the end
+        self.assertEqual(stages['items']['calls'], 3)
+        self.assertEqual(stages['call']['calls'], 1)
+        self.assertEqual(profile.counters, {'counter': 3})
+
+    def test_nested_time_is_not_counted_twice(self):
+        import time
+        import profiling
+        profile = profiling.start()
+        with profiling.stage('outer'):
+            with profiling.stage('inner'):
+                time.sleep(0.05)
+        profiling.stop()
+        self.assertGreaterEqual(profile.stages['inner'][1], 0.05)
+        self.assertLess(profile.stages['outer'][1], 0.05)
+
+    def test_rule_hits_are_recorded(self):
+        import profiling
+        from csv_rules import Rules
+        from csv_importer import RowPlan
+        rules = Rules()
+        rules.options['fields'] = ['date', 'description', 'amount']
+        rules.set_defaults(account1='a1', account2='a2', currency='£')
+        rules.add('FIRST', account2='first')
+        rules.add('SECOND', account2='second')
+        plan = RowPlan(rules)
+        profile = profiling.start()
+        for desc in ['SECOND', 'SECOND', 'FIRST', 'NEITHER']:
+            plan.transaction(['2014-09-01', desc, '1.00'])
+        profiling.stop()
+        self.assertEqual({i: hits for i, (hits, _) in profile.rules.items()},
+                         {0: 1, 1: 2, None: 1})
+        self.assertEqual(set(profile.as_dict()['rules'][0]),
+                         {'rule', 'hits', 'match_seconds_uncached'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,108 @@
+import os
+import unittest
+from io import StringIO
+from tempfile import TemporaryDirectory, NamedTemporaryFile
+
+RULES = """
+fields date, description, amount
+currency £
+account1 assets:bank
+account2 expenses:unknown
+"""
+
+ROWS = [['2014-09-01', 'COFFEE', '-2'],
+        ['2014-09-01', 'COFFEE', '-2'],
+        ['2014-09-02', 'TESCO', '-10']]
+
+
+class TestRowFingerprints(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'rows.sqlite')
+
+    def _store(self, ledger_file=None):
+        from row_fingerprints import RowFingerprints
+        store = RowFingerprints(self.path, ledger_file)
+        self.addCleanup(store.close)
+        return store
+
+    def _rules(self, contents=RULES):
+        from csv_rules import Rules
+        return Rules(StringIO(contents))
+
+    def test_recorded_rows_are_dropped(self):
+        store = self._store()
+        self.assertEqual(list(store.filter('a.csv', self._rules(),
+                                           ROWS[:1])), ROWS[:1])
+        with store.recording():
+            pass
+        self.assertEqual(list(store.filter('b.csv', self._rules(), ROWS)),
+                         ROWS[1:])
+        with store.recording():
+            pass
+        # In a later run
+        self.assertEqual(list(self._store().filter('c.csv', self._rules(),
+                                                   ROWS + ROWS[:1])),
+                         ROWS[:1])
+
+    def test_keyed_by_source_account(self):
+        store = self._store()
+        list(store.filter('a.csv', self._rules(), ROWS))
+        with store.recording():
+            pass
+        rules = self._rules(RULES.replace('assets:bank', 'assets:card'))
+        self.assertEqual(list(store.filter('a.csv', rules, ROWS)), ROWS)
+
+    def test_not_recorded_if_append_fails(self):
+        store = self._store()
+        list(store.filter('a.csv', self._rules(), ROWS))
+        with self.assertRaises(OSError):
+            with store.recording():
+                raise OSError
+        self.assertEqual(list(self._store().filter('a.csv', self._rules(),
+                                                   ROWS)), ROWS)
+        self.assertEqual(list(store.filter('a.csv', self._rules(), ROWS)),
+                         ROWS)
+
+    def test_forgotten_if_journal_edited(self):
+        journal = os.path.join(os.path.dirname(self.path), 'journal')
+        entry = '2014-09-02 TESCO\n    assets:bank  £-10\n\n'
+        with open(journal, 'w') as f:
+            f.write(entry)
+        store = self._store(journal)
+        list(store.filter('a.csv', self._rules(), ROWS))
+        with store.recording():
+            with open(journal, 'a') as f:
+                f.write(entry.replace('TESCO', 'COFFEE'))
+        with open(journal, 'a') as f:
+            f.write(entry.replace('TESCO', 'LIDL'))
+        # Appended to since: still recorded
+        self.assertEqual(list(self._store(journal).filter(
+            'a.csv', self._rules(), ROWS)), [])
+        with open(journal, 'w') as f:
+            f.write(entry)
+        # Transactions deleted
+        self.assertEqual(list(self._store(journal).filter(
+            'a.csv', self._rules(), ROWS)), ROWS)
+        self.assertEqual(list(self._store().filter(
+            'a.csv', self._rules(), ROWS)), ROWS)
+
+    def test_get_transactions(self):
+        from csv_importer import get_transactions
+        store = self._store()
+        with NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write(''.join(','.join(row) + '\n' for row in ROWS))
+        self.addCleanup(os.unlink, f.name)
+        self.assertEqual(
+            len(list(get_transactions(f.name, self._rules(),
+                                      fingerprints=store))), 3)
+        with store.recording():
+            pass
+        self.assertEqual(
+            list(get_transactions(f.name, self._rules(),
+                                  fingerprints=store)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
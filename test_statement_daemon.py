@@ -0,0 +1,161 @@
+import os
+import threading
+import time
+import unittest
+from io import StringIO
+from tempfile import TemporaryDirectory
+
+RULES = """
+skip 1
+fields date, description, amount
+currency £
+account1 assets:bank
+account2 expenses:unknown
+"""
+
+HEADER = 'Date,Description,Amount\n'
+
+
+class TestRecordEnd(unittest.TestCase):
+    def test_record_end(self):
+        from statement_daemon import record_end
+        self.assertEqual(record_end(b''), 0)
+        self.assertEqual(record_end(b'a,b\nc,'), 4)
+        self.assertEqual(record_end(b'a,b\nc,"d\ne"\n'), 12)
+        # The last newline is inside a quoted field
+        self.assertEqual(record_end(b'a,b\nc,"d\ne'), 4)
+        self.assertEqual(record_end(b'a,b\nc,"d\ne', start=4), 4)
+        self.assertEqual(record_end(b'a,b\nc,"d"', complete=True), 9)
+        self.assertEqual(record_end(b'a,b\nc,"d\ne', complete=True), 4)
+        self.assertEqual(record_end(b'a,b\n', start=4, complete=True), 4)
+
+
+class TestStatementDaemon(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = os.path.join(tmp.name, 'statements')
+        os.mkdir(self.dir)
+        self.ledger_file = os.path.join(tmp.name, 'ledger.journal')
+        self.state_file = os.path.join(tmp.name, 'state.json')
+        open(self.ledger_file, 'w').close()
+
+    def _daemon(self, rules=RULES, **kwargs):
+        from csv_rules import Rules
+        from statement_daemon import StatementDaemon
+        return StatementDaemon(self.ledger_file,
+                               lambda: Rules(StringIO(rules)), self.dir,
+                               self.state_file, **kwargs)
+
+    def _write(self, name, contents, mode='w'):
+        path = os.path.join(self.dir, name)
+        with open(path, mode) as f:
+            f.write(contents)
+        return path
+
+    def _journal(self):
+        with open(self.ledger_file) as f:
+            return [line for line in f if line[:1].isdigit()]
+
+    def test_grown_files_are_read_from_where_they_were_left(self):
+        path = self._write('a.csv', HEADER + '2014-09-01,one,1\n'
+                           '2014-09-02,"t')
+        self.assertEqual(self._daemon().ingest([path]), 1)
+        self._write('a.csv', 'wo",2\n2014-09-03,three,3\n', 'a')
+        # A new daemon carries on from the state file
+        daemon = self._daemon()
+        self.assertEqual(daemon.ingest([path]), 2)
+        self.assertEqual(daemon.ingest([path]), 0)
+        self.assertEqual(self._journal(), ['2014-09-01 one\n',
+                                           '2014-09-02 two\n',
+                                           '2014-09-03 three\n'])
+
+    def test_last_row_without_newline(self):
+        daemon = self._daemon()
+        path = self._write('a.csv', HEADER + '2014-09-01,one,1')
+        # Held back until the file is found unchanged a second time
+        self.assertEqual(daemon.ingest([path]), 0)
+        self.assertEqual(daemon.ingest([path]), 1)
+        self._write('a.csv', '\r\n2014-09-02,two,2', 'a')
+        daemon = self._daemon()
+        self.assertEqual(daemon.ingest([path]), 0)
+        self.assertEqual(daemon.ingest([path]), 1)
+        self.assertEqual(self._journal(), ['2014-09-01 one\n',
+                                           '2014-09-02 two\n'])
+
+    def test_file_grown_mid_row(self):
+        daemon = self._daemon()
+        path = self._write('a.csv', HEADER + '2014-09-01,one,1\n2014-09-02,tw')
+        self.assertEqual(daemon.ingest([path]), 1)
+        self._write('a.csv', 'o,2\n', 'a')
+        self.assertEqual(daemon.ingest([path]), 1)
+        self.assertEqual(self._journal(), ['2014-09-01 one\n',
+                                           '2014-09-02 two\n'])
+
+    def test_rewritten_files_are_read_again(self):
+        daemon = self._daemon()
+        path = self._write('a.csv', HEADER + '2014-09-01,one,1\n')
+        daemon.ingest([path])
+        self._write('a.csv', HEADER.upper() + '2014-09-01,one,1\n'
+                    '2014-09-02,two,2\n')
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(daemon.ingest([path]), 1)
+        self.assertEqual(self._journal(), ['2014-09-01 one\n',
+                                           '2014-09-02 two\n'])
+
+    def test_bad_file_does_not_stop_the_others(self):
+        daemon = self._daemon()
+        bad = self._write('a.csv', HEADER + '2014-09-01,one,1\n2014-09-02\n')
+        good = self._write('b.csv', HEADER + '2014-09-03,three,3\n')
+        with self.assertLogs(level='ERROR') as logs:
+            self.assertEqual(daemon.ingest([bad, good]), 1)
+        self.assertIn('a.csv', logs.output[0])
+        self.assertEqual(self._journal(), ['2014-09-03 three\n'])
+        with open(self.state_file) as f:
+            self.assertNotIn('a.csv', f.read())
+
+    def test_failing_balance_assertion_is_not_appended(self):
+        daemon = self._daemon(RULES.replace('amount', 'amount, balance'))
+        path = self._write('a.csv', HEADER + '2014-09-01,one,1,5\n')
+        self.assertEqual(daemon.ingest([path]), 0)
+        self.assertEqual(self._journal(), [])
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_events_are_coalesced(self):
+        from watchdog.events import FileModifiedEvent, FileMovedEvent
+        daemon = self._daemon(delay=0.1)
+        a = os.path.join(self.dir, 'a.csv')
+        b = os.path.join(self.dir, 'b.csv')
+        for _ in range(3):
+            daemon._on_event(FileModifiedEvent(a))
+        daemon._on_event(FileMovedEvent(b + '.part', b))
+        daemon._on_event(FileModifiedEvent(b + '.part'))
+        start = time.monotonic()
+        self.assertEqual(daemon._wait_for_files(), [a, b])
+        self.assertGreaterEqual(time.monotonic() - start, 0.1)
+        self.assertEqual(daemon._wait_for_files(timeout=0.2), [])
+
+    def test_run(self):
+        daemon = self._daemon(delay=0.05)
+        self._write('a.csv', HEADER + '2014-09-01,one,1\n')
+        thread = threading.Thread(target=daemon.run)
+        thread.start()
+        try:
+            for _ in range(100):
+                if self._journal():
+                    break
+                time.sleep(0.05)
+            self._write('b.csv', HEADER + '2014-09-02,two,2\n')
+            for _ in range(100):
+                if len(self._journal()) == 2:
+                    break
+                time.sleep(0.05)
+        finally:
+            daemon.stop()
+            thread.join()
+        self.assertEqual(self._journal(), ['2014-09-01 one\n',
+                                           '2014-09-02 two\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()